@@ -0,0 +1,146 @@
+'''
+Batch scoring of transaction files with the saved fraud model, in bounded memory.
+
+The file is split into ranges of chunksize rows, each read and parsed on its own. Each chunk is encoded with the
+category mappings saved by data_exploration.enumerate_series, scaled with the MinMaxNormalizer saved by the
+notebook (models/scaler.json) and scored with the saved classifier's predict_proba. The fraud probabilities are
+written into a memory-mapped .npy that is preallocated for the whole file, so memory stays flat however many
+transactions are scored. With processes > 1 a process pool parses and scores the ranges in parallel, each worker
+writing its own rows of the output. Rows must not contain quoted line breaks.
+
+Run from CreditCardFraudDetection:
+    python score.py data/transactions_201901.csv data/scores_201901.npy --model saved_model.txt \\
+        --scaler models/scaler.json --processes 4
+'''
+
+import io
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import joblib
+
+# Personal libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'common'))
+import data_exploration as dex
+import data_transformation as dt
+
+
+_model = None       # Classifier, scaler, category mappings and output scores of this (worker) process
+_scaler = None
+_mappings = None
+_positive = None    # Column of predict_proba with the positive (fraud) class
+_scores = None
+
+
+def partition_csv(path, chunksize=100000, block_size=1 << 24):
+    '''
+    Splits a csv into ranges of chunksize data rows by scanning it for line ends, without parsing
+
+    return: (header line as bytes, list of (first byte, end byte, first row, rows) per range, number of rows)
+    '''
+    with open(path, 'rb') as f:
+        header = f.readline()
+        offset = f.tell()
+        row_end = []    # Byte after the end of every chunksize-th row
+        rows = 0
+        size = offset
+        for block in iter(lambda: f.read(block_size), b''):
+            ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n')) + 1
+            row_end.extend((size + ends[(-rows - 1) % chunksize::chunksize]).tolist())
+            rows += len(ends)
+            size += len(block)
+            last = block[-1:]
+    if size > offset and last != b'\n':
+        rows += 1    # last row without a line end
+    if not row_end or row_end[-1] != size:
+        row_end.append(size)
+
+    ranges = []
+    start = offset
+    for i, stop in enumerate(row_end):
+        first_row = i * chunksize
+        if stop > start:
+            ranges.append((start, stop, first_row, min(chunksize, rows - first_row)))
+        start = stop
+    return header, ranges, rows
+
+
+def _init_worker(model_path, scaler_path, mappings, pos_label, input_path, header, output_path):
+    global _model, _scaler, _mappings, _positive, _scores
+    _model = joblib.load(model_path)
+    _scaler = dt.MinMaxNormalizer.load(scaler_path)
+    _mappings = mappings
+    _positive = int(np.flatnonzero(_model.classes_ == pos_label)[0])
+    _scores = (input_path, header, np.load(output_path, mmap_mode='r+'))
+
+
+def _score_chunk(chunk):
+    for col, mapping in _mappings.items():
+        chunk[col] = dex.apply_series_mapping(chunk[col], mapping)
+    features = _scaler.transform(chunk[_scaler.cols], inplace=True, dtype=np.float32)
+    return _model.predict_proba(features.values)[:, _positive].astype(np.float32)
+
+
+def _score_range(args):
+    # Parses, scores and writes one range of rows; returns the number of rows scored
+    start, stop, first_row, rows = args
+    input_path, header, scores = _scores
+    with open(input_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    chunk_scores = _score_chunk(pd.read_csv(io.BytesIO(header + data)))
+    if len(chunk_scores) != rows:
+        raise ValueError('Rows {0}-{1} of {2} hold {3} transactions (blank lines are not supported)'.format(
+            first_row, first_row + rows, input_path, len(chunk_scores)))
+    scores[first_row:first_row + rows] = chunk_scores
+    scores.flush()
+    return rows
+
+
+def score_file(input_path, output_path, model_path='saved_model.txt', scaler_path='models/scaler.json',
+               categorical_cols=None, mapping_dir=None, pos_label=1, chunksize=100000, processes=1):
+    '''
+    Writes the fraud probability of every transaction in a csv to a .npy file
+
+    param categorical_cols: columns to encode with the mappings saved by data_exploration.enumerate_series
+    param mapping_dir: directory containing the <column>_mapping.txt files (defaults to the working directory)
+    param processes: worker processes scoring chunks (1 scores in this process)
+
+    return: (rows scored, seconds)
+    '''
+    start = time.perf_counter()
+    mappings = {col: dex.load_series_mapping(col, mapping_dir) for col in categorical_cols or []}
+    header, ranges, num_rows = partition_csv(input_path, chunksize)
+    np.lib.format.open_memmap(output_path, 'w+', np.float32, (num_rows,)).flush()
+
+    initargs = (model_path, scaler_path, mappings, pos_label, input_path, header, output_path)
+    if processes == 1:
+        _init_worker(*initargs)
+        rows = sum(_score_range(task) for task in ranges)
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+            rows = sum(pool.imap_unordered(_score_range, ranges))
+    return rows, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a csv of transactions with the saved fraud model.')
+    parser.add_argument('transactions', help='csv with the columns the scaler was fit on')
+    parser.add_argument('output', help='.npy file of fraud probabilities (float32, one per transaction)')
+    parser.add_argument('--model', default='saved_model.txt', help='classifier saved with joblib.dump')
+    parser.add_argument('--scaler', default='models/scaler.json', help='saved MinMaxNormalizer')
+    parser.add_argument('--categorical', nargs='+', help='columns to encode with their saved mappings')
+    parser.add_argument('--mapping-dir', help='directory of the <column>_mapping.txt files')
+    parser.add_argument('--pos-label', type=int, default=1, help='class whose probability is written')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='transactions scored at a time')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes')
+    args = parser.parse_args()
+
+    rows, seconds = score_file(args.transactions, args.output, args.model, args.scaler, args.categorical,
+                               args.mapping_dir, args.pos_label, args.chunk_size, args.processes)
+    print('Scored {0} transactions in {1:.1f}s ({2:,.0f} transactions/sec)'.format(
+        rows, seconds, rows / seconds if seconds else 0.))
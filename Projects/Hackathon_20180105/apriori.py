@@ -0,0 +1,429 @@
+'''
+In-process association rule mining, replacing the mba SQL scripts (NSets.sql / sp_UpdateNSetRules.sql).
+
+Reads the same (TransactionId, ItemId) data prepared in 0_DataPreparation.ipynb (e.g. Instacart's
+order_products__prior.csv) and builds the same tables, with the same columns, thresholds and definitions:
+
+    Support:    Supp(A) = (# transactions containing A) / (# total transactions)
+    Confidence: Conf(B|A) = Supp(A,B) / Supp(A)
+    Lift:       Lift(B|A) = Conf(B|A) / Supp(A)    (as defined in sp_UpdateNSetRules.sql)
+
+Instead of a CROSS JOIN + self-join pass over every transaction per level, counting is vectorized:
+    - items are counted with one bincount
+    - pairs are counted at once with a sparse product X^T X of the (transactions x frequent items) matrix
+    - larger sets are mined depth-first (Eclat) on vertical tid-list bitmaps: the transactions containing
+      an itemset are the AND of its items' bitmaps, and its support is the popcount of that bitmap
+
+Sets of any size are mined (max_size limits them). Rules are built for every frequent N-set and every choice of
+NextItem, with the basket items sorted ascending (the order sp_GetRecommendedItem looks them up in).
+
+Run from Hackathon_20180105:
+    python apriori.py data/order_products__prior.csv --products data/products.csv --output data/mba
+'''
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+MIN_SUPPORT = .005      # Used to filter out unpopular items or outliers and save on computation
+MIN_CONFIDENCE = .010   # Used to filter out any rules that are not compelling enough
+
+FORMAT_NAME = 'mba-transactions'
+FORMAT_VERSION = 1
+ARRAYS = ['indptr', 'items', 'item_ids']
+
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(words):
+        '''Number of set bits in each row of a uint64 array.'''
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+else:
+    _BYTE_BITS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        '''Number of set bits in each row of a uint64 array.'''
+        return _BYTE_BITS[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+class Transactions:
+    '''
+    Baskets in compressed sparse row form: the items of transaction t are items[indptr[t]:indptr[t + 1]], as
+    codes into item_ids. item_ids is sorted ascending, so sorted codes are sorted ItemIds. Repeated items within
+    a transaction are counted once.
+
+    save() writes the arrays as a small JSON header plus one .npy file per array, so load() can open them
+    memory-mapped:
+        <base>.json             format and sizes
+        <base>.indptr.npy       offsets of each transaction's items (transactions + 1)
+        <base>.items.npy        item codes, grouped by transaction, ascending within each
+        <base>.item_ids.npy     ItemId of each item code, ascending
+    '''
+    def __init__(self, indptr, items, item_ids):
+        self.indptr = indptr
+        self.items = items
+        self.item_ids = item_ids
+
+    @classmethod
+    def from_pairs(cls, transaction_ids, item_ids, all_item_ids=None):
+        '''
+        Builds the baskets from (TransactionId, ItemId) lines in any order
+
+        param transaction_ids: array of TransactionIds, one per line
+        param item_ids: array of ItemIds, one per line
+        param all_item_ids: sorted array of every ItemId to code items against (defaults to those in item_ids)
+        '''
+        item_ids = np.asarray(item_ids)
+        if all_item_ids is None:
+            item_codes, unique_items = pd.factorize(item_ids, sort=True)
+        else:
+            unique_items = np.asarray(all_item_ids)
+            item_codes = np.minimum(np.searchsorted(unique_items, item_ids), len(unique_items) - 1)
+            if (unique_items[item_codes] != item_ids).any():
+                raise ValueError('item_ids has ItemIds missing from all_item_ids')
+        transaction_codes, unique_transactions = pd.factorize(np.asarray(transaction_ids))
+
+        # Sort lines by (transaction, item) and drop repeats
+        num_items = max(len(unique_items), 1)
+        keys = transaction_codes.astype(np.int64) * num_items + item_codes
+        keys.sort()
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        transaction_codes, item_codes = np.divmod(keys, num_items)
+
+        counts = np.bincount(transaction_codes, minlength=len(unique_transactions))
+        indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(indptr, item_codes.astype(np.int32), np.asarray(unique_items))
+
+    @classmethod
+    def from_csv(cls, path, transaction_column='order_id', item_column='product_id'):
+        '''Reads the baskets from a csv of transaction lines (by default Instacart's order_products files).'''
+        df = pd.read_csv(path, usecols=[transaction_column, item_column],
+                         dtype={transaction_column: np.int64, item_column: np.int64})
+        return cls.from_pairs(df[transaction_column].values, df[item_column].values)
+
+    @classmethod
+    def load(cls, base_path, mmap=True):
+        '''Opens baskets written by save(), memory-mapped by default.'''
+        with open(base_path + '.json', 'r') as f:
+            header = json.loads(f.readline())
+        if header.get('format') != FORMAT_NAME or header.get('version') != FORMAT_VERSION:
+            raise ValueError("Unsupported file format: {0} v{1}".format(header.get('format'), header.get('version')))
+
+        arrays = {name: np.load('{0}.{1}.npy'.format(base_path, name), mmap_mode='r' if mmap else None)
+                  for name in ARRAYS}
+        if len(arrays['indptr']) != header['num_transactions'] + 1 or len(arrays['items']) != header['num_lines']:
+            raise ValueError("Transaction arrays do not match the header's sizes.")
+        return cls(arrays['indptr'], arrays['items'], arrays['item_ids'])
+
+    def save(self, base_path):
+        for name in ARRAYS:
+            np.save('{0}.{1}.npy'.format(base_path, name), getattr(self, name))
+        write_header(base_path, self.num_transactions, len(self.items), len(self.item_ids))
+
+    @property
+    def num_transactions(self):
+        return len(self.indptr) - 1
+
+    def slice(self, start, stop):
+        '''Transactions start..stop-1 (sharing the item codes; a view of memory-mapped items).'''
+        indptr = np.asarray(self.indptr[start:stop + 1])
+        return Transactions(indptr - indptr[0], self.items[indptr[0]:indptr[-1]], self.item_ids)
+
+    def item_counts(self):
+        '''Number of transactions containing each item code.'''
+        return np.bincount(self.items, minlength=len(self.item_ids))
+
+    def matrix(self, codes):
+        '''
+        Sparse indicator matrix (transactions x len(codes)) of which transactions contain the given item codes
+
+        param codes: sorted array of item codes; column j of the result is codes[j]
+        '''
+        columns = np.full(len(self.item_ids), -1, dtype=np.int64)
+        columns[codes] = np.arange(len(codes))
+        keep = columns[self.items] >= 0
+
+        rows = np.repeat(np.arange(self.num_transactions), np.diff(self.indptr))[keep]
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns[self.items][keep])),
+                                 shape=(self.num_transactions, len(codes)))
+
+    def bitmaps(self, codes):
+        '''
+        Vertical tid-lists as bitmaps: row j has bit t set when transaction t contains item codes[j]
+
+        return: uint64 array (len(codes) x ceil(num_transactions / 64))
+        '''
+        by_item = self.matrix(codes).tocsc()
+        num_bytes = -(-self.num_transactions // 64) * 8
+        bits = np.zeros(len(codes) * num_bytes, dtype=np.uint8)
+
+        tids = by_item.indices.astype(np.int64)
+        rows = np.repeat(np.arange(len(codes), dtype=np.int64), np.diff(by_item.indptr))
+        np.bitwise_or.at(bits, rows * num_bytes + (tids >> 3), (1 << (tids & 7)).astype(np.uint8))
+        return bits.view(np.uint64).reshape(len(codes), -1)
+
+
+def write_header(base_path, num_transactions, num_lines, num_items):
+    header = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'num_transactions': int(num_transactions),
+        'num_lines': int(num_lines),
+        'num_items': int(num_items),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    with open(base_path + '.json', 'w+') as f:
+        f.write(json.dumps(header))
+
+
+def frequent_itemsets(transactions, min_support=MIN_SUPPORT, max_size=None):
+    '''
+    Finds every itemset contained in at least min_support of the transactions
+
+    param transactions: Transactions
+    param min_support: minimum Supp(itemset), as a fraction of all transactions
+    param max_size: largest itemset size to mine (None for no limit)
+
+    return: dict of size N -> (array (n x N) of ItemIds, each row ascending; array (n,) of transaction counts)
+    '''
+    total = transactions.num_transactions
+    item_ids = transactions.item_ids
+
+    def is_frequent(counts):
+        return counts / total >= min_support
+
+    # 1-sets
+    counts = transactions.item_counts()
+    frequent = np.flatnonzero(is_frequent(counts))
+    itemsets = {1: (item_ids[frequent][:, np.newaxis], counts[frequent])}
+    if max_size == 1 or len(frequent) < 2:
+        return itemsets
+
+    # 2-sets: co-occurrence counts of every pair of frequent items (indices into frequent) at once
+    X = transactions.matrix(frequent)
+    pair_counts = sparse.triu(X.T.dot(X), k=1).tocoo()
+    keep = is_frequent(pair_counts.data)
+    first, second, counts = pair_counts.row[keep], pair_counts.col[keep], pair_counts.data[keep]
+    order = np.lexsort((second, first))
+    first, second, counts = first[order], second[order], counts[order]
+    itemsets[2] = (item_ids[frequent][np.column_stack((first, second))], counts.astype(np.int64))
+    if max_size == 2 or len(counts) == 0:
+        return itemsets
+
+    # 3+-sets: depth-first over prefixes, extending each by the frequent items after its last item
+    is_pair = np.zeros((len(frequent), len(frequent)), dtype=bool)
+    is_pair[first, second] = True
+    involved = np.unique(np.concatenate((first, second)))
+    bitmap_row = np.full(len(frequent), -1, dtype=np.int64)
+    bitmap_row[involved] = np.arange(len(involved))
+    bitmaps = transactions.bitmaps(frequent[involved])
+
+    found = {}
+
+    def extend(prefix, extensions, extension_bitmaps):
+        # extensions: items e (ascending) such that prefix + [e] is frequent; extension_bitmaps: their bitmaps
+        size = len(prefix) + 2
+        for i in range(len(extensions) - 1):
+            candidates = np.arange(i + 1, len(extensions))
+            candidates = candidates[is_pair[extensions[i], extensions[candidates]]]
+            if len(candidates) == 0:
+                continue
+
+            joint = extension_bitmaps[candidates] & extension_bitmaps[i]
+            counts = _popcount(joint)
+            keep = is_frequent(counts)
+            if not keep.any():
+                continue
+
+            new_prefix = prefix + [extensions[i]]
+            new_extensions = extensions[candidates[keep]]
+            sets, set_counts = found.setdefault(size, ([], []))
+            sets.append(np.column_stack((np.tile(new_prefix, (len(new_extensions), 1)), new_extensions)))
+            set_counts.append(counts[keep])
+            if max_size is None or size < max_size:
+                extend(new_prefix, new_extensions, joint[keep])
+
+    starts = np.concatenate(([0], np.cumsum(np.bincount(first, minlength=len(frequent)))))
+    for item in np.unique(first):
+        extensions = second[starts[item]:starts[item + 1]]
+        extend([item], extensions, bitmaps[bitmap_row[extensions]] & bitmaps[bitmap_row[item]])
+
+    for size in sorted(found):
+        sets = np.concatenate(found[size][0])
+        counts = np.concatenate(found[size][1])
+        order = np.lexsort(sets.T[::-1])
+        itemsets[size] = (item_ids[frequent][sets[order]], counts[order])
+    return itemsets
+
+
+def count_itemsets(transactions, itemsets, block_size=2 ** 22):
+    '''
+    Counts the transactions containing each of the given itemsets
+
+    param transactions: Transactions
+    param itemsets: dict of size N -> array (n x N) of ItemIds
+    param block_size: max uint64 words of intersected bitmaps held at once
+
+    return: dict of size N -> array (n,) of transaction counts (0 for sets with unknown items)
+    '''
+    item_ids = transactions.item_ids
+    codes = {}
+    known = {}
+    for size, sets in itemsets.items():
+        positions = np.minimum(np.searchsorted(item_ids, sets), max(len(item_ids) - 1, 0))
+        known[size] = (item_ids[positions] == sets).all(axis=1) if len(item_ids) else np.zeros(len(sets), bool)
+        codes[size] = positions
+
+    counts = {size: np.zeros(len(sets), dtype=np.int64) for size, sets in itemsets.items()}
+    if 1 in itemsets:
+        counts[1][known[1]] = transactions.item_counts()[codes[1][known[1], 0]]
+
+    larger = [size for size in itemsets if size > 1 and known[size].any()]
+    if not larger:
+        return counts
+    involved = np.unique(np.concatenate([codes[size][known[size]].ravel() for size in larger]))
+    bitmaps = transactions.bitmaps(involved)
+    rows = {size: np.searchsorted(involved, codes[size]) for size in larger}
+
+    rows_per_block = max(1, block_size // max(bitmaps.shape[1], 1))
+    for size in larger:
+        sets = np.flatnonzero(known[size])
+        for start in range(0, len(sets), rows_per_block):
+            block = sets[start:start + rows_per_block]
+            joint = bitmaps[rows[size][block, 0]] & bitmaps[rows[size][block, 1]]
+            for column in range(2, size):
+                joint &= bitmaps[rows[size][block, column]]
+            counts[size][block] = _popcount(joint)
+    return counts
+
+
+def row_positions(rows, lookup_rows):
+    '''Position of each row of a 2D array among the rows of lookup_rows (-1 when missing).'''
+    lookup = pd.MultiIndex.from_arrays(list(lookup_rows.T))
+    return lookup.get_indexer(pd.MultiIndex.from_arrays(list(rows.T)))
+
+
+def support_tables(itemsets, num_transactions):
+    '''
+    Formats frequent itemsets as the mba.Set_N_Support tables
+
+    return: dict of table name -> DataFrame of ItemId1..ItemIdN and Support
+    '''
+    tables = {}
+    for size, (sets, counts) in sorted(itemsets.items()):
+        if size == 1:
+            df = pd.DataFrame({'ItemId': sets[:, 0]})
+        else:
+            df = pd.DataFrame(sets, columns=['ItemId{0}'.format(i + 1) for i in range(size)])
+        df['Support'] = counts / num_transactions
+        tables['Set_{0}_Support'.format(size)] = df
+    return tables
+
+
+def rule_tables(itemsets, num_transactions, min_confidence=MIN_CONFIDENCE, item_names=None):
+    '''
+    Builds the mba.Set_N_Confidence rule tables: for every frequent N-set and each of its items as NextItem, the
+    rule (other N - 1 items, ascending) -> NextItem, kept when its Confidence is at least min_confidence
+
+    param itemsets: dict returned by frequent_itemsets
+    param num_transactions: total number of transactions
+    param min_confidence: minimum Conf(NextItem | basket items)
+    param item_names: optional Series of ItemName indexed by ItemId (the Product table); adds the name columns
+
+    return: dict of table name -> DataFrame, sorted by basket items then NextItem
+    '''
+    tables = {}
+    for size in sorted(itemsets):
+        if size < 2 or size - 1 not in itemsets:
+            continue
+        sets, counts = itemsets[size]
+        basket_sets, basket_counts = itemsets[size - 1]
+
+        baskets, next_items, joint_counts, antecedent_counts = [], [], [], []
+        for position in range(size):
+            basket = np.delete(sets, position, axis=1)
+            baskets.append(basket)
+            next_items.append(sets[:, position])
+            joint_counts.append(counts)
+            antecedent_counts.append(basket_counts[row_positions(basket, basket_sets)])
+        baskets = np.concatenate(baskets)
+        next_items = np.concatenate(next_items)
+        joint_counts = np.concatenate(joint_counts)
+        antecedent_counts = np.concatenate(antecedent_counts)
+
+        joint_support = joint_counts / num_transactions
+        basket_support = antecedent_counts / num_transactions
+        confidence = joint_counts / antecedent_counts
+        keep = confidence >= min_confidence
+        baskets, next_items = baskets[keep], next_items[keep]
+        joint_support, basket_support, confidence = joint_support[keep], basket_support[keep], confidence[keep]
+        order = np.lexsort((next_items,) + tuple(baskets.T[::-1]))
+
+        basket_columns = ['BasketItem{0}'.format(i + 1) for i in range(size - 1)]
+        df = pd.DataFrame(baskets[order], columns=[column + '_Id' for column in basket_columns])
+        df['NextItem_Id'] = next_items[order]
+        if item_names is not None:
+            for column in basket_columns + ['NextItem']:
+                df[column] = item_names.reindex(df[column + '_Id']).values
+        df['Confidence'] = confidence[order]
+        df['JointSupport' if size == 2 else 'Set_{0}_Support'.format(size)] = joint_support[order]
+        df['BasketItem1_Support'] = basket_support[order]
+        df['Lift'] = confidence[order] / basket_support[order]
+        tables['Set_{0}_Confidence'.format(size)] = df
+    return tables
+
+
+def mine(transactions, min_support=MIN_SUPPORT, min_confidence=MIN_CONFIDENCE, max_size=None, item_names=None):
+    '''
+    Mines frequent itemsets and rules (the work of sp_UpdateNSetRules)
+
+    return: dict of table name -> DataFrame with the Set_N_Support and Set_N_Confidence tables
+    '''
+    itemsets = frequent_itemsets(transactions, min_support, max_size)
+    tables = support_tables(itemsets, transactions.num_transactions)
+    tables.update(rule_tables(itemsets, transactions.num_transactions, min_confidence, item_names))
+    return tables
+
+
+def read_item_names(path, id_column='product_id', name_column='product_name'):
+    '''Reads the Product table (ItemId -> ItemName) from a csv such as Instacart's products.csv.'''
+    df = pd.read_csv(path, usecols=[id_column, name_column])
+    return df.set_index(id_column)[name_column]
+
+
+def write_tables(tables, directory):
+    '''Writes each table to <directory>/<table name>.csv.'''
+    os.makedirs(directory, exist_ok=True)
+    for name, df in tables.items():
+        df.to_csv(os.path.join(directory, name + '.csv'), index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mine association rules from a csv of transaction lines.')
+    parser.add_argument('transactions', help='csv with one (transaction, item) line per row')
+    parser.add_argument('--transaction-column', default='order_id')
+    parser.add_argument('--item-column', default='product_id')
+    parser.add_argument('--products', help='csv of item names (product_id, product_name)')
+    parser.add_argument('--min-support', type=float, default=MIN_SUPPORT)
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE)
+    parser.add_argument('--max-size', type=int, default=None)
+    parser.add_argument('--output', default='data/mba', help='directory to write the tables to')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    transactions = Transactions.from_csv(args.transactions, args.transaction_column, args.item_column)
+    item_names = read_item_names(args.products) if args.products else None
+    loaded = time.perf_counter()
+
+    tables = mine(transactions, args.min_support, args.min_confidence, args.max_size, item_names)
+    mined = time.perf_counter()
+    write_tables(tables, args.output)
+
+    print('Loaded {0} transactions in {1:.1f}s; mined in {2:.1f}s'.format(
+        transactions.num_transactions, loaded - start, mined - loaded))
+    for name, df in tables.items():
+        print('{0}: {1} rows'.format(name, len(df)))
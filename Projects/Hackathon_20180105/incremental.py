@@ -0,0 +1,280 @@
+'''
+Incremental maintenance of association rules as new transactions arrive (FUP-style), instead of rebuilding the
+support tables from scratch like sp_UpdateNSetRules.sql.
+
+Exact counts are kept for the frequent sets and those near the threshold, down to border_support (< min_support).
+Every set that is not tracked is known to occur in at most untracked_max transactions. Each new batch is:
+    1) counted against the tracked itemsets (exact counts grow by the batch counts)
+    2) mined on its own, for the sets in at least batch_count of its transactions. batch_count is the count that
+       keeps untracked_max at border_support of all transactions, but never below min_count: mining a small batch
+       at a relative threshold would make every subset of every basket "frequent". A set found in the batch but
+       not tracked occurred at most untracked_max times before; it is kept with that upper bound. Sets not found
+       occur at most untracked_max + batch_count - 1 times, the new untracked_max.
+    3) Only sets whose upper bound reaches min_support are re-counted over the stored history. Sets that fall
+       below border_support are dropped, since untracked_max is (all but) never below it.
+
+untracked_max stays below min_support of all transactions, so every set with support >= min_support is tracked with
+its exact count, and the rule tables are refreshed from them in time proportional to the batch (plus the rare
+re-counts), not the full history. While batch_count can't be at least min_count without breaking that (at the
+start, or after many small batches), batches are buffered and mined together once there are enough transactions;
+until then the tables only count them against the sets already tracked.
+
+The state lives in a directory:
+    state.json              thresholds, transaction counts, history segments and segments still to be mined
+    state.npz               tracked sets and counts, bounded sets and upper bounds, per size
+    segment_NNNNN.*         each batch of transactions (apriori.Transactions format), for re-counts
+
+Run from Hackathon_20180105:
+    python incremental.py data/mba/state data/order_products__prior.csv --output data/mba
+    python incremental.py data/mba/state data/order_products__train.csv --output data/mba
+'''
+
+import os
+import math
+import json
+import time
+import argparse
+import numpy as np
+from apriori import (Transactions, MIN_SUPPORT, MIN_CONFIDENCE, frequent_itemsets, count_itemsets, row_positions,
+                     support_tables, rule_tables, read_item_names, write_tables)
+
+
+def _sort_rows(sets, values):
+    order = np.lexsort(sets.T[::-1])
+    return sets[order], values[order]
+
+
+class IncrementalMiner:
+    '''
+    Frequent itemset counts maintained across batches of transactions
+
+    tracked: dict of size N -> (array (n x N) of ItemIds, array (n,) of exact transaction counts)
+    bounded: dict of size N -> (array (n x N) of ItemIds, array (n,) of upper bounds on their counts)
+    untracked_max: most transactions any set that is not tracked occurs in
+    pending: segments added but not mined yet (buffered until a batch can be mined at min_count)
+    '''
+    border_support = MIN_SUPPORT / 2
+    min_count = 10      # Fewest transactions of a batch a set must occur in to be mined from it
+
+    def __init__(self, directory, min_support=MIN_SUPPORT, min_confidence=MIN_CONFIDENCE, border_support=None,
+                 max_size=None, chunk_size=500000, min_count=None):
+        self.directory = directory
+        self.min_support = min_support
+        self.min_confidence = min_confidence
+        self.border_support = min_support / 2 if border_support is None else border_support
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.min_count = IncrementalMiner.min_count if min_count is None else min_count
+        self.num_transactions = 0
+        self.untracked_max = 0
+        self.segments = []
+        self.pending = []
+        self.tracked = {}
+        self.bounded = {}
+        self.recounted = 0
+
+    def update(self, transactions):
+        '''
+        Adds a batch of transactions and updates the counts
+
+        param transactions: apriori.Transactions of the new batch
+
+        return: self
+        '''
+        total = self.num_transactions + transactions.num_transactions
+
+        # 1) Batch counts of every tracked and bounded set
+        for family in (self.tracked, self.bounded):
+            counts = count_itemsets(transactions, {size: sets for size, (sets, values) in family.items()})
+            for size, (sets, values) in family.items():
+                family[size] = (sets, values + counts[size])
+
+        self.num_transactions = total
+        self.pending.append(self._save_segment(transactions))
+
+        # 2) Sets in at least batch_count transactions of the batch (and of any buffered before it), as large as
+        # the frequent sets allow, and at least the count that keeps untracked_max at border_support
+        most = math.floor(self.min_support * total - self.untracked_max)
+        if most < self.min_count:
+            return self
+        batch_count = min(max(math.ceil(self.border_support * total) - self.untracked_max, self.min_count), most)
+        batch = transactions if len(self.pending) == 1 else self._load_pending()
+
+        local = frequent_itemsets(batch, batch_count / batch.num_transactions, self.max_size)
+        for size, (sets, counts) in local.items():
+            new = np.ones(len(sets), dtype=bool)
+            for family in (self.tracked, self.bounded):
+                if size in family:
+                    new &= row_positions(sets, family[size][0]) < 0
+            if not new.any():
+                continue
+            if self.untracked_max == 0:
+                self._add(self.tracked, size, sets[new], counts[new])
+            else:
+                self._add(self.bounded, size, sets[new], counts[new] + self.untracked_max)
+        self.untracked_max += batch_count - 1
+        self.pending = []
+
+        # 3) Re-count sets that may have reached min_support; forget those below border_support (and untracked_max)
+        min_kept = min(self.border_support * total, self.untracked_max + 1)
+        self._drop(self.tracked, min_kept)
+        self._drop(self.bounded, min_kept)
+        near = {}
+        for size, (sets, bounds) in list(self.bounded.items()):
+            recount = bounds / total >= self.min_support
+            if recount.any():
+                near[size] = sets[recount]
+                self.bounded[size] = (sets[~recount], bounds[~recount])
+        if near:
+            counts = self.count_history(near)
+            for size, sets in near.items():
+                self.recounted += len(sets)
+                self._add(self.tracked, size, sets, counts[size])
+            self._drop(self.tracked, min_kept)
+        return self
+
+    def _add(self, family, size, sets, values):
+        if size in family:
+            sets = np.concatenate((family[size][0], sets))
+            values = np.concatenate((family[size][1], values))
+        family[size] = _sort_rows(sets, values)
+
+    def _drop(self, family, min_count):
+        for size, (sets, values) in list(family.items()):
+            keep = values >= min_count
+            if keep.all():
+                continue
+            if keep.any():
+                family[size] = (sets[keep], values[keep])
+            else:
+                del family[size]
+
+    def count_history(self, itemsets):
+        '''Exact counts of itemsets over every stored batch, chunk_size transactions at a time.'''
+        counts = {size: np.zeros(len(sets), dtype=np.int64) for size, sets in itemsets.items()}
+        for segment in self.segments:
+            transactions = Transactions.load(os.path.join(self.directory, segment))
+            for start in range(0, transactions.num_transactions, self.chunk_size):
+                chunk = transactions.slice(start, min(start + self.chunk_size, transactions.num_transactions))
+                for size, chunk_counts in count_itemsets(chunk, itemsets).items():
+                    counts[size] += chunk_counts
+        return counts
+
+    def frequent_itemsets(self):
+        '''Sets with support >= min_support, in the format of apriori.frequent_itemsets.'''
+        itemsets = {}
+        for size, (sets, counts) in sorted(self.tracked.items()):
+            keep = counts / self.num_transactions >= self.min_support
+            if keep.any():
+                itemsets[size] = (sets[keep], counts[keep].astype(np.int64))
+        return itemsets
+
+    def tables(self, item_names=None):
+        '''The Set_N_Support and Set_N_Confidence tables of all transactions so far.'''
+        itemsets = self.frequent_itemsets()
+        tables = support_tables(itemsets, self.num_transactions)
+        tables.update(rule_tables(itemsets, self.num_transactions, self.min_confidence, item_names))
+        return tables
+
+    def _save_segment(self, transactions):
+        os.makedirs(self.directory, exist_ok=True)
+        segment = 'segment_{0:05d}'.format(len(self.segments))
+        transactions.save(os.path.join(self.directory, segment))
+        self.segments.append(segment)
+        return segment
+
+    def _load_pending(self):
+        # The buffered segments as one batch (they are small, or they would have been mined on their own)
+        transaction_ids, item_ids = [], []
+        first = 0
+        for segment in self.pending:
+            transactions = Transactions.load(os.path.join(self.directory, segment), mmap=False)
+            sizes = np.diff(transactions.indptr)
+            transaction_ids.append(first + np.repeat(np.arange(len(sizes)), sizes))
+            item_ids.append(transactions.item_ids[transactions.items])
+            first += len(sizes)
+        return Transactions.from_pairs(np.concatenate(transaction_ids), np.concatenate(item_ids))
+
+    def save(self):
+        '''Writes the counts state (the segments are written as batches arrive).'''
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {}
+        for name, family in (('tracked', self.tracked), ('bounded', self.bounded)):
+            for size, (sets, values) in family.items():
+                arrays['{0}_sets_{1}'.format(name, size)] = sets
+                arrays['{0}_values_{1}'.format(name, size)] = values
+        np.savez(os.path.join(self.directory, 'state.npz'), **arrays)
+
+        header = {
+            'min_support': self.min_support,
+            'min_confidence': self.min_confidence,
+            'border_support': self.border_support,
+            'max_size': self.max_size,
+            'chunk_size': self.chunk_size,
+            'min_count': self.min_count,
+            'num_transactions': self.num_transactions,
+            'untracked_max': self.untracked_max,
+            'segments': self.segments,
+            'pending': self.pending,
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        with open(os.path.join(self.directory, 'state.json'), 'w+') as f:
+            f.write(json.dumps(header))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'state.json'), 'r') as f:
+            header = json.loads(f.readline())
+        miner = cls(directory, header['min_support'], header['min_confidence'], header['border_support'],
+                    header['max_size'], header['chunk_size'], header.get('min_count'))
+        miner.num_transactions = header['num_transactions']
+        miner.segments = header['segments']
+        miner.pending = header.get('pending', [])
+        # States saved before untracked_max was kept mined every batch at border_support
+        miner.untracked_max = header.get('untracked_max',
+                                         max(math.ceil(miner.border_support * miner.num_transactions) - 1, 0))
+
+        with np.load(os.path.join(directory, 'state.npz')) as data:
+            for name in data.files:
+                family, kind, size = name.rsplit('_', 2)
+                if kind == 'sets':
+                    getattr(miner, family)[int(size)] = (data[name], data['{0}_values_{1}'.format(family, size)])
+        return miner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add a batch of transactions and refresh the rule tables.')
+    parser.add_argument('state', help='state directory (created on the first batch)')
+    parser.add_argument('transactions', help='csv with one (transaction, item) line per row')
+    parser.add_argument('--transaction-column', default='order_id')
+    parser.add_argument('--item-column', default='product_id')
+    parser.add_argument('--products', help='csv of item names (product_id, product_name)')
+    parser.add_argument('--min-support', type=float, default=MIN_SUPPORT, help='used when creating the state')
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE, help='used when creating the state')
+    parser.add_argument('--border-support', type=float, help='used when creating the state (default: half)')
+    parser.add_argument('--max-size', type=int, default=None, help='used when creating the state')
+    parser.add_argument('--min-count', type=int, help='used when creating the state (default: {0})'.format(
+        IncrementalMiner.min_count))
+    parser.add_argument('--output', default='data/mba', help='directory to write the tables to')
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.state, 'state.json')):
+        miner = IncrementalMiner.load(args.state)
+    else:
+        miner = IncrementalMiner(args.state, args.min_support, args.min_confidence, args.border_support,
+                                 args.max_size, min_count=args.min_count)
+
+    start = time.perf_counter()
+    batch = Transactions.from_csv(args.transactions, args.transaction_column, args.item_column)
+    miner.update(batch)
+    miner.save()
+    item_names = read_item_names(args.products) if args.products else None
+    tables = miner.tables(item_names)
+    write_tables(tables, args.output)
+
+    print('Added {0} transactions ({1} in total) in {2:.1f}s; re-counted {3} sets over the history'.format(
+        batch.num_transactions, miner.num_transactions, time.perf_counter() - start, miner.recounted))
+    if miner.pending:
+        print('{0} batches are buffered until there are enough transactions to mine them'.format(len(miner.pending)))
+    for name, df in tables.items():
+        print('{0}: {1} rows'.format(name, len(df)))
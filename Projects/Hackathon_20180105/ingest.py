@@ -0,0 +1,228 @@
+'''
+Bulk loading of the market basket datasets into a local SQLite database, replacing the to_sql -> SQL Server cells of
+0_DataPreparation.ipynb (which need a live server and insert row by row).
+
+Each source is streamed in chunks of lines, shaped into the same tables and columns as the notebook (TransactionId,
+LineId, ItemId, ...), and inserted with executemany, batch_size rows per transaction, into a database in WAL mode.
+Tables are loaded without indexes; the keys and indexes of IndexTables.sql are built once at the end. The rows/sec
+of every table is reported so the nightly loads can be sized.
+
+Transaction files must have each transaction's lines together (as the Instacart and bakery files do); a
+transaction split across chunks is carried over to the next chunk.
+
+Run from Hackathon_20180105:
+    python ingest.py data/mba.sqlite --order-products data/order_products__prior.csv data/order_products__train.csv \\
+        --products data/products.csv --batch-size 100000
+'''
+
+import time
+import sqlite3
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+from apriori import Transactions
+
+
+TABLES = {
+    'ProductTransaction': [('TransactionId', 'INTEGER'), ('LineId', 'INTEGER'), ('ItemId', 'INTEGER'),
+                           ('AddToCartOrder', 'INTEGER'), ('Reordered', 'INTEGER')],
+    'ProductTransactionTrain': [('TransactionId', 'INTEGER'), ('LineId', 'INTEGER'), ('ItemId', 'INTEGER'),
+                                ('AddToCartOrder', 'INTEGER'), ('Reordered', 'INTEGER')],
+    'Product': [('ItemId', 'INTEGER'), ('ItemName', 'TEXT'), ('AisleId', 'INTEGER'), ('DepartmentId', 'INTEGER')],
+    'TransactionsByDept': [('TransactionId', 'INTEGER'), ('LineId', 'INTEGER'), ('Department', 'TEXT'),
+                           ('ItemId', 'INTEGER'), ('SalesUnits', 'INTEGER')],
+    'BakeryTransaction': [('TransactionId', 'INTEGER'), ('LineId', 'INTEGER'), ('ItemId', 'INTEGER')],
+    'BakeryItem': [('ItemId', 'INTEGER'), ('ItemName', 'TEXT')]
+}
+
+# Keys and indexes of IndexTables.sql: (TransactionId, LineId) keys and ItemId lookups, ItemId keys of item tables
+INDEXES = {table: [('PK_' + table, True, ['TransactionId', 'LineId']),
+                   ('IX_{0}_ItemId'.format(table), False, ['ItemId'])]
+           for table in ['ProductTransaction', 'ProductTransactionTrain', 'TransactionsByDept', 'BakeryTransaction']}
+INDEXES.update({table: [('PK_' + table, True, ['ItemId'])] for table in ['Product', 'BakeryItem']})
+
+
+def connect(path):
+    '''Opens the database in WAL mode, with commits that only sync at checkpoints.'''
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('PRAGMA cache_size=-262144')
+    return connection
+
+
+def _grouped(chunks, column):
+    # Re-cuts DataFrame chunks so no value of column spans two of them (lines must be grouped by column)
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat((carry, chunk), ignore_index=True)
+        values = chunk[column].values
+        split = np.flatnonzero(values != values[-1])
+        split = split[-1] + 1 if len(split) else 0
+        carry = chunk.iloc[split:]
+        if split:
+            yield chunk.iloc[:split]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _number_lines(chunk, sort_columns):
+    # LineId: position of each line within its transaction after sorting, starting at 1
+    chunk = chunk.sort_values(sort_columns, kind='stable')
+    chunk.insert(1, 'LineId', chunk.groupby('TransactionId', sort=False).cumcount().values + 1)
+    return chunk
+
+
+def read_order_products(path, chunksize=500000):
+    '''Instacart order_products__*.csv -> ProductTransaction chunks, lines sorted by ItemId within each order.'''
+    chunks = pd.read_csv(path, chunksize=chunksize)
+    for chunk in _grouped((chunk.set_axis(['TransactionId', 'ItemId', 'AddToCartOrder', 'Reordered'], axis=1)
+                           for chunk in chunks), 'TransactionId'):
+        yield _number_lines(chunk, ['TransactionId', 'ItemId'])
+
+
+def read_products(path, chunksize=500000):
+    '''Instacart products.csv -> Product chunks.'''
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        yield chunk.set_axis(['ItemId', 'ItemName', 'AisleId', 'DepartmentId'], axis=1)
+
+
+def read_transactions_by_dept(path, chunksize=500000):
+    '''
+    transactions_by_dept.csv -> TransactionsByDept chunks. TransactionIds are renumbered 1, 2, ... in order of
+    appearance (the notebook's numbering when the file is sorted by TransactionId).
+    '''
+    numbers = {}
+    chunks = pd.read_csv(path, chunksize=chunksize)
+    for chunk in _grouped((chunk.set_axis(['TransactionId', 'Department', 'ItemId', 'SalesUnits'], axis=1)
+                           for chunk in chunks), 'TransactionId'):
+        for transaction_id in pd.unique(chunk['TransactionId']):
+            numbers.setdefault(transaction_id, len(numbers) + 1)
+        chunk = chunk.assign(TransactionId=chunk['TransactionId'].map(numbers))
+        yield _number_lines(chunk, ['TransactionId', 'ItemId'])[['TransactionId', 'LineId', 'Department', 'ItemId',
+                                                                 'SalesUnits']]
+
+
+def read_bakery_receipts(path, chunksize=100000):
+    '''
+    Extended bakery receipts ("ReceiptID, ItemID_1, ..., ItemID_N" per line) -> BakeryTransaction chunks, with
+    LineIds in receipt order.
+    '''
+    with open(path, 'r') as f:
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            fields = [line.strip().split(', ') for line in lines]
+            sizes = np.array([len(receipt) - 1 for receipt in fields])
+            transaction_ids = np.repeat([int(receipt[0]) for receipt in fields], sizes)
+            item_ids = np.array([int(item) for receipt in fields for item in receipt[1:]], dtype=np.int64)
+            line_ids = np.arange(len(item_ids)) - np.repeat(np.cumsum(sizes) - sizes, sizes) + 1
+            yield pd.DataFrame({'TransactionId': transaction_ids, 'LineId': line_ids, 'ItemId': item_ids})
+
+
+def read_bakery_items(path):
+    '''
+    Extended bakery goods ("insert into goods values (0,'Chocolate','Cake',8.95,'Food');" per line) -> BakeryItem,
+    named "<flavor> <food>" without quotes.
+    '''
+    with open(path, 'r') as f:
+        items = [line.split('(')[1].split(',')[0:-2] for line in f if '(' in line]
+    yield pd.DataFrame({'ItemId': [int(item[0]) for item in items],
+                        'ItemName': ['{0} {1}'.format(item[1], item[2]).replace("'", '') for item in items]})
+
+
+def load_table(connection, table, chunks, batch_size=100000, replace=True):
+    '''
+    Inserts DataFrame chunks into a table with executemany, committing every batch_size rows
+
+    param replace: drop and recreate the table (and its indexes) first, like to_sql(if_exists='replace')
+
+    return: (rows inserted, seconds)
+    '''
+    columns = TABLES[table]
+    if replace:
+        connection.execute('DROP TABLE IF EXISTS {0}'.format(table))
+    connection.execute('CREATE TABLE IF NOT EXISTS {0} ({1})'.format(
+        table, ', '.join('{0} {1}'.format(name, kind) for name, kind in columns)))
+    insert = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+        table, ', '.join(name for name, kind in columns), ', '.join('?' * len(columns)))
+
+    start = time.perf_counter()
+    rows = 0
+    for chunk in chunks:
+        # Python scalars per column (tolist) are much faster to bind than numpy scalars or itertuples
+        values = list(zip(*(chunk[name].tolist() for name, kind in columns)))
+        for batch in range(0, len(values), batch_size):
+            with connection:
+                connection.executemany(insert, values[batch:batch + batch_size])
+        rows += len(values)
+    return rows, time.perf_counter() - start
+
+
+def build_indexes(connection, table):
+    '''Creates the keys and indexes of IndexTables.sql for a table; returns the seconds taken.'''
+    start = time.perf_counter()
+    with connection:
+        for name, unique, columns in INDEXES[table]:
+            connection.execute('CREATE {0}INDEX IF NOT EXISTS {1} ON {2} ({3})'.format(
+                'UNIQUE ' if unique else '', name, table, ', '.join(columns)))
+    connection.execute('ANALYZE {0}'.format(table))
+    return time.perf_counter() - start
+
+
+def read_transactions(connection, table='ProductTransaction', chunksize=1000000):
+    '''Reads a transaction table back as apriori.Transactions, for mining from the database.'''
+    chunks = pd.read_sql_query('SELECT TransactionId, ItemId FROM {0}'.format(table), connection, chunksize=chunksize)
+    pairs = pd.concat(chunks, ignore_index=True)
+    return Transactions.from_pairs(pairs['TransactionId'].values, pairs['ItemId'].values)
+
+
+def ingest(connection, table, sources, batch_size=100000):
+    '''Loads one or more sources into a table, builds its indexes and prints the load rate.'''
+    def chunks():
+        for source in sources:
+            for chunk in source:
+                yield chunk
+
+    rows, seconds = load_table(connection, table, chunks(), batch_size)
+    index_seconds = build_indexes(connection, table)
+    print('{0}: {1} rows in {2:.1f}s ({3:,.0f} rows/sec); indexes in {4:.1f}s'.format(
+        table, rows, seconds, rows / seconds if seconds else 0., index_seconds))
+    return rows, seconds, index_seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the market basket datasets into a SQLite database.')
+    parser.add_argument('database')
+    parser.add_argument('--order-products', nargs='+', help='order_products csvs -> ProductTransaction')
+    parser.add_argument('--order-products-train', help='order_products__train.csv -> ProductTransactionTrain')
+    parser.add_argument('--products', help='products.csv -> Product')
+    parser.add_argument('--transactions-by-dept', help='transactions_by_dept.csv -> TransactionsByDept')
+    parser.add_argument('--bakery-receipts', help='75000-out1.csv -> BakeryTransaction')
+    parser.add_argument('--bakery-goods', help='EB-build-goods.sql -> BakeryItem')
+    parser.add_argument('--batch-size', type=int, default=100000, help='rows per insert transaction')
+    parser.add_argument('--chunk-size', type=int, default=500000, help='csv lines read at a time')
+    args = parser.parse_args()
+
+    connection = connect(args.database)
+    if args.order_products:
+        ingest(connection, 'ProductTransaction',
+               [read_order_products(path, args.chunk_size) for path in args.order_products], args.batch_size)
+    if args.order_products_train:
+        ingest(connection, 'ProductTransactionTrain', [read_order_products(args.order_products_train,
+                                                                           args.chunk_size)], args.batch_size)
+    if args.products:
+        ingest(connection, 'Product', [read_products(args.products, args.chunk_size)], args.batch_size)
+    if args.transactions_by_dept:
+        ingest(connection, 'TransactionsByDept', [read_transactions_by_dept(args.transactions_by_dept,
+                                                                            args.chunk_size)], args.batch_size)
+    if args.bakery_receipts:
+        ingest(connection, 'BakeryTransaction', [read_bakery_receipts(args.bakery_receipts, args.chunk_size)],
+               args.batch_size)
+    if args.bakery_goods:
+        ingest(connection, 'BakeryItem', [read_bakery_items(args.bakery_goods)], args.batch_size)
+    connection.close()
@@ -0,0 +1,200 @@
+'''
+Partitioned, multi-process association rule mining (SON) for transaction logs too large to mine in one pass.
+
+    1) The log is streamed from csv once into memory-mappable arrays (apriori.Transactions format), one chunk
+       of lines at a time.
+    2) The transactions are split into equal partitions of at most chunk_size transactions. A process pool mines
+       each partition with apriori.frequent_itemsets at the same relative min_support; the union of these locally
+       frequent sets is the candidate set (a set frequent overall is frequent in at least one partition).
+    3) A second pass over the partitions counts every candidate exactly (apriori.count_itemsets); candidates
+       frequent overall are the result, so the rule tables match single-process mining.
+
+Workers open the arrays memory-mapped and only touch their own partition, so peak memory is bounded by the
+chunk size rather than the log size.
+
+Run from Hackathon_20180105:
+    python partitioned.py data/order_products__prior.csv --store data/mba/order_products__prior --processes 4
+'''
+
+import os
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from apriori import (Transactions, MIN_SUPPORT, MIN_CONFIDENCE, frequent_itemsets, count_itemsets, support_tables,
+                     rule_tables, read_item_names, write_tables, write_header)
+
+
+_transactions = None    # Memory-mapped transactions shared with pool workers
+_candidates = None      # Candidate itemsets counted by pool workers
+
+
+def _read_baskets(path, transaction_column, item_column, chunksize):
+    '''
+    Streams (transaction ids, item ids) arrays of whole transactions from a csv, chunksize lines at a time. Lines
+    must be grouped by transaction (as in the order_products files); the last transaction of each chunk is held
+    back until the next one, since it may continue there.
+    '''
+    carry = None
+    for chunk in pd.read_csv(path, usecols=[transaction_column, item_column], chunksize=chunksize,
+                             dtype={transaction_column: np.int64, item_column: np.int64}):
+        transaction_ids = chunk[transaction_column].values
+        item_ids = chunk[item_column].values
+        if carry is not None:
+            transaction_ids = np.concatenate((carry[0], transaction_ids))
+            item_ids = np.concatenate((carry[1], item_ids))
+
+        split = np.flatnonzero(transaction_ids != transaction_ids[-1])
+        split = split[-1] + 1 if len(split) else 0
+        carry = transaction_ids[split:], item_ids[split:]
+        if split:
+            yield transaction_ids[:split], item_ids[:split]
+    if carry is not None:
+        yield carry
+
+
+def convert_csv(path, base_path, transaction_column='order_id', item_column='product_id', chunksize=1000000):
+    '''
+    Converts a csv of transaction lines into the arrays of Transactions.save(), holding one chunk at a time
+
+    Two passes: the first finds every ItemId and the output sizes, the second codes and writes each chunk into
+    memory-mapped output arrays.
+
+    return: memory-mapped Transactions
+    '''
+    item_ids = np.array([], dtype=np.int64)
+    num_transactions = num_lines = 0
+    for transaction_ids, items in _read_baskets(path, transaction_column, item_column, chunksize):
+        chunk = Transactions.from_pairs(transaction_ids, items)
+        item_ids = np.union1d(item_ids, chunk.item_ids)
+        num_transactions += chunk.num_transactions
+        num_lines += len(chunk.items)
+
+    indptr = np.lib.format.open_memmap(base_path + '.indptr.npy', 'w+', np.int64, (num_transactions + 1,))
+    codes = np.lib.format.open_memmap(base_path + '.items.npy', 'w+', np.int32, (num_lines,))
+    np.save(base_path + '.item_ids.npy', item_ids)
+
+    indptr[0] = 0
+    transaction = line = 0
+    for transaction_ids, items in _read_baskets(path, transaction_column, item_column, chunksize):
+        chunk = Transactions.from_pairs(transaction_ids, items, item_ids)
+        indptr[transaction + 1:transaction + chunk.num_transactions + 1] = chunk.indptr[1:] + line
+        codes[line:line + len(chunk.items)] = chunk.items
+        transaction += chunk.num_transactions
+        line += len(chunk.items)
+    indptr.flush()
+    codes.flush()
+
+    write_header(base_path, num_transactions, num_lines, len(item_ids))
+    return Transactions.load(base_path)
+
+
+def _init_worker(base_path, candidates=None):
+    global _transactions, _candidates
+    _transactions = Transactions.load(base_path)
+    _candidates = candidates
+
+
+def _mine_partition(args):
+    start, stop, min_support, max_size = args
+    itemsets = frequent_itemsets(_transactions.slice(start, stop), min_support, max_size)
+    return {size: sets for size, (sets, counts) in itemsets.items()}
+
+
+def _count_partition(args):
+    start, stop = args
+    return count_itemsets(_transactions.slice(start, stop), _candidates)
+
+
+def _run(function, tasks, processes, initargs):
+    if processes == 1:
+        _init_worker(*initargs)
+        return [function(task) for task in tasks]
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+        return list(pool.imap_unordered(function, tasks))
+
+
+def frequent_itemsets_partitioned(base_path, min_support=MIN_SUPPORT, max_size=None, chunk_size=500000,
+                                  processes=None):
+    '''
+    Finds every itemset contained in at least min_support of the transactions saved at base_path, mining
+    partitions of chunk_size transactions in a process pool
+
+    param processes: worker processes (defaults to the CPU count; 1 mines in this process)
+
+    return: same as apriori.frequent_itemsets
+    '''
+    total = Transactions.load(base_path).num_transactions
+    # Partitions of equal size (at most chunk_size): a small last partition would be mined at a count of a few
+    # transactions, enumerating nearly every subset of its baskets
+    bounds = np.linspace(0, total, -(-total // chunk_size) + 1).astype(np.int64)
+    partitions = [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+    processes = processes or os.cpu_count() or 1
+
+    # Pass 1: union of the locally frequent itemsets of each partition
+    local = _run(_mine_partition, [partition + (min_support, max_size) for partition in partitions], processes,
+                 (base_path,))
+    candidates = {}
+    for size in sorted({size for itemsets in local for size in itemsets}):
+        sets = np.concatenate([itemsets[size] for itemsets in local if size in itemsets])
+        candidates[size] = np.unique(sets, axis=0)
+
+    # Pass 2: exact counts of every candidate over all partitions
+    counts = {size: np.zeros(len(sets), dtype=np.int64) for size, sets in candidates.items()}
+    for partition_counts in _run(_count_partition, partitions, processes, (base_path, candidates)):
+        for size in counts:
+            counts[size] += partition_counts[size]
+
+    itemsets = {}
+    for size in sorted(candidates):
+        keep = counts[size] / total >= min_support
+        if keep.any():
+            itemsets[size] = (candidates[size][keep], counts[size][keep])
+    return itemsets
+
+
+def mine_partitioned(base_path, min_support=MIN_SUPPORT, min_confidence=MIN_CONFIDENCE, max_size=None,
+                     item_names=None, chunk_size=500000, processes=None):
+    '''
+    Partitioned equivalent of apriori.mine for transactions saved at base_path
+
+    return: dict of table name -> DataFrame with the Set_N_Support and Set_N_Confidence tables
+    '''
+    total = Transactions.load(base_path).num_transactions
+    itemsets = frequent_itemsets_partitioned(base_path, min_support, max_size, chunk_size, processes)
+    tables = support_tables(itemsets, total)
+    tables.update(rule_tables(itemsets, total, min_confidence, item_names))
+    return tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mine association rules from a large transaction log.')
+    parser.add_argument('transactions', help='csv with one (transaction, item) line per row, grouped by transaction')
+    parser.add_argument('--store', required=True, help='base path of the memory-mapped transaction arrays')
+    parser.add_argument('--reload', action='store_true', help='rebuild the arrays even if the store exists')
+    parser.add_argument('--transaction-column', default='order_id')
+    parser.add_argument('--item-column', default='product_id')
+    parser.add_argument('--products', help='csv of item names (product_id, product_name)')
+    parser.add_argument('--min-support', type=float, default=MIN_SUPPORT)
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE)
+    parser.add_argument('--max-size', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=500000, help='transactions per partition')
+    parser.add_argument('--processes', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('--output', default='data/mba', help='directory to write the tables to')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.reload or not os.path.exists(args.store + '.json'):
+        convert_csv(args.transactions, args.store, args.transaction_column, args.item_column)
+    item_names = read_item_names(args.products) if args.products else None
+    loaded = time.perf_counter()
+
+    tables = mine_partitioned(args.store, args.min_support, args.min_confidence, args.max_size, item_names,
+                              args.chunk_size, args.processes)
+    mined = time.perf_counter()
+    write_tables(tables, args.output)
+
+    print('Prepared transactions in {0:.1f}s; mined in {1:.1f}s'.format(loaded - start, mined - loaded))
+    for name, df in tables.items():
+        print('{0}: {1} rows'.format(name, len(df)))
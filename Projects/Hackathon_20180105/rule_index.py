@@ -0,0 +1,285 @@
+'''
+In-memory index of association rules for "next item" recommendations, replacing mba.sp_GetRecommendedItem.
+
+sp_GetRecommendedItem only answers baskets of 1 or 2 items, from one Set_N_Confidence table per size. RuleIndex
+puts the rules of every size in one prefix trie keyed by the sorted basket ItemIds; the node of a basket holds its
+NextItems ranked by Confidence (then Lift), so a lookup is one hash probe per basket item. Baskets of any size are
+answered without a database round trip; when a basket is not itself a rule antecedent, the largest subsets of it
+that are answer instead.
+
+The trie is stored as flat arrays, which are also its serialized form (a compressed .npz):
+    item_ids        ItemId of each item code, ascending
+    edge_keys       parent node * num_items + child item code of every edge, ascending
+    edge_children   child node of each edge
+    rule_ptr        rules of node n are rule_items[rule_ptr[n]:rule_ptr[n + 1]], best first
+    rule_items, rule_confidence, rule_lift
+
+Build from the tables written by apriori.py / partitioned.py (run from Hackathon_20180105):
+    python rule_index.py build data/mba --output data/mba/rule_index.npz
+    python rule_index.py query data/mba/rule_index.npz 13176 21137
+'''
+
+import os
+import re
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from apriori import row_positions
+
+
+FORMAT_NAME = 'mba-rule-index'
+FORMAT_VERSION = 1
+
+
+class RuleIndex:
+    '''
+    Prefix trie of rule antecedents (node 0 is the empty basket) with the ranked NextItems of each
+    '''
+    def __init__(self, item_ids, edge_keys, edge_children, rule_ptr, rule_items, rule_confidence, rule_lift):
+        self.item_ids = item_ids
+        self.edge_keys = edge_keys
+        self.edge_children = edge_children
+        self.rule_ptr = rule_ptr
+        self.rule_items = rule_items
+        self.rule_confidence = rule_confidence
+        self.rule_lift = rule_lift
+
+        # Single baskets walk the trie through hash lookups of ItemId -> code and edge key -> child node
+        num_nodes = len(rule_ptr) - 1
+        self.num_items = max(len(item_ids), 1)
+        self.item_codes = {item: code for code, item in enumerate(item_ids.tolist())}
+        self.children = dict(zip(edge_keys.tolist(), edge_children.tolist()))
+        self.num_rules = np.diff(rule_ptr).tolist()
+
+        # Longest antecedent: propagate depths down the edges until they stop changing
+        depth = np.zeros(num_nodes, dtype=np.int64)
+        parents = edge_keys // self.num_items
+        while True:
+            updated = depth.copy()
+            updated[edge_children] = depth[parents] + 1
+            if np.array_equal(updated, depth):
+                break
+            depth = updated
+        self.max_depth = int(depth.max())
+
+    @classmethod
+    def from_tables(cls, tables):
+        '''
+        Builds the index from rule tables
+
+        param tables: iterable of Set_N_Confidence DataFrames (BasketItem1_Id.., NextItem_Id, Confidence, Lift)
+        '''
+        tables = [df for df in tables if len(df)]
+        item_ids = np.unique(np.concatenate(
+            [df[[c for c in df.columns if c.endswith('_Id')]].values.ravel() for df in tables] or [[]]))
+        item_ids = item_ids.astype(np.int64)
+
+        # Antecedents (as sorted item codes) and rules of each basket size
+        antecedents, rules = {}, []
+        for df in tables:
+            columns = sorted((c for c in df.columns if re.match(r'BasketItem\d+_Id$', c)),
+                             key=lambda c: int(re.findall(r'\d+', c)[0]))
+            codes = np.sort(np.searchsorted(item_ids, df[columns].values), axis=1)
+            antecedents.setdefault(len(columns), []).append(codes)
+            rules.append((codes, np.searchsorted(item_ids, df['NextItem_Id'].values),
+                          df['Confidence'].values, df['Lift'].values))
+        max_depth = max(antecedents) if antecedents else 0
+
+        # Nodes: the distinct prefixes of every antecedent, numbered by depth then prefix
+        prefixes = {0: np.zeros((1, 0), dtype=np.int64)}
+        first_node = {0: 0}
+        num_nodes = 1
+        for depth in range(1, max_depth + 1):
+            sets = [codes[:, :depth] for size, group in antecedents.items() if size >= depth for codes in group]
+            prefixes[depth] = np.unique(np.concatenate(sets), axis=0)
+            first_node[depth] = num_nodes
+            num_nodes += len(prefixes[depth])
+
+        edge_keys, edge_children = [], []
+        for depth in range(1, max_depth + 1):
+            parents = first_node[depth - 1] + (
+                row_positions(prefixes[depth][:, :-1], prefixes[depth - 1]) if depth > 1 else 0)
+            edge_keys.append(parents * len(item_ids) + prefixes[depth][:, -1])
+            edge_children.append(first_node[depth] + np.arange(len(prefixes[depth])))
+        edge_keys = np.concatenate(edge_keys or [[]]).astype(np.int64)
+        edge_children = np.concatenate(edge_children or [[]]).astype(np.int32)
+        order = np.argsort(edge_keys)
+        edge_keys, edge_children = edge_keys[order], edge_children[order]
+
+        # Rules, grouped by antecedent node and ranked by Confidence, then Lift, then ItemId
+        nodes, items, confidence, lift = [], [], [], []
+        for codes, next_items, rule_confidence, rule_lift in rules:
+            depth = codes.shape[1]
+            nodes.append(first_node[depth] + row_positions(codes, prefixes[depth]))
+            items.append(next_items)
+            confidence.append(rule_confidence)
+            lift.append(rule_lift)
+        nodes = np.concatenate(nodes or [[]]).astype(np.int64)
+        items = np.concatenate(items or [[]]).astype(np.int32)
+        confidence = np.concatenate(confidence or [[]]).astype(np.float32)
+        lift = np.concatenate(lift or [[]]).astype(np.float32)
+        order = np.lexsort((items, -lift, -confidence, nodes))
+        rule_ptr = np.concatenate(([0], np.cumsum(np.bincount(nodes, minlength=num_nodes)))).astype(np.int64)
+
+        return cls(item_ids, edge_keys, edge_children, rule_ptr, items[order], confidence[order], lift[order])
+
+    @classmethod
+    def from_directory(cls, directory):
+        '''Builds the index from the Set_N_Confidence.csv tables written by apriori.write_tables.'''
+        names = [name for name in os.listdir(directory) if re.match(r'Set_\d+_Confidence\.csv$', name)]
+        return cls.from_tables(pd.read_csv(os.path.join(directory, name)) for name in names)
+
+    def save(self, path):
+        np.savez_compressed(path, format=np.array(FORMAT_NAME), version=np.array(FORMAT_VERSION),
+                            item_ids=self.item_ids, edge_keys=self.edge_keys, edge_children=self.edge_children,
+                            rule_ptr=self.rule_ptr, rule_items=self.rule_items,
+                            rule_confidence=self.rule_confidence, rule_lift=self.rule_lift)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if str(data['format']) != FORMAT_NAME or int(data['version']) != FORMAT_VERSION:
+                raise ValueError("Unsupported file format: {0} v{1}".format(data['format'], data['version']))
+            return cls(data['item_ids'], data['edge_keys'], data['edge_children'], data['rule_ptr'],
+                       data['rule_items'], data['rule_confidence'], data['rule_lift'])
+
+    def _codes(self, basket):
+        # Sorted item codes of the basket's known items, and whether every item was known
+        codes = [self.item_codes.get(int(item), -1) for item in set(basket)]
+        known = sorted(code for code in codes if code >= 0)
+        return known, len(known) == len(codes)
+
+    def _walk(self, codes):
+        # Node reached by the sorted codes, or -1
+        node = 0
+        for code in codes:
+            node = self.children.get(node * self.num_items + code, -1)
+            if node < 0:
+                break
+        return node
+
+    def find(self, basket):
+        '''Node of the basket (an antecedent prefix), or -1 when no rule antecedent starts with it.'''
+        codes, known = self._codes(basket)
+        return self._walk(codes) if known else -1
+
+    def _rules(self, node, num_recs):
+        start, stop = self.rule_ptr[node], min(self.rule_ptr[node + 1], self.rule_ptr[node] + num_recs)
+        return list(zip(self.item_ids[self.rule_items[start:stop]].tolist(),
+                        self.rule_confidence[start:stop].tolist()))
+
+    def _fallback(self, codes, num_recs):
+        # Merged NextItems of the largest subsets of codes with rules, skipping items already in the basket
+        by_depth = {}
+        stack = [(0, 0, 0)]
+        while stack:
+            node, start, depth = stack.pop()
+            for index in range(start, len(codes)):
+                child = self.children.get(node * self.num_items + codes[index], -1)
+                if child < 0:
+                    continue
+                if self.num_rules[child]:
+                    by_depth.setdefault(depth + 1, []).append(child)
+                if depth + 1 < self.max_depth:
+                    stack.append((child, index + 1, depth + 1))
+
+        basket = set(codes)
+        for depth in sorted(by_depth, reverse=True):
+            # Best rule per NextItem, ranked as in the trie
+            best = {}
+            for node in by_depth[depth]:
+                start, stop = self.rule_ptr[node], self.rule_ptr[node + 1]
+                for item, confidence, lift in zip(self.rule_items[start:stop].tolist(),
+                                                  self.rule_confidence[start:stop].tolist(),
+                                                  self.rule_lift[start:stop].tolist()):
+                    rank = (-confidence, -lift, item)
+                    if item not in basket and rank < best.get(item, (np.inf,)):
+                        best[item] = rank
+            if best:
+                ranked = sorted(best.values())[:num_recs]
+                return [(int(self.item_ids[item]), -confidence) for confidence, lift, item in ranked]
+        return []
+
+    def recommend(self, basket, num_recs=10):
+        '''
+        Recommends next items for a basket of any size
+
+        Uses the rules whose antecedent is the whole basket; when there are none, merges the rules of the largest
+        subsets of the basket that have some (keeping each NextItem's best rule, and skipping items already in
+        the basket).
+
+        param basket: iterable of ItemIds
+        param num_recs: max number of items to return
+
+        return: list of (NextItem_Id, Confidence), best first
+        '''
+        codes, known = self._codes(basket)
+        if known and codes:
+            node = self._walk(codes)
+            if node > 0 and self.num_rules[node]:
+                return self._rules(node, num_recs)
+        return self._fallback(codes, num_recs)
+
+    def recommend_batch(self, baskets, num_recs=10):
+        '''
+        Recommends next items for many baskets at once
+
+        The trie is walked for all baskets of the same size together, one vectorized lookup per level; only
+        baskets without an exact match fall back to subsets one at a time. Repeated baskets are answered once.
+
+        return: list of recommend() results, one per basket
+        '''
+        keys = [tuple(sorted(set(int(item) for item in basket))) for basket in baskets]
+        if len(self.item_ids) == 0:
+            return [[] for key in keys]
+        unique = list(dict.fromkeys(keys))
+        results = {}
+
+        by_size = {}
+        for basket in unique:
+            by_size.setdefault(len(basket), []).append(basket)
+        for size, group in by_size.items():
+            items = np.array(group, dtype=np.int64).reshape(len(group), size)
+            positions = np.minimum(np.searchsorted(self.item_ids, items), len(self.item_ids) - 1)
+            nodes = np.where((self.item_ids[positions] == items).all(axis=1) & (size > 0), 0, -1)
+            for column in range(size):
+                walking = np.flatnonzero(nodes >= 0)
+                edge_keys = nodes[walking] * self.num_items + positions[walking, column]
+                edges = np.minimum(np.searchsorted(self.edge_keys, edge_keys), len(self.edge_keys) - 1)
+                nodes[walking] = np.where(self.edge_keys[edges] == edge_keys, self.edge_children[edges], -1)
+
+            for basket, node in zip(group, nodes):
+                if node > 0 and self.num_rules[node]:
+                    results[basket] = self._rules(node, num_recs)
+                else:
+                    results[basket] = self._fallback(self._codes(basket)[0], num_recs)
+        return [results[key] for key in keys]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the basket rule index.')
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build', help='index the Set_N_Confidence.csv tables of a directory')
+    build.add_argument('directory')
+    build.add_argument('--output', default='data/mba/rule_index.npz')
+    query = commands.add_parser('query', help='recommend next items for a basket')
+    query.add_argument('index')
+    query.add_argument('items', type=int, nargs='+')
+    query.add_argument('--num-recs', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        index = RuleIndex.from_directory(args.directory)
+        index.save(args.output)
+        print('Indexed {0} rules in {1:.1f}s'.format(len(index.rule_items), time.perf_counter() - start))
+    elif args.command == 'query':
+        index = RuleIndex.load(args.index)
+        start = time.perf_counter()
+        recommendations = index.recommend(args.items, args.num_recs)
+        print('Looked up in {0:.0f}us'.format((time.perf_counter() - start) * 1e6))
+        for item, confidence in recommendations:
+            print('{0}\t{1:.4f}'.format(item, confidence))
+    else:
+        parser.print_help()
@@ -0,0 +1,73 @@
+import time
+import numpy as np
+from apriori import Transactions, frequent_itemsets
+from incremental import IncrementalMiner
+
+
+def _random_batch(rng, first_id, num_transactions, num_items=200, big_basket=None):
+    # Baskets of 1-12 items with a few popular items, optionally with one very large basket
+    sizes = rng.randint(1, 13, num_transactions)
+    if big_basket:
+        sizes[0] = big_basket
+    popularity = 1. / np.arange(1, num_items + 1)
+    transaction_ids, item_ids = [], []
+    for transaction, size in enumerate(sizes):
+        items = rng.choice(num_items, size, replace=False, p=popularity / popularity.sum()) + 1
+        transaction_ids.extend([first_id + transaction] * size)
+        item_ids.extend(items)
+    return Transactions.from_pairs(np.array(transaction_ids), np.array(item_ids))
+
+
+def _as_dict(itemsets):
+    return {tuple(row): count for size, (sets, counts) in itemsets.items() for row, count in zip(sets.tolist(), counts)}
+
+
+def _concatenate(batches):
+    transaction_ids, item_ids = [], []
+    for number, batch in enumerate(batches):
+        sizes = np.diff(batch.indptr)
+        transaction_ids.append(number * 10 ** 6 + np.repeat(np.arange(len(sizes)), sizes))
+        item_ids.append(batch.item_ids[batch.items])
+    return Transactions.from_pairs(np.concatenate(transaction_ids), np.concatenate(item_ids))
+
+
+def test_small_batches_match_full_mining(tmp_path):
+    rng = np.random.RandomState(0)
+    miner = IncrementalMiner(str(tmp_path), min_support=.02, min_confidence=.1)
+
+    # A 30-order batch with a 22-item basket must not be mined at a count of 1 (4M subsets)
+    batches = [_random_batch(rng, 0, 30, big_basket=22)]
+    start = time.perf_counter()
+    miner.update(batches[0])
+    assert time.perf_counter() - start < 5
+    assert miner.pending and miner.frequent_itemsets() == {}
+
+    sizes = [30, 400, 20, 25, 1000, 15, 600, 10, 40, 500]
+    for number, size in enumerate(sizes):
+        batches.append(_random_batch(rng, (number + 1) * 10000, size, big_basket=22 if size < 50 else None))
+        miner.update(batches[-1])
+        if miner.pending:
+            continue
+        expected = _as_dict(frequent_itemsets(_concatenate(batches), miner.min_support))
+        assert _as_dict(miner.frequent_itemsets()) == expected
+        assert miner.untracked_max < miner.min_support * miner.num_transactions
+
+    assert not miner.pending
+    assert time.perf_counter() - start < 60
+
+
+def test_save_and_load_keep_buffered_batches(tmp_path):
+    rng = np.random.RandomState(1)
+    miner = IncrementalMiner(str(tmp_path), min_support=.02)
+    batches = [_random_batch(rng, 0, 20), _random_batch(rng, 100, 20)]
+    for batch in batches:
+        miner.update(batch)
+    miner.save()
+
+    loaded = IncrementalMiner.load(str(tmp_path))
+    assert loaded.pending == miner.pending and loaded.untracked_max == miner.untracked_max
+    batches.append(_random_batch(rng, 200, 800))
+    loaded.update(batches[-1])
+    assert not loaded.pending
+    expected = _as_dict(frequent_itemsets(_concatenate(batches), loaded.min_support))
+    assert _as_dict(loaded.frequent_itemsets()) == expected
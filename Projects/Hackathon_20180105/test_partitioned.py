@@ -0,0 +1,26 @@
+import time
+import numpy as np
+from apriori import Transactions, mine
+from partitioned import mine_partitioned
+
+
+def test_large_basket_in_tail_partition_matches_single_process(tmp_path):
+    # 3000 small orders, then one 22-item order that would be alone in a 1-transaction tail partition
+    rng = np.random.RandomState(0)
+    sizes = np.append(rng.randint(1, 6, 3000), 22)
+    popularity = 1. / np.arange(1, 101)
+    transaction_ids = np.repeat(np.arange(len(sizes)), sizes)
+    item_ids = np.concatenate([rng.choice(100, size, replace=False, p=popularity / popularity.sum()) + 1
+                               for size in sizes])
+    transactions = Transactions.from_pairs(transaction_ids, item_ids)
+    base_path = str(tmp_path / 'orders')
+    transactions.save(base_path)
+
+    start = time.perf_counter()
+    tables = mine_partitioned(base_path, min_support=.01, min_confidence=.1, chunk_size=3000, processes=1)
+    assert time.perf_counter() - start < 10
+
+    expected = mine(transactions, min_support=.01, min_confidence=.1)
+    assert sorted(tables) == sorted(expected)
+    for name in expected:
+        assert tables[name].equals(expected[name]), name
@@ -9,6 +9,7 @@ import pandas as pd
 import json
 import random
 import copy
+from Projects.ReinforcmentLearning.PolicyStore import CompactQTable, CompactPolicy
 
 
 class Action:
@@ -23,6 +24,7 @@ class QTable:
     gamma = .9
 
     def __init__(self, alpha: float, gamma: float):
+        self.table = {}
         self.alpha = alpha
         self.gamma = gamma
 
@@ -55,6 +57,12 @@ class QTable:
         with open(file_name, 'w+') as f:
             f.write(json.dumps(policy, sort_keys=True))
 
+    def export_compact(self, base_path: str):
+        CompactQTable.from_q_table(self.table).save(base_path)
+
+    def export_compact_policy(self, base_path: str):
+        CompactPolicy.from_policy(self.get_policy()).save(base_path)
+
     def get_policy(self):
         policy = {}
         for state in self.table:
@@ -130,7 +138,7 @@ class HistoryTable:
     table = {}  # key: state_index, value: {key: state_str, value: {actions}}
 
     def __init__(self):
-        pass
+        self.table = {}
 
     def add(self, state: State, action: str):
         if state.state_index not in self.table:
@@ -151,7 +159,7 @@ class AssetTable:
     table = {}  # key: state_index, value: {key: state_str, value: Portfolio}
 
     def __init__(self):
-        pass
+        self.table = {}
 
     def add_or_update(self, state: State, portfolio: Portfolio):
         if state.state_index not in self.table:
@@ -203,8 +211,10 @@ class DynaQLearner:
         self.initial_cash = initial_cash
         self.p_explore = p_explore
 
-        self.q_table.alpha = alpha
-        self.q_table.gamma = gamma
+        # Each learner gets its own tables rather than sharing the class-level defaults
+        self.q_table = QTable(alpha, gamma)
+        self.history_table = HistoryTable()
+        self.asset_table = AssetTable()
 
         self.initialize_state()
         self.asset_table.add_or_update(self.state, self.portfolio)
@@ -351,3 +361,9 @@ class DynaQLearner:
 
     def export_policy(self, file_name: str):
         self.q_table.export_policy(file_name)
+
+    def export_compact_q_table(self, base_path: str):
+        self.q_table.export_compact(base_path)
+
+    def export_compact_policy(self, base_path: str):
+        self.q_table.export_compact_policy(base_path)
@@ -1,8 +1,8 @@
 import pandas as pd
-import json
 import copy
 import matplotlib.pyplot as plt
 from Projects.ReinforcmentLearning.DynaQLearner import Action, Portfolio
+from Projects.ReinforcmentLearning.Policy import as_policy
 
 
 class MarketSimulator:
@@ -14,16 +14,18 @@ class MarketSimulator:
     portfolio = None
     moves = {}
     state_index = 0
+    unknown_states = 0
 
     def __init__(self,
                  market_df: pd.DataFrame,
                  price_df: pd.DataFrame,
-                 policy: dict,
+                 policy,
                  initial_cash: int = 5):
         self.market_df = market_df
         self.price_df = price_df
         self.policy = policy
         self.initial_cash = initial_cash
+        self.moves = {}
         # self.validate_data()
         self.initial_portfolio = Portfolio(self.initial_cash, 0, 0, self.price_df)
         self.portfolio = copy.deepcopy(self.initial_portfolio)
@@ -38,33 +40,45 @@ class MarketSimulator:
                                  "Policy must be trained on a dataset with same metadata.")
 
     def run(self):
-        for index, row in self.market_df.iterrows():
-            # Initializing state
-            state = copy.deepcopy(row)
-            update_state_assets(state, self.portfolio)
-            state_str = json.dumps(state.to_dict(), sort_keys=True)
-
-            # Get action and adjust assets based on action
-            try:
-                action = self.policy[state_str]
-                if action == Action.BUY or action == Action.SELL:
-                    self.moves[index] = (self.state_index, action)
-                    self.portfolio.apply_action(self.state_index, action, self.price_df)
-            except IndexError:
-                # Known IndexError occurs because portfolio.apply_action() increments state index
-                if self.state_index == self.price_df.size - 1:
-                    pass
-                else:
-                    raise IndexError('Unexpected IndexError')
-            except KeyError:
-                # If state not found, do nothing
-                pass
-
+        policy = as_policy(self.policy)
+
+        # The market features are fixed, so the policy is evaluated once per position (holding cash/holding stock)
+        # over the whole frame; only the choice between the two depends on the portfolio as the simulation runs
+        cash_states = self.market_df.copy()
+        cash_states['hasCash'] = True
+        cash_states['hasStock'] = False
+        stock_states = self.market_df.copy()
+        stock_states['hasCash'] = False
+        stock_states['hasStock'] = True
+
+        cash_actions = policy(cash_states)
+        stock_actions = policy(stock_states)
+
+        self.unknown_states = 0
+        for i, index in enumerate(self.market_df.index):
+            action = cash_actions[i] if self.portfolio.stock == 0 else stock_actions[i]
+            if action is None:
+                # If the policy has no action for this state, do nothing
+                self.unknown_states += 1
+            else:
+                self.take_action(index, action)
             self.state_index += 1
 
         self.portfolio.calculate_portfolio_value(self.state_index - 1, self.price_df)
         print(self.results())
 
+    def take_action(self, index, action: str):
+        try:
+            if action == Action.BUY or action == Action.SELL:
+                self.moves[index] = (self.state_index, action)
+                self.portfolio.apply_action(self.state_index, action, self.price_df)
+        except IndexError:
+            # Known IndexError occurs because portfolio.apply_action() increments state index
+            if self.state_index == self.price_df.size - 1:
+                pass
+            else:
+                raise IndexError('Unexpected IndexError')
+
     def results(self):
         result_str = "Policy results:"
         result_str += "\n\tInitial Portfolio:\t" + str(self.initial_portfolio)
@@ -73,6 +87,7 @@ class MarketSimulator:
                       str(percentage_gain(self.price_df.iloc[0]['close'], self.price_df.iloc[-1]['close']))
         result_str += "\n\tPolicy performance: \t" + \
                       str(percentage_gain(self.initial_portfolio.value, self.portfolio.value))
+        result_str += "\n\tStates without an action: \t" + str(self.unknown_states)
         return result_str
 
     def plot_moves(self):
@@ -0,0 +1,164 @@
+'''
+Policy interface used by MarketSimulator.
+
+A policy is any callable that takes a batch of states as a pd.DataFrame (one row per state, with the same columns the
+learners key on, including hasCash/hasStock) and returns a np.ndarray with one action per row. A row's action is
+None when the policy has nothing for that state.
+
+Adapters:
+    TablePolicy         compact uint8 lookup table (PolicyStore.CompactPolicy)
+    DictPolicy          {state_str: action} dict as exported by the learners, looked up by exact JSON state string
+    NearestStatePolicy  wraps a table and answers unseen states with the action of the nearest known state
+
+as_policy() turns whatever a caller has (dict, CompactPolicy or callable) into a policy, compiling dicts into a
+TablePolicy so lookups are vectorized.
+'''
+
+import json
+import numpy as np
+import pandas as pd
+from Projects.ReinforcmentLearning.PolicyStore import CompactPolicy, NO_ACTION
+
+
+POSITION_FEATURES = ['hasCash', 'hasStock']
+
+
+class TablePolicy:
+    table = None
+
+    def __init__(self, table: CompactPolicy):
+        self.table = table
+        self.action_names = np.array(list(table.actions) + [None], dtype=object)
+
+    def __call__(self, state_df: pd.DataFrame):
+        action_indices = self.table.get_action_indices(self.table.schema.encode_frame(state_df)).astype(np.int64)
+        action_indices[action_indices == NO_ACTION] = len(self.table.actions)
+        return self.action_names[action_indices]
+
+
+class DictPolicy:
+    policy = {}
+
+    def __init__(self, policy: dict):
+        self.policy = policy
+
+    def __call__(self, state_df: pd.DataFrame):
+        columns = sorted(state_df.columns)
+        records = state_df[columns].astype(object).to_dict('records')
+        return np.array([self.policy.get(json.dumps(_to_python(record), sort_keys=True)) for record in records],
+                        dtype=object)
+
+
+class NearestStatePolicy:
+    '''
+    Looks states up in a table and falls back to the nearest known state for any state the table does not contain.
+
+    Distance between two states is the sum over features of |a - b| / scale for numeric values (scale is each
+    feature's spread over the known states) and 1 for each differing non-numeric value. Position features
+    (hasCash/hasStock) must always match exactly.
+    '''
+    table = None
+    max_distance = np.inf
+
+    def __init__(self, table, max_distance: float=np.inf, batch_size: int=4096):
+        if isinstance(table, dict):
+            table = CompactPolicy.from_policy(table)
+        self.table = table
+        self.exact = TablePolicy(table)
+        self.max_distance = max_distance
+        self.batch_size = batch_size
+
+        known_ids = np.flatnonzero(np.asarray(table.values) != NO_ACTION)
+        known_states = pd.DataFrame([table.schema.decode(int(state_id)) for state_id in known_ids],
+                                    columns=table.schema.names)
+        self.known_actions = self.exact.action_names[np.asarray(table.values)[known_ids].astype(np.int64)]
+
+        self.numeric_features = []
+        self.categorical_features = []
+        for name in table.schema.names:
+            values = _as_numeric(known_states[name])
+            if name not in POSITION_FEATURES and values is not None:
+                self.numeric_features.append(name)
+            else:
+                self.categorical_features.append(name)
+
+        self.known_numeric = self._numeric_matrix(known_states)
+        spread = np.nanmax(self.known_numeric, axis=0) - np.nanmin(self.known_numeric, axis=0) \
+            if len(known_states) else np.ones(len(self.numeric_features))
+        self.scale = np.where(np.nan_to_num(spread) > 0, np.nan_to_num(spread), 1)
+        self.known_categorical = self._categorical_matrix(known_states)
+
+    def _numeric_matrix(self, state_df: pd.DataFrame):
+        columns = [pd.to_numeric(state_df[name], errors='coerce').to_numpy(dtype=np.float64)
+                   for name in self.numeric_features]
+        return np.column_stack(columns) if columns else np.empty((state_df.shape[0], 0))
+
+    def _categorical_matrix(self, state_df: pd.DataFrame):
+        columns = [[json.dumps(_to_python(value)) for value in state_df[name]] for name in self.categorical_features]
+        return np.column_stack(columns) if columns else np.empty((state_df.shape[0], 0), dtype=object)
+
+    def __call__(self, state_df: pd.DataFrame):
+        actions = self.exact(state_df)
+        unseen = np.flatnonzero(pd.isnull(actions))
+        if len(unseen) == 0 or len(self.known_actions) == 0:
+            return actions
+
+        unseen_df = state_df.iloc[unseen]
+        numeric = self._numeric_matrix(unseen_df)
+        categorical = self._categorical_matrix(unseen_df)
+        is_position = np.array([name in POSITION_FEATURES for name in self.categorical_features])
+
+        for start in range(0, len(unseen), self.batch_size):
+            stop = start + self.batch_size
+            diff = np.abs(numeric[start:stop, np.newaxis, :] - self.known_numeric[np.newaxis, :, :]) / self.scale
+            both_missing = np.isnan(numeric[start:stop, np.newaxis, :]) & np.isnan(self.known_numeric[np.newaxis])
+            diff = np.where(both_missing, 0, np.where(np.isnan(diff), 1, diff))
+
+            mismatch = categorical[start:stop, np.newaxis, :] != self.known_categorical[np.newaxis, :, :]
+            distance = diff.sum(axis=2) + mismatch[:, :, ~is_position].sum(axis=2)
+            distance[mismatch[:, :, is_position].any(axis=2)] = np.inf
+
+            nearest = np.argmin(distance, axis=1)
+            nearest_distance = distance[np.arange(len(nearest)), nearest]
+            found = nearest_distance <= self.max_distance
+            actions[unseen[start:stop][found]] = self.known_actions[nearest[found]]
+
+        return actions
+
+
+def _to_python(value):
+    # Converts numpy scalars (and dicts of them) to plain Python values so they JSON-encode like the learners' states
+    if isinstance(value, dict):
+        return {key: _to_python(item) for key, item in value.items()}
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _as_numeric(values: pd.Series):
+    '''Returns values as a float array if every non-missing value is numeric (or a numeric string), else None.'''
+    if any(isinstance(value, (bool, np.bool_)) for value in values):
+        return None
+    numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+    if np.any(np.isnan(numeric) & values.notna().to_numpy()):
+        return None
+    return numeric
+
+
+def as_policy(policy):
+    '''
+    Returns a batch policy for a dict, CompactPolicy or callable.
+
+    Dicts are compiled into a TablePolicy; if their state space is too large to store densely they are looked up
+    row by row with DictPolicy instead.
+    '''
+    if isinstance(policy, CompactPolicy):
+        return TablePolicy(policy)
+    if isinstance(policy, dict):
+        try:
+            return TablePolicy(CompactPolicy.from_policy(policy))
+        except ValueError:
+            return DictPolicy(policy)
+    if callable(policy):
+        return policy
+    raise TypeError("Unsupported policy type: {0}".format(type(policy).__name__))
@@ -0,0 +1,307 @@
+'''
+Compact binary storage for Q-tables and policies.
+
+The JSON exports written by QTable.export()/export_policy() key every entry by a JSON-encoded state dict, so every
+load re-parses every key. The compact format instead stores:
+    <base>.json     small header: format version, action names and the state schema (feature names + values)
+    <base>.npy      float32 Q matrix (num_states x num_actions, NaN where an action is invalid/unseen)
+                    or uint8 action vector (num_states, NO_ACTION where the state is unseen)
+
+A state id is the mixed-radix number formed by the index of each feature's value in the schema, so looking up a
+state is O(1) arithmetic and the .npy can be opened with np.load(mmap_mode='r') without reading it into memory.
+'''
+
+import json
+import numpy as np
+import pandas as pd
+
+
+FORMAT_NAME = 'rl-qtable'
+FORMAT_VERSION = 1
+
+Q_TABLE = 'q_table'
+POLICY = 'policy'
+
+NO_ACTION = 255     # Marks unseen states in a uint8 policy vector
+MAX_STATES = 2 ** 31
+
+
+def _value_key(value):
+    # Canonical string for a feature value, identical to how it appears inside a JSON state string
+    if hasattr(value, 'item'):
+        value = value.item()
+    return json.dumps(value)
+
+
+class StateSchema:
+    features = []   # list of (feature_name, [values])
+
+    def __init__(self, features: list):
+        self.features = [(name, list(values)) for name, values in features]
+        self.names = [name for name, values in self.features]
+        self.lookups = [{_value_key(value): index for index, value in enumerate(values)}
+                        for name, values in self.features]
+
+        # Mixed-radix strides; the last feature varies fastest
+        self.strides = []
+        size = 1
+        for name, values in reversed(self.features):
+            self.strides.insert(0, size)
+            size *= max(len(values), 1)
+        self.size = size
+
+        if self.size > MAX_STATES:
+            raise ValueError("State schema has {0} states; too many to store densely.".format(self.size))
+
+    @classmethod
+    def from_states(cls, states: list):
+        '''Builds a schema covering every state dict in states.'''
+        values = {}
+        for state in states:
+            for name, value in state.items():
+                values.setdefault(name, {})[_value_key(value)] = value
+
+        features = [(name, [values[name][key] for key in sorted(values[name])]) for name in sorted(values)]
+        return cls(features)
+
+    @classmethod
+    def from_header(cls, header: dict):
+        return cls([(feature['name'], feature['values']) for feature in header['features']])
+
+    def to_header(self):
+        return [{'name': name, 'values': values} for name, values in self.features]
+
+    def encode(self, state):
+        '''Returns the id of a state (dict or pd.Series), or -1 if any feature value is outside the schema.'''
+        state_id = 0
+        for name, lookup, stride in zip(self.names, self.lookups, self.strides):
+            index = lookup.get(_value_key(state[name]))
+            if index is None:
+                return -1
+            state_id += index * stride
+        return state_id
+
+    def encode_str(self, state_str: str):
+        return self.encode(json.loads(state_str))
+
+    def decode(self, state_id: int):
+        '''Returns the state dict for a state id.'''
+        state = {}
+        for (name, values), stride in zip(self.features, self.strides):
+            state[name] = values[(state_id // stride) % len(values)]
+        return state
+
+    def encode_frame(self, state_df: pd.DataFrame):
+        '''
+        Vectorized encode of every row of state_df. Each distinct value in a column is canonicalized once, then
+        the ids are assembled with array arithmetic.
+
+        :return: np.ndarray of int64 state ids (-1 where a row has a value outside the schema)
+        '''
+        state_ids = np.zeros(state_df.shape[0], dtype=np.int64)
+        unknown = np.zeros(state_df.shape[0], dtype=bool)
+
+        for name, lookup, stride in zip(self.names, self.lookups, self.strides):
+            codes, uniques = pd.factorize(state_df[name].astype(object))
+
+            # Missing values (code -1) appear as NaN in JSON state strings
+            missing_index = lookup.get('NaN', lookup.get('null', -1))
+            unique_index = np.array([lookup.get(_value_key(value), -1) for value in uniques] + [missing_index],
+                                    dtype=np.int64)
+            feature_index = unique_index[codes]
+
+            unknown |= feature_index < 0
+            state_ids += feature_index * stride
+
+        state_ids[unknown] = -1
+        return state_ids
+
+
+class CompactQTable:
+    schema = None
+    actions = []
+    values = None   # np.ndarray (num_states x num_actions) of float32
+
+    def __init__(self, schema: StateSchema, actions: list, values: np.ndarray):
+        self.schema = schema
+        self.actions = list(actions)
+        self.values = values
+
+    @classmethod
+    def from_q_table(cls, table: dict):
+        '''Builds a compact table from a {state_str: {action: q-value}} dict (QTable.table or its JSON export).'''
+        states = {state_str: json.loads(state_str) for state_str in table}
+        schema = StateSchema.from_states(states.values())
+        actions = sorted({action for action_values in table.values() for action in action_values})
+        action_index = {action: index for index, action in enumerate(actions)}
+
+        values = np.full((schema.size, len(actions)), np.nan, dtype=np.float32)
+        for state_str, action_values in table.items():
+            state_id = schema.encode(states[state_str])
+            for action, q in action_values.items():
+                values[state_id, action_index[action]] = q
+
+        return cls(schema, actions, values)
+
+    def to_q_table(self):
+        '''Returns the equivalent {state_str: {action: q-value}} dict.'''
+        table = {}
+        for state_id in np.flatnonzero(~np.all(np.isnan(self.values), axis=1)):
+            state_str = json.dumps(self.schema.decode(int(state_id)), sort_keys=True)
+            table[state_str] = {action: float(q) for action, q in zip(self.actions, self.values[state_id])
+                                if not np.isnan(q)}
+        return table
+
+    def get_q_values(self, state):
+        '''Returns {action: q-value} for a state dict/Series, or None if the state is unknown.'''
+        state_id = self.schema.encode(state)
+        if state_id < 0:
+            return None
+        return {action: float(q) for action, q in zip(self.actions, self.values[state_id]) if not np.isnan(q)}
+
+    def to_policy(self):
+        '''Returns the greedy CompactPolicy for this table.'''
+        seen = ~np.all(np.isnan(self.values), axis=1)
+        greedy = np.argmax(np.where(np.isnan(self.values), -np.inf, self.values), axis=1).astype(np.uint8)
+        return CompactPolicy(self.schema, self.actions, np.where(seen, greedy, NO_ACTION).astype(np.uint8))
+
+    def save(self, base_path: str):
+        _save(base_path, Q_TABLE, self.schema, self.actions, self.values.astype(np.float32, copy=False))
+
+    @classmethod
+    def load(cls, base_path: str, mmap: bool=True):
+        schema, actions, values = _load(base_path, Q_TABLE, mmap)
+        return cls(schema, actions, values)
+
+
+class CompactPolicy:
+    schema = None
+    actions = []
+    values = None   # np.ndarray (num_states,) of uint8 action indices
+
+    def __init__(self, schema: StateSchema, actions: list, values: np.ndarray):
+        self.schema = schema
+        self.actions = list(actions)
+        self.values = values
+
+    def __getitem__(self, state_str: str):
+        # Dict-style lookup by state string, so a CompactPolicy can stand in for a loaded JSON policy
+        action = self.get_action(json.loads(state_str))
+        if action is None:
+            raise KeyError(state_str)
+        return action
+
+    def __contains__(self, state_str: str):
+        return self.get_action(json.loads(state_str)) is not None
+
+    @classmethod
+    def from_policy(cls, policy: dict):
+        '''Builds a compact policy from a {state_str: action} dict (QTable.get_policy() or its JSON export).'''
+        states = {state_str: json.loads(state_str) for state_str in policy}
+        schema = StateSchema.from_states(states.values())
+        actions = sorted(set(policy.values()))
+        action_index = {action: index for index, action in enumerate(actions)}
+
+        values = np.full(schema.size, NO_ACTION, dtype=np.uint8)
+        for state_str, action in policy.items():
+            values[schema.encode(states[state_str])] = action_index[action]
+
+        return cls(schema, actions, values)
+
+    def to_policy(self):
+        '''Returns the equivalent {state_str: action} dict.'''
+        return {json.dumps(self.schema.decode(int(state_id)), sort_keys=True): self.actions[self.values[state_id]]
+                for state_id in np.flatnonzero(self.values != NO_ACTION)}
+
+    def get_action(self, state):
+        '''Returns the action for a state dict/Series, or None if the state is unknown.'''
+        state_id = self.schema.encode(state)
+        if state_id < 0 or self.values[state_id] == NO_ACTION:
+            return None
+        return self.actions[self.values[state_id]]
+
+    def get_action_indices(self, state_ids: np.ndarray):
+        '''Vectorized lookup; returns uint8 action indices with NO_ACTION for unknown ids.'''
+        state_ids = np.asarray(state_ids)
+        action_indices = np.full(state_ids.shape, NO_ACTION, dtype=np.uint8)
+        known = state_ids >= 0
+        action_indices[known] = self.values[state_ids[known]]
+        return action_indices
+
+    def save(self, base_path: str):
+        _save(base_path, POLICY, self.schema, self.actions, self.values.astype(np.uint8, copy=False))
+
+    @classmethod
+    def load(cls, base_path: str, mmap: bool=True):
+        schema, actions, values = _load(base_path, POLICY, mmap)
+        return cls(schema, actions, values)
+
+
+def _save(base_path: str, kind: str, schema: StateSchema, actions: list, values: np.ndarray):
+    header = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'kind': kind,
+        'dtype': str(values.dtype),
+        'shape': list(values.shape),
+        'actions': actions,
+        'features': schema.to_header()
+    }
+    with open(base_path + '.json', 'w+') as f:
+        f.write(json.dumps(header))
+    np.save(base_path + '.npy', values)
+
+
+def _load(base_path: str, kind: str, mmap: bool):
+    with open(base_path + '.json', 'r') as f:
+        header = json.loads(f.readline())
+
+    if header.get('format') != FORMAT_NAME or header.get('version') != FORMAT_VERSION:
+        raise ValueError("Unsupported file format: {0} v{1}".format(header.get('format'), header.get('version')))
+    if header['kind'] != kind:
+        raise ValueError("Expected a {0} file but found a {1} file.".format(kind, header['kind']))
+
+    values = np.load(base_path + '.npy', mmap_mode='r' if mmap else None)
+    if list(values.shape) != header['shape']:
+        raise ValueError("Data shape {0} does not match header shape {1}.".format(values.shape, header['shape']))
+
+    return StateSchema.from_header(header), header['actions'], values
+
+
+def load(base_path: str, mmap: bool=True):
+    '''Loads a compact Q-table or policy, whichever kind the header at base_path describes.'''
+    with open(base_path + '.json', 'r') as f:
+        kind = json.loads(f.readline()).get('kind')
+    if kind == Q_TABLE:
+        return CompactQTable.load(base_path, mmap)
+    return CompactPolicy.load(base_path, mmap)
+
+
+def json_to_compact(json_path: str, base_path: str):
+    '''
+    Converts a JSON Q-table or policy export (e.g. output/q_table.txt, output/policy.txt) to the compact format.
+
+    :return: CompactQTable or CompactPolicy that was written
+    '''
+    with open(json_path, 'r') as f:
+        table = json.loads(f.readline())
+
+    if all(isinstance(value, dict) for value in table.values()):
+        compact = CompactQTable.from_q_table(table)
+    else:
+        compact = CompactPolicy.from_policy(table)
+
+    compact.save(base_path)
+    return compact
+
+
+def compact_to_json(base_path: str, json_path: str):
+    '''Converts a compact Q-table or policy back to the one-line JSON export format.'''
+    compact = load(base_path, mmap=True)
+    if isinstance(compact, CompactQTable):
+        table = compact.to_q_table()
+    else:
+        table = compact.to_policy()
+
+    with open(json_path, 'w+') as f:
+        f.write(json.dumps(table, sort_keys=True))
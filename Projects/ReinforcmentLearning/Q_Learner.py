@@ -8,6 +8,7 @@ Add verbose/persist options for console logging and logging to disk
 import pandas as pd
 import json
 import random
+from Projects.ReinforcmentLearning.PolicyStore import CompactQTable, CompactPolicy
 
 
 '''
@@ -62,6 +63,7 @@ class Q_Learner:
         self.alpha = alpha
         self.gamma = gamma
         self.p_explore = p_explore
+        self.q_table = {}
 
         self.initialize_state()
 
@@ -205,9 +207,19 @@ class Q_Learner:
             f.write(json.dumps(self.q_table))
 
     def export_policy(self, file_name: str):
-        policy = {}
-        for state in self.q_table:
-            policy[state] = max(self.q_table[state], key=self.q_table[state].get)
+        policy = self.get_policy()
 
         with open(file_name, 'w+') as f:
             f.write(json.dumps(policy, sort_keys=True))
+
+    def export_compact_q_table(self, base_path: str):
+        CompactQTable.from_q_table(self.q_table).save(base_path)
+
+    def export_compact_policy(self, base_path: str):
+        CompactPolicy.from_policy(self.get_policy()).save(base_path)
+
+    def get_policy(self):
+        policy = {}
+        for state in self.q_table:
+            policy[state] = max(self.q_table[state], key=self.q_table[state].get)
+        return policy
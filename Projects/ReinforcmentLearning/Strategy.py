@@ -92,3 +92,31 @@ def beta(data: pd.DataFrame):
     })
 
     return state_df
+
+
+def gamma(data: pd.DataFrame):
+    """
+    Strategy version gamma.
+
+    State members are left continuous for function approximation learners (see TileCodingQLearner):
+        Bollinger z-score: (close - rolling mean) / rolling std_dev
+        Momentum: 2-day momentum in units of rolling std_dev
+
+    :return: state_df: pd.DataFrame of transformed data
+    """
+
+    # Define state features
+    window = 20
+
+    data['rm'] = get_rolling_mean(data['close'], window)
+    data['rstd'] = get_rolling_std(data['close'], window)
+    data['mom_2'] = get_momentum(data['close'], window=2)
+
+    state_df = pd.DataFrame(data={
+        'bb_z': (data['close'] - data['rm']) / data['rstd'],
+        'momentum': data['mom_2'] / data['rstd'],
+        'hasCash': None,
+        'hasStock': None
+    })
+
+    return state_df
@@ -0,0 +1,214 @@
+'''
+Q-learning with a tile-coded linear Q-function over continuous strategy features.
+
+Q_Learner and DynaQLearner key their Q-tables by the exact JSON state, which forces strategies to bin features
+coarsely (Strategy.alpha floors the Bollinger z-score to halves). This learner keeps the features continuous
+(see Strategy.gamma) and approximates Q(s, a) as the sum of one weight per tiling. Tile coordinates are hashed
+into a fixed-size weight vector, so memory stays constant no matter how fine the tile resolution is.
+
+Because the market features do not depend on the agent, every (bar, position, action) transition is known up
+front. Training sweeps those transitions in shuffled minibatches with vectorized TD updates instead of stepping
+through the series one state at a time.
+'''
+
+import json
+import numpy as np
+import pandas as pd
+from Projects.ReinforcmentLearning.DynaQLearner import Action
+
+
+ACTIONS = [Action.HOLD, Action.BUY, Action.SELL]
+HOLD, BUY, SELL = range(len(ACTIONS))
+
+# Valid actions by position (row 0: holding cash, row 1: holding stock)
+VALID_ACTIONS = np.array([[True, True, False],
+                          [True, False, True]])
+
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class TileCoder:
+    feature_names = []
+    resolution = None   # tiles per unit of each feature
+    num_tilings = 8
+    memory_size = 2 ** 16
+
+    def __init__(self, feature_names: list, resolution, num_tilings: int=8, memory_size: int=2 ** 16, seed: int=0):
+        if memory_size & (memory_size - 1):
+            raise ValueError("memory_size must be a power of 2.")
+
+        self.feature_names = list(feature_names)
+        self.resolution = np.broadcast_to(np.asarray(resolution, dtype=np.float64), (len(self.feature_names),))
+        self.num_tilings = num_tilings
+        self.memory_size = memory_size
+        self.seed = seed
+
+        # Each tiling is shifted by a fraction of a tile along every feature
+        rng = np.random.RandomState(seed)
+        self.offsets = (np.arange(num_tilings)[:, np.newaxis] + rng.uniform(size=(num_tilings, len(self.feature_names))))\
+            / num_tilings
+        self.feature_multipliers = rng.randint(1, 2 ** 31, size=len(self.feature_names) + 3).astype(np.uint64)
+        self.hash_shift = np.uint64(64 - int(np.log2(memory_size)))
+
+    def get_features(self, state_df: pd.DataFrame):
+        '''Returns the continuous features of state_df as a float array, with missing values set to 0.'''
+        return np.nan_to_num(state_df[self.feature_names].to_numpy(dtype=np.float64))
+
+    def indices(self, features: np.ndarray, positions: np.ndarray, actions: np.ndarray):
+        '''
+        Hashes each (features, position, action) row to one weight index per tiling.
+
+        :param features: array (batch x features)
+        :param positions: array (batch,) of 0 (cash) or 1 (stock)
+        :param actions: array (batch,) of action indices
+        :return: array (batch x num_tilings) of weight indices
+        '''
+        coords = np.floor(features[:, np.newaxis, :] * self.resolution + self.offsets).astype(np.int64)
+
+        key = (coords.astype(np.uint64) * self.feature_multipliers[:-3]).sum(axis=2)
+        key += np.arange(self.num_tilings, dtype=np.uint64) * self.feature_multipliers[-3]
+        key += (np.asarray(positions, dtype=np.uint64) * self.feature_multipliers[-2])[:, np.newaxis]
+        key += (np.asarray(actions, dtype=np.uint64) * self.feature_multipliers[-1])[:, np.newaxis]
+
+        return ((key * _HASH_MULTIPLIER) >> self.hash_shift).astype(np.int64)
+
+    def to_dict(self):
+        return {
+            'feature_names': self.feature_names,
+            'resolution': self.resolution.tolist(),
+            'num_tilings': self.num_tilings,
+            'memory_size': self.memory_size,
+            'seed': self.seed
+        }
+
+
+class TileCodingPolicy:
+    '''
+    Greedy policy over a tile-coded Q-function. Call it with a state frame (feature columns plus hasStock) to get an
+    array of actions, one per row.
+    '''
+    coder = None
+    weights = None
+
+    def __init__(self, coder: TileCoder, weights: np.ndarray):
+        self.coder = coder
+        self.weights = weights
+
+    def __call__(self, state_df: pd.DataFrame):
+        features = self.coder.get_features(state_df)
+        positions = state_df['hasStock'].fillna(False).to_numpy(dtype=bool).astype(np.int64)
+        return np.array(ACTIONS, dtype=object)[self.get_greedy_actions(features, positions)]
+
+    def get_q_values(self, features: np.ndarray, positions: np.ndarray):
+        '''Returns Q-values (batch x actions), with invalid actions set to -inf.'''
+        q_values = np.empty((features.shape[0], len(ACTIONS)))
+        for action in range(len(ACTIONS)):
+            idx = self.coder.indices(features, positions, np.full(features.shape[0], action))
+            q_values[:, action] = self.weights[idx].sum(axis=1)
+        return np.where(VALID_ACTIONS[positions], q_values, -np.inf)
+
+    def get_greedy_actions(self, features: np.ndarray, positions: np.ndarray):
+        return np.argmax(self.get_q_values(features, positions), axis=1)
+
+    def to_dict(self):
+        return {'type': 'tile_coding_q', 'coder': self.coder.to_dict(), 'weights': self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(TileCoder(**data['coder']), np.asarray(data['weights'], dtype=np.float32))
+
+
+def load_policy(file_name: str):
+    '''Loads a policy written by TileCodingQLearner.export_policy().'''
+    with open(file_name, 'r') as f:
+        return TileCodingPolicy.from_dict(json.loads(f.readline()))
+
+
+class TileCodingQLearner:
+    # Learning variables
+    alpha = .1
+    gamma = .9
+    batch_size = 256
+    coder = None
+    weights = None
+    policy = None
+
+    # Environment
+    state_df = pd.DataFrame()
+    price_df = pd.DataFrame()
+
+    def __init__(self,
+                 state_df: pd.DataFrame,
+                 price_df: pd.DataFrame,
+                 feature_names: list=('bb_z', 'momentum'),
+                 resolution=4,
+                 num_tilings: int=8,
+                 memory_size: int=2 ** 16,
+                 alpha: float=.1,
+                 gamma: float=.9,
+                 batch_size: int=256,
+                 seed: int=0):
+        # Assign parameter values
+        self.state_df = state_df
+        self.price_df = price_df
+        self.alpha = alpha
+        self.gamma = gamma
+        self.batch_size = batch_size
+        self.rng = np.random.RandomState(seed)
+
+        self.coder = TileCoder(feature_names, resolution, num_tilings, memory_size, seed)
+        self.weights = np.zeros(memory_size, dtype=np.float32)
+        self.policy = TileCodingPolicy(self.coder, self.weights)
+
+        self.initialize_transitions()
+
+    def initialize_transitions(self):
+        '''
+        Enumerates every (bar, position, action) transition. Rewards follow Portfolio.apply_action with fractional
+        shares: the return of the next bar when holding stock after the action, 0 when holding cash.
+        '''
+        features = self.coder.get_features(self.state_df)
+        close = self.price_df['close'].to_numpy(dtype=np.float64)
+        bar_returns = close[1:] / close[:-1] - 1
+        num_steps = len(bar_returns)
+
+        bars, positions, actions = [], [], []
+        for position in (0, 1):
+            for action in np.flatnonzero(VALID_ACTIONS[position]):
+                bars.append(np.arange(num_steps))
+                positions.append(np.full(num_steps, position))
+                actions.append(np.full(num_steps, action))
+
+        self.bars = np.concatenate(bars)
+        self.positions = np.concatenate(positions)
+        self.actions = np.concatenate(actions)
+        self.next_positions = np.where(self.actions == BUY, 1, np.where(self.actions == SELL, 0, self.positions))
+        self.rewards = np.where(self.next_positions == 1, bar_returns[self.bars], 0)
+        self.terminal = self.bars == num_steps - 1
+        self.features = features
+
+    def train(self, iterations: int = 100):
+        for iteration in range(iterations):
+            print(iteration)
+            order = self.rng.permutation(len(self.bars))
+            for start in range(0, len(order), self.batch_size):
+                self.update_q(order[start:start + self.batch_size])
+
+    def update_q(self, batch: np.ndarray):
+        # Semi-gradient Q-learning on a minibatch of transitions
+        # w += alpha/num_tilings * [r + g*max_a'(q[s'][a']) - q[s][a]] * grad q[s][a]
+        idx = self.coder.indices(self.features[self.bars[batch]], self.positions[batch], self.actions[batch])
+        q = self.weights[idx].sum(axis=1)
+
+        next_q = self.policy.get_q_values(self.features[self.bars[batch] + 1], self.next_positions[batch]).max(axis=1)
+        target = self.rewards[batch] + np.where(self.terminal[batch], 0, self.gamma * next_q)
+
+        td_error = (target - q) * (self.alpha / self.coder.num_tilings)
+        np.add.at(self.weights, idx, np.repeat(td_error[:, np.newaxis], self.coder.num_tilings, axis=1))
+
+    def get_policy(self):
+        return self.policy
+
+    def export_policy(self, file_name: str):
+        with open(file_name, 'w+') as f:
+            f.write(json.dumps(self.policy.to_dict()))
@@ -0,0 +1,250 @@
+'''
+Scaling benchmarks for the reinforcement learning code.
+
+Times Q_Learner.train, DynaQLearner.train, DynaQLearner.dyna_planning and MarketSimulator.run on synthetic price
+series of growing length and state cardinality. No data files are needed.
+
+Run from the repository root:
+    python -m Projects.ReinforcmentLearning.benchmark --output bench.json
+    python -m Projects.ReinforcmentLearning.benchmark --quick --baseline bench.json
+    python -m Projects.ReinforcmentLearning.benchmark --full --no-memory --output bench_full.json
+
+Each result records throughput (steps/sec or planning updates/sec) and peak traced memory. Peak memory is measured
+in a second, separate run under tracemalloc so tracing overhead does not distort the timings (--no-memory skips it,
+roughly halving the run time). The default series lengths finish in minutes; --full adds the 100k and 1M bar
+cases, which take hours.
+'''
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+from Projects.ReinforcmentLearning.Q_Learner import Q_Learner
+from Projects.ReinforcmentLearning.DynaQLearner import DynaQLearner
+from Projects.ReinforcmentLearning.MarketSimulator import MarketSimulator
+
+
+BAR_COUNTS = [1000, 10000, 20000]                # About 6 minutes (3 with --no-memory)
+QUICK_BAR_COUNTS = [1000, 10000]
+FULL_BAR_COUNTS = [1000, 10000, 100000, 1000000]   # Hours: the 1M bar cases train for over an hour each
+CARDINALITIES = [8, 64, 512]
+PLANNING_UPDATES = 2000
+REGRESSION_TOLERANCE = .2   # Flag results more than 20% slower than the baseline
+
+
+def make_synthetic_data(num_bars: int, cardinality: int, seed: int=0):
+    '''
+    Builds a synthetic price series and matching state frame.
+
+    The single market feature is the rolling z-score of the price bucketed into `cardinality` quantiles, so the
+    learners see cardinality * 2 position states.
+
+    :return: state_df, price_df
+    '''
+    rng = np.random.RandomState(seed)
+    close = np.exp(np.cumsum(rng.normal(0, .01, num_bars)))
+    price_df = pd.DataFrame({'close': close / close[0]})
+
+    rolling = price_df['close'].rolling(20, min_periods=1)
+    z_score = ((price_df['close'] - rolling.mean()) / rolling.std()).fillna(0)
+    bucket = pd.qcut(z_score.rank(method='first'), cardinality, labels=False)
+
+    state_df = pd.DataFrame({
+        'bucket': bucket.astype(int),
+        'hasCash': None,
+        'hasStock': None
+    }, index=price_df.index)
+
+    return state_df, price_df
+
+
+def _time_call(func, measure_memory: bool):
+    '''Runs func with stdout silenced; returns (seconds, result, peak memory in MB or None).'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+
+        peak_mb = None
+        if measure_memory:
+            tracemalloc.start()
+            func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+    return seconds, result, peak_mb
+
+
+def bench_q_learner(state_df: pd.DataFrame, price_df: pd.DataFrame, iterations: int, measure_memory: bool):
+    def run():
+        learner = Q_Learner(state_df=state_df.copy(), reward_df=price_df)
+        learner.train(iterations)
+        return learner
+
+    seconds, learner, peak_mb = _time_call(run, measure_memory)
+    steps = (state_df.shape[0] - 1) * iterations
+    return {'seconds': seconds, 'steps': steps, 'steps_per_sec': steps / seconds, 'peak_memory_mb': peak_mb,
+            'q_table_states': len(learner.q_table)}
+
+
+def bench_dyna_q_learner(state_df: pd.DataFrame, price_df: pd.DataFrame, iterations: int, measure_memory: bool):
+    def run():
+        learner = DynaQLearner(state_df=state_df.copy(), price_df=price_df)
+        learner.train(iterations)
+        return learner
+
+    seconds, learner, peak_mb = _time_call(run, measure_memory)
+    steps = (state_df.shape[0] - 1) * iterations
+    return {'seconds': seconds, 'steps': steps, 'steps_per_sec': steps / seconds, 'peak_memory_mb': peak_mb,
+            'q_table_states': len(learner.q_table.table)}, learner
+
+
+def bench_dyna_planning(learner: DynaQLearner, updates: int, measure_memory: bool):
+    seconds, _, peak_mb = _time_call(lambda: learner.dyna_planning(updates), measure_memory)
+    return {'seconds': seconds, 'planning_updates': updates, 'planning_updates_per_sec': updates / seconds,
+            'peak_memory_mb': peak_mb}
+
+
+def bench_market_simulator(state_df: pd.DataFrame, price_df: pd.DataFrame, policy: dict, measure_memory: bool):
+    def run():
+        simulator = MarketSimulator(state_df.copy(), price_df, policy, 5)
+        simulator.run()
+        return simulator
+
+    seconds, _, peak_mb = _time_call(run, measure_memory)
+    steps = state_df.shape[0]
+    return {'seconds': seconds, 'steps': steps, 'steps_per_sec': steps / seconds, 'peak_memory_mb': peak_mb}
+
+
+def run_benchmarks(bar_counts: list=None,
+                   cardinalities: list=None,
+                   iterations: int=1,
+                   planning_updates: int=PLANNING_UPDATES,
+                   measure_memory: bool=True,
+                   seed: int=0):
+    '''
+    Runs every benchmark for each (bars, cardinality) combination.
+
+    :return: list of result dicts
+    '''
+    bar_counts = bar_counts or BAR_COUNTS
+    cardinalities = cardinalities or CARDINALITIES
+    results = []
+
+    for num_bars in bar_counts:
+        for cardinality in cardinalities:
+            random.seed(seed)
+            state_df, price_df = make_synthetic_data(num_bars, cardinality, seed)
+            case = {'bars': num_bars, 'cardinality': cardinality, 'iterations': iterations}
+
+            q_result = bench_q_learner(state_df, price_df, iterations, measure_memory)
+            results.append(dict(case, benchmark='Q_Learner.train', **q_result))
+
+            dyna_result, learner = bench_dyna_q_learner(state_df, price_df, iterations, measure_memory)
+            results.append(dict(case, benchmark='DynaQLearner.train', **dyna_result))
+
+            planning_result = bench_dyna_planning(learner, planning_updates, measure_memory)
+            results.append(dict(case, benchmark='DynaQLearner.dyna_planning', **planning_result))
+
+            sim_result = bench_market_simulator(state_df, price_df, learner.policy, measure_memory)
+            results.append(dict(case, benchmark='MarketSimulator.run', **sim_result))
+
+            for result in results[-4:]:
+                print(format_result(result))
+
+    return results
+
+
+def _throughput(result: dict):
+    return result.get('steps_per_sec', result.get('planning_updates_per_sec'))
+
+
+def format_result(result: dict):
+    if 'planning_updates_per_sec' in result:
+        rate = '{0:>12,.0f} updates/sec'.format(result['planning_updates_per_sec'])
+    else:
+        rate = '{0:>12,.0f} steps/sec  '.format(result['steps_per_sec'])
+    memory = '' if result['peak_memory_mb'] is None else '{0:>9.1f} MB'.format(result['peak_memory_mb'])
+    return '{0:<28} bars={1:<8} cardinality={2:<5} {3}{4}'.format(
+        result['benchmark'], result['bars'], result['cardinality'], rate, memory)
+
+
+def compare_to_baseline(results: list, baseline: dict, tolerance: float=REGRESSION_TOLERANCE):
+    '''
+    Compares throughput against a previously saved benchmark file.
+
+    :return: list of (result, baseline result, ratio) for every case slower than baseline by more than tolerance
+    '''
+    def key(result):
+        return result['benchmark'], result['bars'], result['cardinality'], result['iterations']
+
+    baseline_results = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        ratio = _throughput(result) / _throughput(previous)
+        if ratio < 1 - tolerance:
+            regressions.append((result, previous, ratio))
+    return regressions
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def main(argv: list=None):
+    parser = argparse.ArgumentParser(description='Benchmark the reinforcement learning learners and simulator.')
+    parser.add_argument('--bars', type=int, nargs='+', help='price series lengths (default: 1k to 20k)')
+    parser.add_argument('--cardinality', type=int, nargs='+', help='number of market feature states')
+    parser.add_argument('--quick', action='store_true', help='only run the small series lengths')
+    parser.add_argument('--full', action='store_true', help='run series lengths up to 1M bars (takes hours)')
+    parser.add_argument('--iterations', type=int, default=1, help='training iterations per learner')
+    parser.add_argument('--planning-updates', type=int, default=PLANNING_UPDATES)
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced peak memory runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    bar_counts = args.bars or (QUICK_BAR_COUNTS if args.quick else FULL_BAR_COUNTS if args.full else BAR_COUNTS)
+    results = run_benchmarks(bar_counts=bar_counts,
+                             cardinalities=args.cardinality,
+                             iterations=args.iterations,
+                             planning_updates=args.planning_updates,
+                             measure_memory=not args.no_memory,
+                             seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w+') as f:
+            f.write(json.dumps({'environment': environment_info(), 'results': results}, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.loads(f.read())
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for result, previous, ratio in regressions:
+            print('REGRESSION: {0} ({1:.0%} of baseline throughput)'.format(format_result(result), ratio))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
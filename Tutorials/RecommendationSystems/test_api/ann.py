@@ -0,0 +1,266 @@
+import time
+import argparse
+import numpy as np
+from scipy import sparse
+
+
+class LshIndex:
+    '''
+    Approximate nearest neighbor index using random-projection (sign) locality sensitive hashing.
+
+    Each of num_tables hash tables assigns a vector a num_bits code: one bit per random hyperplane, set when the
+    vector lies on its positive side. Vectors with a small angle between them tend to share codes, so a query only
+    has to score the users in its own buckets instead of every user.
+
+    Recall/latency tradeoff:
+        num_tables: more tables find more true neighbors, at the cost of more candidates and memory
+        num_bits: more bits make buckets smaller (faster queries, lower recall)
+        num_probes: also probe the buckets that differ from the query's code in one of its num_probes least
+                    certain bits (raises recall without adding tables)
+
+    New or changed vectors can be added at any time. They go into a pending buffer that is merged into the sorted
+    bucket arrays once it grows past merge_threshold, so inserts never rebuild the whole index.
+    '''
+    metric = None
+    num_tables = 8
+    num_bits = 12
+    num_probes = 0
+
+    def __init__(self, num_features, num_tables=8, num_bits=12, num_probes=0, metric=None, merge_threshold=1024,
+                 seed=0):
+        if num_bits > 62:
+            raise ValueError("num_bits must be at most 62.")
+
+        self.num_features = num_features
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.num_probes = num_probes
+        self.metric = metric
+        self.merge_threshold = merge_threshold
+        self.seed = seed
+
+        rng = np.random.RandomState(seed)
+        self.hyperplanes = rng.standard_normal((num_features, num_tables * num_bits)).astype(np.float32)
+        self.bit_values = (1 << np.arange(num_bits, dtype=np.int64))
+
+        # Current code of every indexed id in every table (-1 for ids that are not indexed)
+        self.codes = np.full((0, num_tables), -1, dtype=np.int64)
+
+        # Per table: bucket codes sorted ascending and the ids stored under them
+        self.table_codes = [np.empty(0, dtype=np.int64) for table in range(num_tables)]
+        self.table_ids = [np.empty(0, dtype=np.int64) for table in range(num_tables)]
+
+        # Inserts not yet merged into the sorted tables
+        self.pending_ids = []
+        self.pending_codes = []
+
+    def __len__(self):
+        return int(np.count_nonzero(self.codes[:, 0] >= 0))
+
+    def project(self, vectors):
+        '''Returns the projections (vectors x tables x bits) of a sparse or dense matrix of row vectors.'''
+        projections = vectors.dot(self.hyperplanes) if sparse.issparse(vectors) else np.dot(vectors, self.hyperplanes)
+        return np.asarray(projections).reshape(-1, self.num_tables, self.num_bits)
+
+    def add_features(self, num_features):
+        '''
+        Grows the index to accept vectors with num_features features. The new features get fresh hyperplane
+        components, so the codes of vectors that are zero in them do not change.
+        '''
+        if num_features <= self.num_features:
+            return
+        rng = np.random.RandomState([self.seed, num_features])
+        extra = rng.standard_normal((num_features - self.num_features, self.hyperplanes.shape[1])).astype(np.float32)
+        self.hyperplanes = np.vstack([self.hyperplanes, extra])
+        self.num_features = num_features
+
+    def hash(self, projections):
+        return (projections > 0).astype(np.int64).dot(self.bit_values)
+
+    def add(self, ids, vectors):
+        '''
+        Inserts (or re-inserts, for changed vectors) rows into the index
+
+        param ids: integer ids of the rows (e.g. row positions in the ratings matrix)
+        param vectors: sparse or dense matrix with one row per id
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        codes = self.hash(self.project(vectors))
+
+        if ids.max() >= self.codes.shape[0]:
+            grown = np.full((ids.max() + 1, self.num_tables), -1, dtype=np.int64)
+            grown[:self.codes.shape[0]] = self.codes
+            self.codes = grown
+        self.codes[ids] = codes
+
+        self.pending_ids.append(ids)
+        self.pending_codes.append(codes)
+        if sum(len(pending) for pending in self.pending_ids) >= self.merge_threshold:
+            self.merge()
+
+    def merge(self):
+        '''Merges the pending inserts into the sorted tables and drops entries made stale by re-inserts.'''
+        if not self.pending_ids:
+            return
+        pending_ids = np.concatenate(self.pending_ids)
+        pending_codes = np.concatenate(self.pending_codes)
+
+        for table in range(self.num_tables):
+            ids = np.concatenate([self.table_ids[table], pending_ids])
+            codes = np.concatenate([self.table_codes[table], pending_codes[:, table]])
+
+            # Keep one entry per id, and only if it matches the id's current code
+            current = self.codes[ids, table] == codes
+            ids, codes = ids[current], codes[current]
+            ids, unique = np.unique(ids, return_index=True)
+            codes = codes[unique]
+
+            order = np.argsort(codes, kind='mergesort')
+            self.table_ids[table] = ids[order]
+            self.table_codes[table] = codes[order]
+
+        self.pending_ids = []
+        self.pending_codes = []
+
+    def probe_codes(self, projections, num_probes):
+        '''
+        Returns the codes to look up in each table: the query's own code plus codes with one of its least certain
+        bits (smallest |projection|) flipped.
+
+        return: array (tables x (1 + num_probes)) of codes
+        '''
+        codes = self.hash(projections[np.newaxis])[0]
+        num_probes = min(num_probes, self.num_bits)
+        if num_probes == 0:
+            return codes[:, np.newaxis]
+
+        uncertain_bits = np.argsort(np.abs(projections), axis=1)[:, :num_probes]
+        flipped = codes[:, np.newaxis] ^ self.bit_values[uncertain_bits]
+        return np.concatenate([codes[:, np.newaxis], flipped], axis=1)
+
+    def query(self, vector, num_probes=None):
+        '''
+        Finds the candidate neighbors of a single vector
+
+        param vector: sparse or dense row vector
+        param num_probes: overrides the index's num_probes for this query
+
+        return: np.ndarray of unique candidate ids
+        '''
+        num_probes = self.num_probes if num_probes is None else num_probes
+        probes = self.probe_codes(self.project(vector)[0], num_probes)
+
+        # Mark candidates in a flag array rather than concatenating and de-duplicating bucket lists
+        is_candidate = np.zeros(self.codes.shape[0], dtype=bool)
+        for table in range(self.num_tables):
+            table_codes = self.table_codes[table]
+            left = np.searchsorted(table_codes, probes[table], side='left')
+            right = np.searchsorted(table_codes, probes[table], side='right')
+            for start, stop in zip(left, right):
+                is_candidate[self.table_ids[table][start:stop]] = True
+
+        if not self.pending_ids:
+            return np.flatnonzero(is_candidate)
+
+        pending_ids = np.concatenate(self.pending_ids)
+        pending_codes = np.concatenate(self.pending_codes)
+        is_candidate[pending_ids[(pending_codes[:, :, np.newaxis] == probes[np.newaxis]).any(axis=(1, 2))]] = True
+        candidates = np.flatnonzero(is_candidate)
+
+        # Drop entries made stale by a re-insert that is still pending a merge
+        current = self.codes[candidates][:, :, np.newaxis] == probes[np.newaxis]
+        return candidates[current.any(axis=(1, 2))]
+
+    def save(self, path):
+        self.merge()
+        np.savez(path,
+                 params=np.array([self.num_features, self.num_tables, self.num_bits, self.num_probes,
+                                  self.merge_threshold, self.seed]),
+                 metric=np.array(self.metric or ''),
+                 hyperplanes=self.hyperplanes,
+                 codes=self.codes,
+                 table_codes=np.stack(self.table_codes) if self.num_tables else np.empty((0, 0), dtype=np.int64),
+                 table_ids=np.stack(self.table_ids) if self.num_tables else np.empty((0, 0), dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            num_features, num_tables, num_bits, num_probes, merge_threshold, seed = [int(x) for x in data['params']]
+            index = cls(num_features, num_tables, num_bits, num_probes, str(data['metric']) or None,
+                        merge_threshold, seed)
+            index.hyperplanes = data['hyperplanes']
+            index.codes = data['codes']
+            index.table_codes = list(data['table_codes'])
+            index.table_ids = list(data['table_ids'])
+        return index
+
+
+def recall_at_k(knn, userIDs, k=10):
+    '''
+    Measures the recall and latency of the approximate neighbor search against exact search
+
+    Recall counts an approximate neighbor as correct when its exact distance is no greater than the k-th exact
+    neighbor's distance, so ties at the boundary are not penalized.
+
+    param knn: Knn instance with an index built
+    param userIDs: userIDs to query
+    param k: number of neighbors
+
+    return: dict with mean recall@k, mean candidates scored and mean exact/approximate latency in milliseconds
+    '''
+    recalls = []
+    candidates = []
+    exact_times = []
+    approx_times = []
+    for userID in userIDs:
+        start = time.perf_counter()
+        exact = knn.find_knn(userID, k, exact=True)
+        exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        approx = knn.find_knn(userID, k)
+        approx_times.append(time.perf_counter() - start)
+
+        row = knn.user_index[userID]
+        candidates.append(len(knn.index.query(knn.index_vectors(knn.index.metric, [row]))))
+        if len(exact) == 0:
+            continue
+        distances = knn.distances(userID, knn.index.metric)
+        approx_distances = distances[[knn.user_index[user] for user in approx.index]]
+        recalls.append(np.count_nonzero(approx_distances <= exact.iloc[-1] + 1e-12) / len(exact))
+
+    return {
+        'recall': float(np.mean(recalls)) if recalls else float('nan'),
+        'candidates': float(np.mean(candidates)) if candidates else 0.,
+        'exact_ms': 1000 * float(np.mean(exact_times)),
+        'approx_ms': 1000 * float(np.mean(approx_times)),
+        'queries': len(userIDs)
+    }
+
+
+if __name__ == '__main__':
+    from knn import Knn
+
+    parser = argparse.ArgumentParser(description='Benchmark recall@k and latency of the LSH index against exact search.')
+    parser.add_argument('--metric', default='cosine')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--sample', type=int, default=200, help='number of users to query')
+    parser.add_argument('--tables', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--bits', type=int, nargs='+', default=[6, 8, 12])
+    parser.add_argument('--probes', type=int, nargs='+', default=[0, 2])
+    args = parser.parse_args()
+
+    knn = Knn(metric=args.metric)
+    sample = np.random.RandomState(0).choice(knn.user_ids, min(args.sample, len(knn.user_ids)), replace=False)
+
+    print('tables\tbits\tprobes\trecall@{0}\tcandidates\texact ms\tapprox ms'.format(args.k))
+    for num_tables in args.tables:
+        for num_bits in args.bits:
+            for num_probes in args.probes:
+                knn.build_index(num_tables=num_tables, num_bits=num_bits, num_probes=num_probes)
+                result = recall_at_k(knn, sample, args.k)
+                print('{0}\t{1}\t{2}\t{3:.3f}\t\t{4:.0f}\t\t{5:.2f}\t\t{6:.2f}'.format(
+                    num_tables, num_bits, num_probes, result['recall'], result['candidates'], result['exact_ms'],
+                    result['approx_ms']))
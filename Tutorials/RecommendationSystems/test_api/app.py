@@ -1,8 +1,16 @@
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory
 from flask_restful import Resource, Api
+import os
 import json
+import time
 import datetime
+import threading
 from knn import Knn
+from cache import RecommendationCache
+from precompute import PrecomputedRecommendations
+from batching import MicroBatcher
+from metrics import LatencyHistograms
+from mf import MatrixFactorization
 #https://impythonist.wordpress.com/2015/07/12/build-an-api-under-30-lines-of-code-with-python-and-flask/
 
 
@@ -13,18 +21,134 @@ api = Api(app)
 
 # Create KNN learner and import data
 knn = Knn()
+
+# Serve from the offline table written by precompute.py when there is one computed from the loaded ratings
+precomputed_path = 'data/movielens_2k/recommendations'
+precomputed = PrecomputedRecommendations(precomputed_path) if os.path.exists(precomputed_path + '.json') else None
+if precomputed is not None:
+    mismatch = precomputed.check(knn)
+    if mismatch:
+        print('Not serving the precomputed recommendations: ' + mismatch + '; rerun precompute.py')
+        precomputed = None
+
+# Matrix factorization engine trained by mf.py, served alongside Knn when its model file exists
+mf_model_path = 'data/movielens_2k/mf_model.npz'
+mf_model = MatrixFactorization.load(knn, mf_model_path) if os.path.exists(mf_model_path) else None
+
+# Cache recommendations per (userID, k, num_recs) and neighbor rankings per (userID, k)
+recommendation_cache = RecommendationCache(knn, max_size=4096, ttl=300, precomputed=precomputed)
+
+# New ratings are buffered and merged into the model every few seconds; requests and merges share one lock
+model_lock = threading.RLock()
+merge_interval = 5
+
+# Set by serve.py in multi-process mode: ratings are appended to a shared log that every worker merges from
+ratings_log = None
+
+# Concurrent cache misses are answered together with one batched neighbor search
+batcher = MicroBatcher(recommendation_cache, model_lock, max_batch=64, max_wait=.002)
+
+# Latency histograms in shared memory, one slot per worker process (serve.py sets the slot of each worker)
+MAX_WORKERS = 64
+histograms = LatencyHistograms(['recommend', 'recommend_mf', 'ratings'], num_workers=MAX_WORKERS)
+
+background_pid = None
+
+
+def merge_ratings():
+    with model_lock:
+        if ratings_log is not None:
+            triples = ratings_log.read_new()
+            if triples:
+                user_ids, movie_ids, values = zip(*triples)
+                knn.add_ratings(user_ids, movie_ids, values)
+        changed = knn.merge_ratings()
+        if changed:
+            recommendation_cache.invalidate(changed)
+    return changed
+
+
+def merge_loop():
+    while True:
+        time.sleep(merge_interval)
+        merge_ratings()
+
+
+def start_background_threads():
+    # Threads do not survive fork(), so every process that serves requests starts its own merge thread
+    global background_pid
+    if background_pid != os.getpid():
+        background_pid = os.getpid()
+        threading.Thread(target=merge_loop, daemon=True).start()
+
+
 print('App is ready')
 
 
 # Create api
 class Movie_Recs(Resource):
     def get(self, userID, k, num_recs):
+        start_background_threads()
         start = datetime.datetime.now()
-        recommendations = knn.getRecommendations(userID, k, num_recs)
+        recommendations = batcher.submit(userID, k, num_recs)
         end = datetime.datetime.now()
 
+        histograms.observe('recommend', (end - start).total_seconds())
         print('Time to process request: ' + str(end-start))
-        return json.dumps(recommendations)
+        return recommendations
+
+
+class MF_Movie_Recs(Resource):
+    def get(self, userID, num_recs):
+        if mf_model is None:
+            return {'error': 'No matrix factorization model; train one with mf.py.'}, 404
+        start = time.perf_counter()
+        with model_lock:
+            recommendations = json.dumps(mf_model.getRecommendations(userID, num_recs=num_recs))
+        histograms.observe('recommend_mf', time.perf_counter() - start)
+        # JSON-encoded string, like /recommend (the page parses the response body with JSON.parse)
+        return recommendations
+
+
+class Ratings(Resource):
+    def post(self):
+        '''
+        Buffers new ratings. The body is a JSON object or list of objects with userID, movieID and rating; add
+        ?merge=1 to merge them right away instead of at the next periodic merge.
+        '''
+        start_background_threads()
+        start = time.perf_counter()
+        body = request.get_json(force=True)
+        ratings = body if isinstance(body, list) else [body]
+        try:
+            triples = [(int(r['userID']), int(r['movieID']), float(r['rating'])) for r in ratings]
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Each rating needs an integer userID and movieID and a numeric rating.'}, 400
+
+        if ratings_log is not None:
+            ratings_log.append(triples)
+        else:
+            with model_lock:
+                if triples:
+                    user_ids, movie_ids, values = zip(*triples)
+                    knn.add_ratings(user_ids, movie_ids, values)
+
+        if request.args.get('merge'):
+            response = {'buffered': len(triples), 'merged_users': len(merge_ratings())}
+        else:
+            response = {'buffered': len(triples), 'pending': len(knn.pending_ratings)}
+        histograms.observe('ratings', time.perf_counter() - start)
+        return response
+
+
+class Cache_Stats(Resource):
+    def get(self):
+        return dict(recommendation_cache.stats(), batching=batcher.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(histograms.report(), mimetype='text/plain')
 
 
 # Host static html page
@@ -32,8 +156,12 @@ class Movie_Recs(Resource):
 def send_html(path):
     return send_from_directory('', path)
 
-api.add_resource(Movie_Recs, '/recommend/<string:userID>/<int:k>/<int:num_recs>')
+api.add_resource(Movie_Recs, '/recommend/<int:userID>/<int:k>/<int:num_recs>')
+api.add_resource(MF_Movie_Recs, '/recommend/mf/<int:userID>/<int:num_recs>')
+api.add_resource(Ratings, '/ratings')
+api.add_resource(Cache_Stats, '/cache/stats')
 
+# Development server; for multi-process serving use serve.py
 if __name__ == '__main__':
     app.run()
 
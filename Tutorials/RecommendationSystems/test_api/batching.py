@@ -0,0 +1,117 @@
+import time
+import queue
+import threading
+
+
+class _Request:
+    def __init__(self, userID, k, num_recs):
+        self.userID = userID
+        self.k = k
+        self.num_recs = num_recs
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    '''
+    Answers concurrent recommendation requests together
+
+    Requests served by the cache return immediately. The rest are queued; a background thread waits up to max_wait
+    seconds for up to max_batch of them, then finds the neighbors of every distinct user in the batch with one
+    Knn.find_knn_batch call (using the largest k requested; each request takes its own k closest) and fills the
+    cache from the results.
+
+    All model access happens under lock, which is shared with whatever merges new ratings into the model.
+    '''
+    max_batch = 64
+    max_wait = .002
+
+    def __init__(self, cache, lock, max_batch=64, max_wait=.002):
+        self.cache = cache
+        self.lock = lock
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.batches = 0
+        self.batched_requests = 0
+
+    def submit(self, userID, k=10, num_recs=10):
+        '''
+        Gets the recommendations for userID, waiting for the next batch on a cache miss
+
+        return: JSON string of Knn.getRecommendations(userID, k, num_recs)
+        '''
+        with self.lock:
+            result = self.cache.lookup(userID, k, num_recs)
+        if result is not None:
+            return result
+
+        self.start()
+        request = _Request(userID, k, num_recs)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def start(self):
+        # Threads do not survive fork(), so each process starts its own batch thread on first use
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.process(batch)
+
+    def process(self, batch):
+        with self.lock:
+            knn = self.cache.knn
+            pending = []
+            for request in batch:
+                if request.userID not in knn.user_index:
+                    request.error = KeyError(request.userID)
+                    continue
+                # An earlier request in this batch may already have cached the ranking
+                request.result = self.cache.lookup(request.userID, request.k, request.num_recs)
+                if request.result is None:
+                    pending.append(request)
+
+            try:
+                if pending:
+                    userIDs = list(dict.fromkeys(request.userID for request in pending))
+                    k = max(request.k for request in pending)
+                    neighbors = dict(zip(userIDs, knn.find_knn_batch(userIDs, k)))
+                    for request in pending:
+                        request.result = self.cache.get_recommendations(
+                            request.userID, request.k, request.num_recs, neighbors[request.userID].iloc[:request.k])
+            except Exception as error:
+                for request in pending:
+                    if request.result is None:
+                        request.error = error
+
+        self.batches += 1
+        self.batched_requests += len(batch)
+        for request in batch:
+            request.done.set()
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'requests': self.batched_requests,
+            'mean_batch_size': self.batched_requests / self.batches if self.batches else 0.
+        }
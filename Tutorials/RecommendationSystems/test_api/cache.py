@@ -0,0 +1,209 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache with an optional time-to-live
+
+    Entries past ttl seconds old are treated as missing. Once max_size entries are stored, adding another evicts
+    the least recently used one.
+    '''
+    max_size = 1024
+    ttl = None
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key -> (time stored, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def items(self):
+        '''Returns a snapshot of the (key, value) pairs, including expired ones, without touching the counters.'''
+        with self.lock:
+            return [(key, value) for key, (stored, value) in self.entries.items()]
+
+    def invalidate(self, predicate):
+        '''
+        Removes every entry for which predicate(key, value) is true
+
+        return: number of entries removed
+        '''
+        with self.lock:
+            stale = [key for key, (stored, value) in self.entries.items() if predicate(key, value)]
+            for key in stale:
+                del self.entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.
+        }
+
+
+class RecommendationCache:
+    '''
+    Caches recommendations in front of a Knn model at two levels:
+        results: the serialized response for each (userID, k, num_recs)
+        rankings: the neighbors and the ranked unrated movies for each (userID, k), so a request for a different
+                  num_recs only has to describe a different slice of the same ranking
+
+    Given a precomputed table (precompute.PrecomputedRecommendations), requests it covers are described straight
+    from the table, and only other users or settings are computed online.
+
+    Entries are dropped when ratings change: invalidate(userIDs) removes the entries of those users and of every
+    user whose cached or precomputed neighbors include them, and stops serving those users from the precomputed
+    table. If the model's
+    ratings were replaced without an invalidate call (its ratings_version changed), everything is dropped on the
+    next request and the precomputed table is no longer used. Neighbor lists of other users can still shift after
+    a change, which the ttl bounds.
+    '''
+    def __init__(self, knn, max_size=4096, ttl=300, precomputed=None):
+        self.knn = knn
+        self.results = LRUCache(max_size, ttl)
+        self.rankings = LRUCache(max_size, ttl)
+        self.ratings_version = knn.ratings_version
+        self.precomputed = precomputed
+        self.stale_precomputed = set()     # Users whose precomputed entries predate their latest ratings
+        self.precomputed_hits = 0
+
+    def lookup(self, userID, k=10, num_recs=10):
+        '''
+        Gets the recommendations for userID if they can be served without a neighbor search (from the results
+        cache, the rankings cache or the precomputed table)
+
+        return: JSON string, or None if the neighbors have to be computed
+        '''
+        self.check_version()
+
+        result = self.results.get((userID, k, num_recs))
+        if result is not None:
+            return result
+
+        movies = self.get_precomputed(userID, k, num_recs)
+        if movies is not None:
+            result = json.dumps(self.knn.describe_recommendations(movies))
+            self.results.put((userID, k, num_recs), result)
+            return result
+
+        ranking = self.rankings.get((userID, k))
+        if ranking is not None:
+            result = json.dumps(self.knn.describe_recommendations(ranking[1].index[0:num_recs]))
+            self.results.put((userID, k, num_recs), result)
+        return result
+
+    def get_recommendations(self, userID, k=10, num_recs=10, neighbors=None):
+        '''
+        Gets the recommendations for userID as a JSON string, computing only what is not cached
+
+        param neighbors: neighbors already found for userID (e.g. by a batched search), used on a cache miss
+
+        return: JSON string of Knn.getRecommendations(userID, k, num_recs)
+        '''
+        result = self.lookup(userID, k, num_recs)
+        if result is not None:
+            return result
+
+        # lookup() found no ranking for (userID, k), so compute one
+        if neighbors is None:
+            neighbors = self.knn.find_knn(userID, k)
+        ranking = (set(neighbors.index), self.knn.rank_unrated_movies(userID, neighbors.index))
+        self.rankings.put((userID, k), ranking)
+
+        result = json.dumps(self.knn.describe_recommendations(ranking[1].index[0:num_recs]))
+        self.results.put((userID, k, num_recs), result)
+        return result
+
+    def get_precomputed(self, userID, k, num_recs):
+        # Recommended movieIDs from the precomputed table, or None if it cannot answer this request
+        table = self.precomputed
+        if table is None or k != table.k or num_recs > table.num_recs or table.metric != self.knn.metric \
+                or userID in self.stale_precomputed:
+            return None
+        found = table.get_recommendations(userID, num_recs)
+        if found is None:
+            return None
+        self.precomputed_hits += 1
+        return found[0]
+
+    def check_version(self):
+        if self.knn.ratings_version != self.ratings_version:
+            self.clear()
+            self.precomputed = None
+
+    def invalidate(self, userIDs):
+        '''
+        Drops the cached entries affected by new ratings from userIDs
+
+        return: number of entries removed
+        '''
+        userIDs = set(userIDs)
+        stale_users = {userID for (userID, k), (neighbors, ranking) in self.rankings.items()
+                       if not neighbors.isdisjoint(userIDs)} | userIDs
+        if self.precomputed is not None and userIDs:
+            # Users served from the table whose precomputed neighbors changed
+            stale_users |= set(self.precomputed.get_users_with_neighbors(userIDs).tolist())
+
+        removed = self.rankings.invalidate(lambda key, value: key[0] in stale_users)
+        removed += self.results.invalidate(lambda key, value: key[0] in stale_users)
+        self.stale_precomputed |= stale_users
+        self.ratings_version = self.knn.ratings_version
+        return removed
+
+    def clear(self):
+        self.results.clear()
+        self.rankings.clear()
+        self.ratings_version = self.knn.ratings_version
+
+    def stats(self):
+        return {
+            'results': self.results.stats(),
+            'rankings': self.rankings.stats(),
+            'precomputed': {
+                'loaded': self.precomputed is not None,
+                'hits': self.precomputed_hits,
+                'stale_users': len(self.stale_precomputed)
+            }
+        }
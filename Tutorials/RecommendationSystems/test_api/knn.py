@@ -1,45 +1,243 @@
+import os
+import csv
 import datetime
 import numpy as np
 import pandas as pd
-from scipy.spatial.distance import hamming
+from scipy import sparse
+from ann import LshIndex
 
-def file_to_df(path, usecols, delimiter=','):
+def file_key(path):
+    '''Returns [size, modification time in ns] of a file, which changes whenever the file is rewritten.'''
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def file_to_df(path, usecols, delimiter=',', dtype=None, cache=True):
     '''
     Import text file data to a pandas dataframe object
 
+    The file is parsed with pandas' C parser, reading only usecols. When cache is set, the parsed columns are also
+    written to a binary cache next to the file (<path>.cache.npz); later loads read the cache instead of parsing the
+    text, as long as the file's size and modification time and the requested columns/dtypes have not changed.
+
     param path: path of text file containing data to import
     param usecols: list of columns to take
     param delimiter: character used to separate data elements in a line
+    param dtype: {column: dtype} for columns that should not be left as strings
+    param cache: read/write the binary cache
 
     return: DataFrame object of data frm text file
     '''
-    # Read file line-by-line into a list
-    with open(path, errors='replace') as file:
-        data = file.readlines()
+    dtype = dtype or {}
+    dtypes = [np.dtype(dtype.get(column, object)) for column in usecols]
+    key = file_key(path)
+    layout = np.array(['{0}:{1}'.format(column, column_dtype.str) for column, column_dtype in zip(usecols, dtypes)])
+    cache_path = path + '.cache.npz'
+
+    if cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                if np.array_equal(data['key'], key) and np.array_equal(data['layout'], layout):
+                    return pd.DataFrame({column: data['column_{0}'.format(i)].astype(column_dtype, copy=False)
+                                         for i, (column, column_dtype) in enumerate(zip(usecols, dtypes))})
+        except (OSError, KeyError, ValueError):
+            pass    # Unreadable or outdated cache; parse the file again
+
+    # Missing numbers ('' or \N) become NaN; text columns keep empty strings, like a plain split of each line
+    df = pd.read_csv(path, sep=delimiter, usecols=usecols, dtype={column: column_dtype
+                                                                  for column, column_dtype in zip(usecols, dtypes)},
+                     keep_default_na=False, na_values={column: ['', '\\N'] for column, column_dtype
+                                                       in zip(usecols, dtypes) if column_dtype.kind in 'fc'},
+                     quoting=csv.QUOTE_NONE, encoding_errors='replace')
+    df = df[usecols]
 
-    # Clean data
-    for i in range(len(data)):
-        data[i] = data[i].replace('\n', '')  # Remove newline chars
+    if cache:
+        columns = {'column_{0}'.format(i): df[column].to_numpy(dtype=str if column_dtype == object else column_dtype)
+                   for i, (column, column_dtype) in enumerate(zip(usecols, dtypes))}
+        try:
+            # Write to a temporary file first so a concurrent reader never sees a partial cache
+            temp_path = '{0}.{1}.tmp.npz'.format(cache_path, os.getpid())
+            np.savez(temp_path, key=key, layout=layout, **columns)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass    # Read-only data directory; keep working without a cache
 
-    # Convert array of strings into 2D list of strings
-    data = [line.split(delimiter) for line in data]
+    return df
 
-    # Convert 2D list to a DataFrame object
-    df = pd.DataFrame(data)
 
-    # Set column names to values in first row
-    df.columns = list(df.iloc[0])
+def top_k_smallest(values, k):
+    '''
+    Finds the positions of the k smallest values using a partial sort (argpartition)
 
-    # Take specified columns only
-    df = df[usecols]
+    param values: 1D array of values
+    param k: number of positions to return
 
-    # Delete first row since it contains column names and not values
-    df = df.drop(0)
+    return: np.ndarray of positions ordered by value; ties are broken by position so results are deterministic
+    '''
+    k = min(k, len(values))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    # Partial sort to find the k-th smallest value, then keep every position at or below it (including ties)
+    boundary = values[np.argpartition(values, k - 1)[k - 1]]
+    candidates = np.flatnonzero(values <= boundary)
+    return candidates[np.lexsort((candidates, values[candidates]))][:k]
 
-    # Reset to 0-based index
-    df.index = range(len(df.index))
 
-    return df
+def _gather(offsets, values, rows):
+    '''
+    Gathers the values of several rows of a CSR-style (offsets, values) layout
+
+    param offsets: offsets[i]:offsets[i + 1] is the slice of values belonging to row i
+    param values: values of every row, stored row after row
+    param rows: row positions to gather
+
+    return: (values of the rows concatenated in order, number of values taken from each row)
+    '''
+    starts = offsets[rows]
+    lengths = offsets[np.asarray(rows) + 1] - starts
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return values[positions], lengths
+
+
+def top_k_smallest_rows(values, k):
+    '''
+    Row-wise top_k_smallest over a 2D array
+
+    Rows whose k-th smallest value is not tied with a value outside the top k are selected with one vectorized
+    argpartition; the rest go through top_k_smallest so ties are broken by position exactly like it.
+
+    param values: 2D array of values
+    param k: number of positions to return per row
+
+    return: np.ndarray (rows x min(k, columns)) of column positions, each row ordered by value
+    '''
+    k = min(k, values.shape[1])
+    if k <= 0:
+        return np.empty((values.shape[0], 0), dtype=np.int64)
+
+    partition = np.argpartition(values, k - 1, axis=1)[:, :k]
+    top_values = np.take_along_axis(values, partition, axis=1)
+    order = np.lexsort((partition, top_values), axis=1)
+    nearest = np.take_along_axis(partition, order, axis=1)
+
+    # Rows with more than k values at or below the boundary have ties that argpartition may have cut arbitrarily
+    boundary = np.take_along_axis(values, nearest[:, -1:], axis=1)
+    tied = np.flatnonzero(np.count_nonzero(values <= boundary, axis=1) > k)
+    for row in tied:
+        nearest[row] = top_k_smallest(values[row], k)
+    return nearest
+
+
+class MovieMetadata:
+    '''
+    Movie titles, actors, directors and genres indexed by movie row, so details and tallies for a batch of movies
+    are array lookups rather than scans over the metadata frames.
+
+    Movie ids map to rows through the sorted movie_ids array. Actors and genres are stored CSR-style: the names of
+    movie row i are names[codes[offsets[i]:offsets[i + 1]]], in file order. Each movie keeps its first director.
+    '''
+    def __init__(self, df_movies, df_movie_actors, df_movie_directors, df_movie_genres):
+        self.movie_ids = np.unique(df_movies['id'].to_numpy(dtype=np.int64))
+        self.titles = np.full(len(self.movie_ids), '', dtype=object)
+        self.titles[self.get_rows(df_movies['id'])] = df_movies['title'].to_numpy(dtype=object)
+
+        self.actor_offsets, self.actor_codes, self.actor_names = \
+            self._group(df_movie_actors['movieID'], df_movie_actors['actorName'])
+        self.genre_offsets, self.genre_codes, self.genre_names = \
+            self._group(df_movie_genres['movieID'], df_movie_genres['genre'])
+
+        # First director listed for each movie (-1 for movies without one)
+        director_rows = self.get_rows(df_movie_directors['movieID'])
+        director_codes, self.director_names = pd.factorize(df_movie_directors['directorName'].to_numpy(dtype=object))
+        known = director_rows >= 0
+        first = np.unique(director_rows[known], return_index=True)
+        self.director_codes = np.full(len(self.movie_ids), -1, dtype=np.int64)
+        self.director_codes[first[0]] = director_codes[known][first[1]]
+
+    def get_rows(self, movie_ids):
+        '''Returns the row of each movie id (-1 for ids missing from the movies file).'''
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.movie_ids, movie_ids), max(len(self.movie_ids) - 1, 0))
+        found = len(self.movie_ids) > 0 and self.movie_ids[rows] == movie_ids
+        return np.where(found, rows, -1)
+
+    def _group(self, movie_ids, names):
+        # Builds CSR-style offsets and name codes for a (movieID, name) table, dropping movies missing from the index
+        rows = self.get_rows(movie_ids)
+        codes, uniques = pd.factorize(np.asarray(names, dtype=object))
+        known = rows >= 0
+        rows, codes = rows[known], codes[known]
+
+        order = np.argsort(rows, kind='mergesort')
+        offsets = np.zeros(len(self.movie_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(rows, minlength=len(self.movie_ids)))
+        return offsets, codes[order], np.asarray(uniques, dtype=object)
+
+    def get_titles(self, movie_ids):
+        '''Returns the title of each movie ('' for ids missing from the movies file).'''
+        rows = self.get_rows(movie_ids)
+        return np.where(rows >= 0, self.titles[rows], '')
+
+    def get_details(self, movie_ids):
+        '''
+        Gets the title, actors, director and genres of each movie
+
+        param movie_ids: movie ids to get details for
+
+        return: list of {'title': [title], 'actors': [...], 'director': [name], 'genres': [...]} dicts
+        '''
+        rows = self.get_rows(movie_ids)
+        details = []
+        for row in rows:
+            if row < 0:
+                details.append({'title': [''], 'actors': [], 'director': [''], 'genres': []})
+                continue
+            actors = self.actor_codes[self.actor_offsets[row]:self.actor_offsets[row + 1]]
+            genres = self.genre_codes[self.genre_offsets[row]:self.genre_offsets[row + 1]]
+            director = self.director_codes[row]
+            details.append({
+                'title': [self.titles[row]],
+                'actors': list(self.actor_names[actors]),
+                'director': [self.director_names[director] if director >= 0 else ''],
+                'genres': list(self.genre_names[genres])
+            })
+        return details
+
+    def count_values(self, movie_ids):
+        '''
+        Tallies how often each genre, actor and director appears among a batch of movies
+
+        param movie_ids: movie ids to tally
+
+        return: dict of 'genres', 'actors' and 'directors', each a list of (name, count) pairs sorted by count
+                (descending) and then name
+        '''
+        rows = self.get_rows(movie_ids)
+        rows = rows[rows >= 0]
+
+        genre_codes, _ = _gather(self.genre_offsets, self.genre_codes, rows)
+        actor_codes, _ = _gather(self.actor_offsets, self.actor_codes, rows)
+        director_codes = self.director_codes[rows]
+
+        return {
+            'genres': _tally(genre_codes, self.genre_names),
+            'actors': _tally(actor_codes, self.actor_names),
+            'directors': _tally(director_codes[director_codes >= 0], self.director_names)
+        }
+
+
+def _tally(codes, names):
+    # (name, count) pairs for every name that occurs in codes, most frequent first, skipping empty names
+    counts = np.bincount(codes, minlength=len(names))
+    present = np.flatnonzero(counts)
+    present = present[names[present] != '']
+    present = present[np.lexsort((names[present], -counts[present]))]
+    return [(names[code], int(counts[code])) for code in present]
+
+
+def _indicator(ratings):
+    # Rated-movie indicator sharing the structure of a CSR ratings matrix
+    return sparse.csr_matrix((np.ones_like(ratings.data), ratings.indices, ratings.indptr), shape=ratings.shape)
 
 
 class Knn:
@@ -50,7 +248,21 @@ class Knn:
     movie_genres_path = 'data/movielens_2k/movie_genres.dat'
     user_rated_movies_path = 'data/movielens_2k/user_ratedmovies.dat'
 
-    def __init__(self):
+    # Merged ratings are compacted into the ratings matrix once the delta holds this fraction of its ratings
+    delta_fraction = .05
+
+    def __init__(self, metric='hamming', use_index=False, index_path=None):
+        '''
+        param metric: default distance metric ('hamming', 'cosine' or 'pearson')
+        param use_index: answer find_knn from an approximate nearest neighbor index instead of scanning every user
+        param index_path: .npz file to load the index from, or to save a newly built index to
+        '''
+        self.metric = metric
+        self.index = None
+        self.ratings_version = 0
+        self.data_key = file_key(self.user_rated_movies_path).tolist()    # Identifies the ratings file loaded
+        self.pending_ratings = []   # (userID, movieID, rating) triples waiting for merge_ratings
+
         #############
         # Load data #
         #############
@@ -58,80 +270,556 @@ class Knn:
                                usecols=['id', 'title', 'imdbID', 'rtID', 'rtAllCriticsRating', 'rtAllCriticsNumReviews',
                                         'rtAllCriticsScore', 'rtTopCriticsRating', 'rtTopCriticsNumReviews',
                                         'rtTopCriticsNumFresh', 'rtTopCriticsNumRotten', 'rtTopCriticsScore',
-                                        'rtAudienceRating', 'rtAudienceNumRatings', 'rtAudienceScore'])
+                                        'rtAudienceRating', 'rtAudienceNumRatings', 'rtAudienceScore'],
+                               dtype={'id': np.int64, 'rtAllCriticsRating': np.float64,
+                                      'rtAllCriticsNumReviews': np.float64, 'rtAllCriticsScore': np.float64,
+                                      'rtTopCriticsRating': np.float64, 'rtTopCriticsNumReviews': np.float64,
+                                      'rtTopCriticsNumFresh': np.float64, 'rtTopCriticsNumRotten': np.float64,
+                                      'rtTopCriticsScore': np.float64, 'rtAudienceRating': np.float64,
+                                      'rtAudienceNumRatings': np.float64, 'rtAudienceScore': np.float64})
         self.df_movie_actors = file_to_df(self.movie_actors_path, delimiter='\t',
-                                     usecols=['movieID', 'actorID', 'actorName', 'ranking'])
+                                     usecols=['movieID', 'actorID', 'actorName', 'ranking'],
+                                     dtype={'movieID': np.int64, 'ranking': np.int64})
         self.df_movie_directors = file_to_df(self.movie_directors_path, delimiter='\t',
-                                        usecols=['movieID', 'directorID', 'directorName'])
-        self.df_movie_genres = file_to_df(self.movie_genres_path, delimiter='\t', usecols=['movieID', 'genre'])
-        self.df_user_rated_movies = file_to_df(self.user_rated_movies_path, delimiter='\t', usecols=['userID', 'movieID', 'rating'])
+                                        usecols=['movieID', 'directorID', 'directorName'],
+                                        dtype={'movieID': np.int64})
+        self.df_movie_genres = file_to_df(self.movie_genres_path, delimiter='\t', usecols=['movieID', 'genre'],
+                                          dtype={'movieID': np.int64})
+        self.df_user_rated_movies = file_to_df(self.user_rated_movies_path, delimiter='\t',
+                                               usecols=['userID', 'movieID', 'rating'],
+                                               dtype={'userID': np.int64, 'movieID': np.int64,
+                                                      'rating': np.float32})
+
+        # Index movie metadata by movie so recommendation details are array lookups
+        self.metadata = MovieMetadata(self.df_movies, self.df_movie_actors, self.df_movie_directors,
+                                      self.df_movie_genres)
+
+        # Create sparse User/Movie ratings matrix (CSR for user rows)
+        self.set_ratings(self.df_user_rated_movies['userID'],
+                         self.df_user_rated_movies['movieID'],
+                         self.df_user_rated_movies['rating'])
+
+        if use_index:
+            if index_path and os.path.exists(index_path):
+                self.load_index(index_path)
+            else:
+                self.build_index(path=index_path)
+
+    def set_ratings(self, user_ids, movie_ids, ratings):
+        '''
+        Builds the sparse ratings structures from (userID, movieID, rating) columns. Memory scales with the number
+        of ratings rather than users x movies.
+
+        param user_ids: userID of each rating
+        param movie_ids: movieID of each rating
+        param ratings: rating values
+        '''
+        user_codes, self.user_ids = pd.factorize(np.asarray(user_ids), sort=True)
+        movie_codes, self.movie_ids = pd.factorize(np.asarray(movie_ids), sort=True)
+        shape = (len(self.user_ids), len(self.movie_ids))
+
+        self.set_ratings_matrix(sparse.csr_matrix((np.asarray(ratings, dtype=np.float32), (user_codes, movie_codes)),
+                                                  shape=shape))
+        self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        self.compute_user_stats()
+        self.ratings_version = getattr(self, 'ratings_version', 0) + 1
+
+        # Row positions may have changed, so an existing index is rebuilt with the same settings
+        if getattr(self, 'index', None) is not None:
+            self.build_index(self.index.num_tables, self.index.num_bits, self.index.num_probes, self.index.metric)
+
+    def set_ratings_matrix(self, ratings):
+        # Installs a CSR ratings matrix as the base, with an empty delta
+        self._base = ratings
+        self._base_rated = _indicator(ratings)
+        self._set_delta(np.array([], dtype=np.int64), sparse.csr_matrix((0, ratings.shape[1]), dtype=np.float32))
+
+    def _set_delta(self, rows, delta):
+        # Installs the delta: the current ratings of the users at rows (sorted), one row each
+        self._delta_rows = rows
+        self._delta = delta
+        self._delta_rated = _indicator(delta)
+        self._delta_position = np.full(self._base.shape[0], -1, dtype=np.int64)
+        self._delta_position[rows] = np.arange(len(rows))
+
+    @property
+    def ratings(self):
+        '''CSR ratings matrix (users x movies). Pending delta rows are compacted into it first.'''
+        self.compact()
+        return self._base
+
+    @property
+    def rated(self):
+        '''CSR rated-movie indicator sharing the structure of ratings.'''
+        self.compact()
+        return self._base_rated
+
+    def get_ratings(self, rows, indicator=False):
+        '''
+        Gets the current ratings of a block of users, reading users changed since the last compaction from the delta
+
+        param rows: row positions of the users
+        param indicator: return the rated-movie indicator instead of the ratings
+
+        return: CSR matrix with one row per entry of rows
+        '''
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        base, delta = (self._base_rated, self._delta_rated) if indicator else (self._base, self._delta)
+        positions = self._delta_position[rows]
+        changed = positions >= 0
+        if not changed.any():
+            return base[rows]
+
+        # Stack the base rows of unchanged users and the delta rows of changed ones, then put them back in order
+        order = np.empty(len(rows), dtype=np.int64)
+        order[~changed] = np.arange(np.count_nonzero(~changed))
+        order[changed] = np.count_nonzero(~changed) + np.arange(np.count_nonzero(changed))
+        return sparse.vstack([base[rows[~changed]], delta[positions[changed]]], format='csr')[order]
+
+    def _dot(self, vector, indicator=False):
+        # ratings.dot(vector) (or rated.dot) over every user, with delta rows replacing base rows
+        base, delta = (self._base_rated, self._delta_rated) if indicator else (self._base, self._delta)
+        products = base.dot(vector)
+        products[self._delta_rows] = delta.dot(vector)
+        return products
+
+    def _dot_transposed(self, block, indicator=False):
+        # block.dot(ratings.T) (or rated.T) as a dense array, with delta rows replacing base rows
+        base, delta = (self._base_rated, self._delta_rated) if indicator else (self._base, self._delta)
+        products = block.dot(base.T).toarray()
+        products[:, self._delta_rows] = block.dot(delta.T).toarray()
+        return products
+
+    def add_ratings(self, user_ids, movie_ids, ratings, merge_threshold=None):
+        '''
+        Buffers new or changed ratings; they take effect at the next merge_ratings()
+
+        param user_ids: userID of each rating (new users are added)
+        param movie_ids: movieID of each rating (new movies are added)
+        param ratings: rating values; a rating for a movie the user already rated replaces the old one
+        param merge_threshold: merge right away once this many ratings are buffered
+
+        return: userIDs whose ratings changed if a merge ran, otherwise an empty list
+        '''
+        self.pending_ratings.extend(zip(user_ids, movie_ids, ratings))
+        if merge_threshold is not None and len(self.pending_ratings) >= merge_threshold:
+            return self.merge_ratings()
+        return []
+
+    def merge_ratings(self):
+        '''
+        Merges the buffered ratings
+
+        The new rows of the users with new ratings go to a small delta matrix next to the base ratings matrix, which
+        queries combine with the base (see get_ratings), so a merge costs time in proportion to the delta rather
+        than to every rating. The delta is compacted into the base once it holds more than delta_fraction of the
+        base's ratings. Per-user stats and the nearest neighbor index are updated for the affected users only.
+        Callers that cache neighbors should invalidate the returned users.
 
-        # Create User/Movie ratings matrix
-        self.df_user_movie_ratings = self.df_user_rated_movies.pivot(index='userID', columns='movieID', values='rating')
+        return: list of userIDs whose ratings changed
+        '''
+        if not self.pending_ratings:
+            return []
+        pending = pd.DataFrame(self.pending_ratings, columns=['userID', 'movieID', 'rating'])
+        self.pending_ratings = []
+        pending = pending.drop_duplicates(['userID', 'movieID'], keep='last')
+
+        # Add unseen users and movies after the existing rows/columns
+        pending_users = pending['userID'].to_numpy()
+        pending_movies = pending['movieID'].to_numpy()
+        new_users = pd.unique(pending_users[pd.Index(self.user_ids).get_indexer(pending_users) < 0])
+        new_movies = pd.unique(pending_movies[pd.Index(self.movie_ids).get_indexer(pending_movies) < 0])
+        for user_id in new_users:
+            self.user_index[user_id] = len(self.user_index)
+        for movie_id in new_movies:
+            self.movie_index[movie_id] = len(self.movie_index)
+        self.user_ids = np.concatenate([self.user_ids, np.asarray(new_users, dtype=self.user_ids.dtype)])
+        self.movie_ids = np.concatenate([self.movie_ids, np.asarray(new_movies, dtype=self.movie_ids.dtype)])
+        num_users, num_movies = len(self.user_ids), len(self.movie_ids)
+        self._resize(num_users, num_movies)
+
+        rows = pd.Index(self.user_ids).get_indexer(pending_users).astype(np.int64)
+        columns = pd.Index(self.movie_ids).get_indexer(pending_movies).astype(np.int64)
+        values = pending['rating'].to_numpy(dtype=np.float32)
+        affected = np.unique(rows)
+
+        # Current entries of the affected rows, keyed by row * num_movies + column (sorted, as CSR rows are)
+        old = self.get_ratings(affected)
+        old_rows = np.repeat(affected, np.diff(old.indptr))
+        old_keys = old_rows * num_movies + old.indices
+        new_keys = rows * num_movies + columns
+        order = np.argsort(new_keys)
+        new_keys, values = new_keys[order], values[order]
+
+        # Drop existing entries the new ratings replace, then insert the new ones in key order
+        replaced = np.zeros(len(old_keys), dtype=bool)
+        positions = np.searchsorted(old_keys, new_keys)
+        hits = positions < len(old_keys)
+        hits[hits] = old_keys[positions[hits]] == new_keys[hits]
+        replaced[positions[hits]] = True
+        old_keys, old_values = old_keys[~replaced], old.data[~replaced]
+        positions = np.searchsorted(old_keys, new_keys)
+        block_keys = np.insert(old_keys, positions, new_keys)
+        block_values = np.insert(old_values, positions, values)
+        block_rows, block_columns = np.divmod(block_keys, num_movies)
+        block_lengths = np.bincount(block_rows, minlength=num_users)[affected]
+        block = sparse.csr_matrix((block_values, block_columns, np.concatenate([[0], np.cumsum(block_lengths)])),
+                                  shape=(len(affected), num_movies))
+
+        # Replace the delta rows of the affected users and add the others, keeping the delta sorted by row
+        kept = self._delta_rows[~np.isin(self._delta_rows, affected)]
+        delta_rows = np.concatenate([kept, affected])
+        order = np.argsort(delta_rows)
+        delta = sparse.vstack([self._delta[self._delta_position[kept]], block], format='csr')[order]
+        self._set_delta(delta_rows[order], delta)
+        if self._delta.nnz > self.delta_fraction * self._base.nnz:
+            self.compact()
+
+        # Grow the per-user stats for new users, then recompute them for the affected users only
+        grow = num_users - len(self.num_rated)
+        if grow:
+            self.num_rated = np.concatenate([self.num_rated, np.zeros(grow, dtype=np.int64)])
+            self.means = np.concatenate([self.means, np.zeros(grow)])
+            self.norms = np.concatenate([self.norms, np.zeros(grow)])
+            self.centered_norms = np.concatenate([self.centered_norms, np.zeros(grow)])
+        self.compute_user_stats(affected)
+
+        changed = list(self.user_ids[affected])
+        if self.index is not None:
+            self.index.add_features(num_movies)
+            self.update_index(changed)
+        return changed
+
+    def _resize(self, num_users, num_movies):
+        # Grows the base and delta matrices to new users (empty rows) and new movies (empty columns), sharing their
+        # indices and data
+        if self._base.shape == (num_users, num_movies):
+            return
+        base = self._base
+        indptr = np.concatenate([base.indptr, np.full(num_users - base.shape[0], base.indptr[-1])])
+        self._base = sparse.csr_matrix((base.data, base.indices, indptr), shape=(num_users, num_movies))
+        self._base_rated = sparse.csr_matrix((self._base_rated.data, base.indices, indptr),
+                                             shape=(num_users, num_movies))
+        delta = self._delta
+        self._set_delta(self._delta_rows, sparse.csr_matrix((delta.data, delta.indices, delta.indptr),
+                                                            shape=(delta.shape[0], num_movies)))
+
+    def compact(self):
+        '''
+        Writes the delta rows into the base ratings matrix. The rows in between are moved to their new positions
+        with slice copies, without re-sorting or re-factorizing the rest of the matrix.
+        '''
+        if not len(self._delta_rows):
+            return
+        base, delta, affected = self._base, self._delta, self._delta_rows
+        num_users = base.shape[0]
+
+        # New row lengths and offsets
+        lengths = np.diff(base.indptr)
+        lengths[affected] = np.diff(delta.indptr)
+        new_indptr = np.concatenate([[0], np.cumsum(lengths)])
+
+        new_indices = np.empty(new_indptr[-1], dtype=base.indices.dtype)
+        new_data = np.empty(new_indptr[-1], dtype=np.float32)
+
+        # Unaffected rows between two affected rows are contiguous in both layouts, so each run is one slice copy
+        for start, stop in zip(np.concatenate([[0], affected + 1]), np.concatenate([affected, [num_users]])):
+            if stop > start and base.indptr[stop] > base.indptr[start]:
+                source = slice(base.indptr[start], base.indptr[stop])
+                destination = slice(new_indptr[start], new_indptr[stop])
+                new_indices[destination] = base.indices[source]
+                new_data[destination] = base.data[source]
+
+        # Affected rows are written from the delta, which is sorted by row
+        destination = np.repeat(new_indptr[affected] - delta.indptr[:-1], np.diff(delta.indptr)) + \
+            np.arange(delta.nnz)
+        new_indices[destination] = delta.indices
+        new_data[destination] = delta.data
+
+        self.set_ratings_matrix(sparse.csr_matrix((new_data, new_indices, new_indptr), shape=base.shape))
+
+    def compute_user_stats(self, rows=None):
+        '''
+        Precomputes the per-user values the distance metrics need: number of rated movies, mean rating, norm of the
+        ratings and norm of the mean-centered ratings.
 
-        # Replace null values with a numerical equivalent, then cast all data types in table to float
-        self.df_user_movie_ratings.fillna(value=np.nan, inplace=True)
-        self.df_user_movie_ratings = pd.DataFrame(self.df_user_movie_ratings, dtype=np.float32)
+        param rows: row positions to recompute (all users if not specified)
+        '''
+        if rows is None:
+            num_users = len(self.user_ids)
+            rows = np.arange(num_users)
+            self.num_rated = np.zeros(num_users, dtype=np.int64)
+            self.means = np.zeros(num_users)
+            self.norms = np.zeros(num_users)
+            self.centered_norms = np.zeros(num_users)
+
+        block = self.get_ratings(rows)
+        num_rated = np.diff(block.indptr)
+        sums = np.asarray(block.sum(axis=1, dtype=np.float64)).ravel()
+        sums_sq = np.asarray(block.multiply(block).sum(axis=1, dtype=np.float64)).ravel()
+        means = np.divide(sums, num_rated, out=np.zeros(len(rows)), where=num_rated > 0)
+
+        self.num_rated[rows] = num_rated
+        self.means[rows] = means
+        self.norms[rows] = np.sqrt(sums_sq)
+        # sum((r - mean)^2) = sum(r^2) - n * mean^2
+        self.centered_norms[rows] = np.sqrt(np.maximum(sums_sq - num_rated * means ** 2, 0))
+
+    def distances(self, userID, metric=None, rows=None):
+        '''
+        Finds the distance between userID and every user (including userID itself) with one sparse matrix-vector
+        product over the ratings matrix.
 
+        Metrics:
+            hamming: fraction of movies whose rated/unrated status differs between the two users
+            cosine: 1 - cosine similarity of the rating vectors (unrated movies count as 0)
+            pearson: 1 - cosine similarity of the rating vectors after subtracting each user's mean rating
+
+        param userID: userID to measure distances from
+        param metric: 'hamming', 'cosine' or 'pearson' (defaults to self.metric)
+        param rows: row positions of the users to measure (all users if not specified)
+
+        return: np.ndarray of distances, ordered like the rows of the ratings matrix (or like rows)
+        '''
+        metric = metric or self.metric
+        row = self.user_index[userID]
+        user_row = self.get_ratings([row])
+        num_movies = len(self.movie_ids)
+
+        if rows is None:
+            dot = self._dot
+            num_rated, means, norms, centered_norms = self.num_rated, self.means, self.norms, self.centered_norms
+        else:
+            ratings = self.get_ratings(rows)
+            rated = _indicator(ratings)
+
+            def dot(vector, indicator=False):
+                return (rated if indicator else ratings).dot(vector)
+            num_rated, means, norms, centered_norms = \
+                self.num_rated[rows], self.means[rows], self.norms[rows], self.centered_norms[rows]
+
+        if metric == 'hamming':
+            # |A xor B| = |A| + |B| - 2|A and B|, where A, B are the sets of rated movies
+            user_rated = np.zeros(num_movies)
+            user_rated[user_row.indices] = 1
+            overlap = dot(user_rated, indicator=True)
+            return (num_rated + self.num_rated[row] - 2 * overlap) / num_movies
+
+        user_ratings = np.zeros(num_movies)
+        user_ratings[user_row.indices] = user_row.data
+        dots = dot(user_ratings)
+
+        if metric == 'cosine':
+            norms = norms * self.norms[row]
+        elif metric == 'pearson':
+            # Centered dot product: sum over the query's rated movies of (r_u - mean_u) * (r_q - mean_q)
+            user_centered = np.zeros(num_movies)
+            user_centered[user_row.indices] = user_row.data - self.means[row]
+            dots = dot(user_centered) - means * dot(user_centered, indicator=True)
+            norms = centered_norms * self.centered_norms[row]
+        else:
+            raise ValueError("Unknown distance metric: {0}".format(metric))
+
+        similarity = np.divide(dots, norms, out=np.zeros(len(dots)), where=norms > 0)
+        return 1 - similarity
+
+    def distance_block(self, rows, metric=None):
+        '''
+        Finds the distances from a block of users to every user with sparse matrix-matrix products, using the same
+        metrics as distances()
+
+        param rows: row positions of the users to measure from
+        param metric: 'hamming', 'cosine' or 'pearson' (defaults to self.metric)
+
+        return: np.ndarray (len(rows) x users) of distances
+        '''
+        metric = metric or self.metric
+        rows = np.asarray(rows)
+
+        if metric == 'hamming':
+            overlap = self._dot_transposed(self.get_ratings(rows, indicator=True), indicator=True)
+            return (self.num_rated[rows, np.newaxis] + self.num_rated - 2 * overlap) / len(self.movie_ids)
+
+        if metric == 'cosine':
+            dots = self._dot_transposed(self.get_ratings(rows))
+            norms = np.outer(self.norms[rows], self.norms)
+        elif metric == 'pearson':
+            centered = self.get_ratings(rows).astype(np.float64)
+            centered.data -= np.repeat(self.means[rows], np.diff(centered.indptr))
+            dots = self._dot_transposed(centered) - self.means * self._dot_transposed(centered, indicator=True)
+            norms = np.outer(self.centered_norms[rows], self.centered_norms)
+        else:
+            raise ValueError("Unknown distance metric: {0}".format(metric))
+
+        similarity = np.divide(dots, norms, out=np.zeros(dots.shape), where=norms > 0)
+        return 1 - similarity
 
     def hamming_distance(self, userID_1, userID_2):
         '''
         Finds hamming distance between two users.
-        Hamming distance is the number of features that differ between the two users.
+        Hamming distance is the fraction of movies whose rated/unrated status differs between the two users.
+
+        '''
+        return self.distances(userID_1, 'hamming')[self.user_index[userID_2]]
 
+
+    def index_vectors(self, metric=None, rows=None):
+        '''
+        Gets the vectors the nearest neighbor index hashes for a metric: the rated-movie indicator for hamming, the
+        ratings for cosine and the mean-centered ratings for pearson.
+
+        param metric: distance metric (defaults to self.metric)
+        param rows: row positions to get (all users if not specified)
+
+        return: CSR matrix with one row per user
         '''
-        distance = hamming(self.df_user_movie_ratings.loc[userID_1], self.df_user_movie_ratings.loc[userID_2])
-        return distance
+        metric = metric or self.metric
+        rows = np.arange(len(self.user_ids)) if rows is None else np.asarray(rows)
+
+        if metric == 'hamming':
+            return self.get_ratings(rows, indicator=True)
+        if metric == 'cosine':
+            return self.get_ratings(rows)
+        if metric == 'pearson':
+            block = self.get_ratings(rows).astype(np.float32)
+            block.data -= np.repeat(self.means[rows], np.diff(block.indptr)).astype(np.float32)
+            return block
+        raise ValueError("Unknown distance metric: {0}".format(metric))
+
+    def build_index(self, num_tables=16, num_bits=8, num_probes=2, metric=None, path=None):
+        '''
+        Builds an approximate nearest neighbor index of every user (see ann.LshIndex for the tradeoffs of each
+        setting) and uses it in find_knn
+
+        param metric: metric the index serves (defaults to self.metric)
+        param path: .npz file to save the index to
+        '''
+        metric = metric or self.metric
+        self.index = LshIndex(self.ratings.shape[1], num_tables, num_bits, num_probes, metric,
+                              merge_threshold=max(1024, self.ratings.shape[0]))
+        self.index.add(np.arange(self.ratings.shape[0]), self.index_vectors(metric))
+        self.index.merge()
+
+        if path:
+            self.index.save(path)
 
+    def load_index(self, path):
+        '''
+        Loads an index saved by build_index, rebuilding it if it does not match the current ratings matrix
+
+        param path: .npz file to load
+        '''
+        index = LshIndex.load(path)
+        if index.num_features != self.ratings.shape[1] or len(index) != self.ratings.shape[0]:
+            self.build_index(index.num_tables, index.num_bits, index.num_probes, index.metric, path)
+        else:
+            self.index = index
+
+    def update_index(self, userIDs):
+        '''
+        Re-hashes new or changed users into the index without rebuilding it
+
+        param userIDs: userIDs whose ratings were added or changed
+        '''
+        if self.index is None:
+            return
+        rows = np.array([self.user_index[userID] for userID in userIDs], dtype=np.int64)
+        self.index.add(rows, self.index_vectors(self.index.metric, rows))
 
-    def find_knn(self, userID, k=3):
+    def find_knn(self, userID, k=3, metric=None, exact=False):
         '''
-        Finds k nearest neighbors of userID based on hamming distance
+        Finds k nearest neighbors of userID
+
+        When an index for the metric has been built, only the users it returns as candidates are scored; exact
+        search is used otherwise, or when the index finds fewer than k candidates.
 
         param userID: userID to get neighbors for
+        param k: number of neighbors (capped at the number of other users)
+        param metric: distance metric (defaults to self.metric)
+        param exact: scan every user even if an index is available
+
+        return: Series of distances indexed by the neighbors' userIDs (closest first)
+        '''
+        metric = metric or self.metric
+        row = self.user_index[userID]
+        # The user itself is excluded, so there are at most num_users - 1 neighbors (as in precompute)
+        k = min(k, len(self.user_ids) - 1)
+
+        rows = None
+        if not exact and self.index is not None and self.index.metric == metric:
+            rows = self.index.query(self.index_vectors(metric, [row]))
+            rows = rows[rows != row]
+            if len(rows) < k:
+                rows = None
+
+        if rows is None:
+            # Exclude the specified user, then select the k closest users without sorting every user
+            distances = self.distances(userID, metric)
+            distances[row] = np.inf
+            rows = np.arange(len(distances))
+        else:
+            distances = self.distances(userID, metric, rows)
+        nearest = top_k_smallest(distances, k)
+
+        return pd.Series(distances[nearest], index=self.user_ids[rows[nearest]], name='distance')
+
+    def find_knn_batch(self, userIDs, k=3, metric=None):
+        '''
+        Finds the k nearest neighbors of several users at once with one distance_block product. Results match
+        find_knn(exact=True); when an index serves the metric each user is looked up through it instead.
+
+        param userIDs: userIDs to get neighbors for
         param k: number of neighbors
+        param metric: distance metric (defaults to self.metric)
+
+        return: list of Series of distances indexed by the neighbors' userIDs (closest first), one per userID
         '''
-        # Get data for all other users except specified user
-        df_other_user_movie_ratings = self.df_user_movie_ratings.loc[self.df_user_movie_ratings.index != userID]
+        metric = metric or self.metric
+        if self.index is not None and self.index.metric == metric:
+            return [self.find_knn(userID, k, metric) for userID in userIDs]
+        k = min(k, len(self.user_ids) - 1)
 
-        # Calculate distance between specified user and all other users
-        df_other_user_movie_ratings['distance'] = df_other_user_movie_ratings.apply(
-            lambda row: self.hamming_distance(userID, row.name), axis=1)
+        rows = np.array([self.user_index[userID] for userID in userIDs], dtype=np.int64)
+        distances = self.distance_block(rows, metric)
+        distances[np.arange(len(rows)), rows] = np.inf
+        nearest = top_k_smallest_rows(distances, k)
 
-        # Sort users by distance (closest first)
-        df_other_user_movie_ratings.sort_values(['distance'], axis=0, inplace=True)
+        return [pd.Series(distances[i, nearest[i]], index=self.user_ids[nearest[i]], name='distance')
+                for i in range(len(rows))]
 
-        # Take top k users (k nearest users)
-        df_other_user_movie_ratings = df_other_user_movie_ratings.iloc[0:k]
+    def get_average_ratings(self, userIDs):
+        '''
+        Averages the ratings of a group of users per movie, counting only the users who rated each movie
 
-        return df_other_user_movie_ratings
+        param userIDs: userIDs to average
+
+        return: Series of mean ratings indexed by movieID (movies nobody in the group rated are left out)
+        '''
+        rows = [self.user_index[userID] for userID in userIDs]
+        block = self.get_ratings(rows)
+        sums = np.asarray(block.sum(axis=0, dtype=np.float64)).ravel()
+        counts = np.bincount(block.indices, minlength=len(self.movie_ids))
+
+        rated = np.flatnonzero(counts)
+        return pd.Series(sums[rated] / counts[rated], index=self.movie_ids[rated], name='mean')
 
     def get_unrated_movies_for_user(self, userID):
         '''
-        Gets unrated movies from user/movie ratings matrix by finding row of userID,
-        then finding any column (movieID) with a null value
+        Gets the movies missing from userID's row of the sparse ratings matrix
 
         param userID: userID to get unrated movies for
 
         return: list of movieID's that the specified user has not rated yet
         '''
-
-        # n = single user's movie ratings
-        n = self.df_user_movie_ratings.loc[self.df_user_movie_ratings.index == userID]
-        cols = list(n.columns)
-        unrated_movies = [cols[i] for i in range(len(cols)) if pd.isnull(n[str(cols[i])][0])]
+        unrated = np.ones(len(self.movie_ids), dtype=bool)
+        unrated[self.get_ratings([self.user_index[userID]]).indices] = False
+        unrated_movies = list(self.movie_ids[unrated])
 
         return unrated_movies
 
     def get_movie_details(self, movie_id):
-        movie_details = {}
-        movie_details['title'] = [self.df_movies.loc[self.df_movies.id == movie_id].iloc[0].title]
-        movie_details['actors'] = list(self.df_movie_actors.loc[self.df_movie_actors.movieID == movie_id].actorName)
-        movie_details['director'] = [
-            self.df_movie_directors.loc[self.df_movie_directors.movieID == movie_id].iloc[0].directorName]
-        movie_details['genres'] = list(self.df_movie_genres.loc[self.df_movie_genres.movieID == movie_id].genre)
-
-        return movie_details
+        return self.metadata.get_details([movie_id])[0]
 
     def movie_details_to_df(self, movie_details):
         data = [movie_details['title'],
@@ -144,47 +832,41 @@ class Knn:
 
         return df
 
-    def getRecommendations(self, userID, k=10, num_recs=10):
-        df_knn = self.find_knn(userID, k)
+    def rank_unrated_movies(self, userID, neighbors):
+        '''
+        Ranks the movies userID has not rated by their mean rating among a group of neighbors
 
+        param userID: userID to rank movies for
+        param neighbors: userIDs of the neighbors
+
+        return: Series of mean ratings indexed by movieID, highest first
+        '''
         # Get mean of movie ratings for nearest neighbors
-        avg = df_knn.agg(['mean'], numeric_only=True)
+        avg = self.get_average_ratings(neighbors)
 
-        # Place avg movie ratings into a column, then remove any movies rated by the user
-        unrated_movies = self.get_unrated_movies_for_user(userID)
-        avg_filtered = avg.transpose().loc[unrated_movies]
+        # Remove any movies rated by the user
+        rated_movies = self.movie_ids[self.get_ratings([self.user_index[userID]]).indices]
+        avg_filtered = avg.drop(rated_movies, errors='ignore')
 
         # Sort movies based on mean average (descending)
-        avg_sorted = avg_filtered.sort_values(['mean'], axis=0, ascending=False)
-
-        # Get top recommendations
-        top_recommendations = avg_sorted[0:num_recs]
+        return avg_filtered.sort_values(ascending=False, kind='mergesort')
 
-        # Get list of all movie details after converting each set of movie details to a dataframe
-        movie_details_df_list = [self.movie_details_to_df(self.get_movie_details(movieID)) for movieID in
-                                 list(top_recommendations.index)]
-
-        # Concatenate all movies into a single dataframe for futher analysis
-        df_movie_details = pd.concat(movie_details_df_list)
-
-        # Create an ID column
-        df_movie_details['id'] = range(df_movie_details.shape[0])
-
-        # Look for unique titles
-        titles = pd.Series(df_movie_details['title'].unique())
-        titles = [value for index, value in titles.iteritems() if value != '']
+    def describe_recommendations(self, movie_ids):
+        '''
+        Summarizes a list of recommended movies: their titles and favorite genres, actors and directors
 
-        # Look for favorite genres
-        genres = df_movie_details.groupby('genres')['title'].count().drop('').sort_values(ascending=False)
-        genres = [index + ', ' + str(value) for index, value in genres.iteritems()]
+        param movie_ids: recommended movieIDs, best first
 
-        # look for favorite actors
-        actors = df_movie_details.groupby('actors')['id'].count().sort_values(ascending=False).iloc[0:10]
-        actors = [index + ', ' + str(value) for index, value in actors.iteritems()]
+        return: dict of titles and stats, as returned by getRecommendations
+        '''
+        # Unique titles, in recommendation order
+        titles = [title for title in pd.unique(self.metadata.get_titles(movie_ids)) if title != '']
 
-        # look for favorite directors
-        directors = df_movie_details.groupby('director')['id'].count().drop('').sort_values(ascending=False)
-        directors = [index + ', ' + str(value) for index, value in directors.iteritems()]
+        # Look for favorite genres, actors (top 10) and directors
+        counts = self.metadata.count_values(movie_ids)
+        genres = [name + ', ' + str(count) for name, count in counts['genres']]
+        actors = [name + ', ' + str(count) for name, count in counts['actors'][0:10]]
+        directors = [name + ', ' + str(count) for name, count in counts['directors']]
 
         results = {
             "titles": titles,
@@ -196,3 +878,12 @@ class Knn:
         }
 
         return results
+
+    def getRecommendations(self, userID, k=10, num_recs=10):
+        df_knn = self.find_knn(userID, k)
+
+        # Rank unrated movies by the neighbors' mean rating and describe the top recommendations
+        avg_sorted = self.rank_unrated_movies(userID, df_knn.index)
+        top_recommendations = avg_sorted[0:num_recs]
+
+        return self.describe_recommendations(top_recommendations.index)
@@ -0,0 +1,53 @@
+import multiprocessing
+import numpy as np
+
+
+# Upper bounds (seconds) of the latency buckets; the last bucket catches everything slower
+LATENCY_BUCKETS = [.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+
+
+class LatencyHistograms:
+    '''
+    Request latency histograms per endpoint, kept in shared memory so every worker process of a pre-fork server
+    records into the same table and any worker can report the totals.
+
+    Each worker writes only its own slot (no locking needed); report() sums the slots. Create the histograms
+    before forking and call set_worker() in each worker.
+    '''
+    def __init__(self, endpoints, num_workers=1, buckets=LATENCY_BUCKETS):
+        self.endpoints = list(endpoints)
+        self.buckets = np.asarray(buckets, dtype=np.float64)
+        self.worker = 0
+
+        # Per (worker, endpoint): counts per bucket (+ overflow bucket), then the sum of latencies
+        shape = (num_workers, len(self.endpoints), len(self.buckets) + 2)
+        self.shared = multiprocessing.RawArray('d', int(np.prod(shape)))
+        self.values = np.frombuffer(self.shared, dtype=np.float64).reshape(shape)
+
+    def set_worker(self, worker):
+        self.worker = worker
+
+    def observe(self, endpoint, seconds):
+        row = self.values[self.worker, self.endpoints.index(endpoint)]
+        row[np.searchsorted(self.buckets, seconds)] += 1
+        row[-1] += seconds
+
+    def report(self):
+        '''
+        Renders the histograms in the Prometheus text exposition format
+
+        return: str
+        '''
+        totals = self.values.sum(axis=0)
+        lines = ['# HELP request_latency_seconds Request latency by endpoint',
+                 '# TYPE request_latency_seconds histogram']
+        for endpoint, row in zip(self.endpoints, totals):
+            cumulative = np.cumsum(row[:-1])
+            for bound, count in zip(self.buckets, cumulative):
+                lines.append('request_latency_seconds_bucket{{endpoint="{0}",le="{1:g}"}} {2:.0f}'.format(
+                    endpoint, bound, count))
+            lines.append('request_latency_seconds_bucket{{endpoint="{0}",le="+Inf"}} {1:.0f}'.format(
+                endpoint, cumulative[-1]))
+            lines.append('request_latency_seconds_sum{{endpoint="{0}"}} {1:.6f}'.format(endpoint, row[-1]))
+            lines.append('request_latency_seconds_count{{endpoint="{0}"}} {1:.0f}'.format(endpoint, cumulative[-1]))
+        return '\n'.join(lines) + '\n'
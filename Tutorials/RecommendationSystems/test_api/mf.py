@@ -0,0 +1,212 @@
+'''
+Latent factor (matrix factorization) recommender, served alongside Knn.
+
+Ratings are approximated as R[u, i] ~ mean + P[u] . Q[i] (same P/Q naming as Collaborative_Filtering_LFA.ipynb),
+fit on the observed ratings only with alternating least squares: holding Q fixed, every user's row of P has a
+closed-form ridge regression solution, and vice versa. Each half-step builds all of those small (K x K) systems
+with sparse-dense products and solves them at once with a batched np.linalg.solve.
+
+The model is two float32 factor matrices, so its size does not grow with the number of ratings, and a request is
+one matrix-vector product plus a partial sort.
+
+Train and save from test_api:
+    python mf.py --factors 32 --iterations 10 --output data/movielens_2k/mf_model.npz
+'''
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+GRAM_CHUNK_SIZE = 2 ** 23    # Max floats of Gram matrices held at once
+
+
+def _solve_rows(ratings, Y, lamda):
+    '''
+    Solves the regularized least squares problem of every row of a sparse ratings matrix against fixed factors Y
+
+    Row u minimizes sum over its ratings (r_ui - X[u] . Y[i])^2 + lamda * n_u * |X[u]|^2, whose solution is
+    X[u] = (Y_u^T Y_u + lamda * n_u * I)^-1 Y_u^T r_u, where Y_u holds the factors of the items row u rated.
+
+    The Gram matrices Y_u^T Y_u of all rows come from one sparse-dense product: the rated-item indicator times
+    the upper triangle of each item's outer product y_i y_i^T.
+
+    param ratings: CSR matrix (rows x items) of centered ratings
+    param Y: array (items x K) of fixed factors
+    param lamda: regularization weight
+
+    return: array (rows x K) of factors (zero for rows without ratings)
+    '''
+    num_rows, K = ratings.shape[0], Y.shape[1]
+    Y = Y.astype(np.float64)
+    upper = np.triu_indices(K)
+    outer = Y[:, upper[0]] * Y[:, upper[1]]
+    rated = sparse.csr_matrix((np.ones_like(ratings.data), ratings.indices, ratings.indptr), shape=ratings.shape)
+    counts = np.diff(ratings.indptr)
+
+    X = np.zeros((num_rows, K), dtype=np.float32)
+    rows_per_chunk = max(1, GRAM_CHUNK_SIZE // (K * K))
+    for start in range(0, num_rows, rows_per_chunk):
+        stop = min(start + rows_per_chunk, num_rows)
+        chunk_rows = start + np.flatnonzero(counts[start:stop])
+        if len(chunk_rows) == 0:
+            continue
+
+        gram = np.empty((len(chunk_rows), K, K))
+        gram_upper = rated[chunk_rows].dot(outer)
+        gram[:, upper[0], upper[1]] = gram_upper
+        gram[:, upper[1], upper[0]] = gram_upper
+        gram += (lamda * counts[chunk_rows])[:, np.newaxis, np.newaxis] * np.eye(K)
+
+        rhs = ratings[chunk_rows].dot(Y)
+        X[chunk_rows] = np.linalg.solve(gram, rhs[:, :, np.newaxis])[:, :, 0]
+
+    return X
+
+
+class MatrixFactorization:
+    '''
+    Matrix factorization engine with the same getRecommendations(userID, k, num_recs) contract as Knn. It reads
+    the ratings matrix, ids and movie metadata of a Knn instance; k is accepted for compatibility and ignored,
+    since there are no neighbors.
+    '''
+    num_factors = 32
+    lamda = .05
+
+    def __init__(self, knn, num_factors=32, lamda=.05, seed=0):
+        self.knn = knn
+        self.num_factors = num_factors
+        self.lamda = lamda
+        self.seed = seed
+        self.mean = 0.
+        self.P = None   # users x K
+        self.Q = None   # movies x K
+
+    def fit(self, iterations=10, ratings=None, verbose=False):
+        '''
+        Trains the factors with alternating least squares
+
+        param iterations: number of (users, movies) ALS sweeps
+        param ratings: CSR ratings matrix to fit (defaults to knn.ratings; e.g. pass a training split)
+        param verbose: print the training RMSE after each sweep
+
+        return: self
+        '''
+        ratings = self.knn.ratings if ratings is None else ratings
+        self.mean = float(ratings.data.mean()) if ratings.nnz else 0.
+
+        centered = ratings.astype(np.float64)
+        centered.data -= self.mean
+        centered_by_movie = centered.T.tocsr()
+
+        rng = np.random.RandomState(self.seed)
+        self.Q = (rng.standard_normal((ratings.shape[1], self.num_factors)) * .1).astype(np.float32)
+        for iteration in range(iterations):
+            self.P = _solve_rows(centered, self.Q, self.lamda)
+            self.Q = _solve_rows(centered_by_movie, self.P, self.lamda)
+            if verbose:
+                print('iteration {0}: train RMSE {1:.4f}'.format(iteration, self.rmse(ratings)))
+        return self
+
+    def predict(self, rows, columns):
+        '''Predicted ratings for (user row, movie column) pairs.'''
+        self.extend_factors()
+        return self.mean + np.einsum('ij,ij->i', self.P[rows], self.Q[columns])
+
+    def rmse(self, ratings):
+        '''Root mean squared error over the entries of a sparse ratings matrix.'''
+        coo = ratings.tocoo()
+        errors = coo.data - self.predict(coo.row, coo.col)
+        return float(np.sqrt(np.mean(errors ** 2)))
+
+    def rank_unrated_movies(self, userID, num_recs=10):
+        '''
+        Ranks the movies userID has not rated by predicted rating
+
+        return: Series of the num_recs highest predicted ratings indexed by movieID, highest first
+        '''
+        self.extend_factors()
+        row = self.knn.user_index[userID]
+        scores = self.Q.dot(self.P[row]) + self.mean
+        scores[self.knn.get_ratings([row]).indices] = -np.inf
+
+        num_recs = min(num_recs, int(np.count_nonzero(np.isfinite(scores))))
+        if num_recs <= 0:
+            return pd.Series([], dtype=np.float64, name='score')
+        top = np.argpartition(-scores, num_recs - 1)[:num_recs]
+        top = top[np.lexsort((top, -scores[top]))]
+        return pd.Series(scores[top], index=self.knn.movie_ids[top], name='score')
+
+    def extend_factors(self):
+        '''
+        Adds factor rows for the users and movies knn.merge_ratings appended since the model was fit. New users get
+        the mean user factors (the ranking of an average user) and new movies zero factors (the mean rating), until
+        the next fit.
+        '''
+        num_users, num_movies = len(self.knn.user_ids), len(self.knn.movie_ids)
+        if num_users > len(self.P):
+            fill = self.P.mean(axis=0) if len(self.P) else np.zeros(self.P.shape[1], dtype=np.float32)
+            self.P = np.concatenate([self.P, np.tile(fill, (num_users - len(self.P), 1))])
+        if num_movies > len(self.Q):
+            self.Q = np.concatenate([self.Q, np.zeros((num_movies - len(self.Q), self.Q.shape[1]), dtype=np.float32)])
+
+    def getRecommendations(self, userID, k=10, num_recs=10):
+        return self.knn.describe_recommendations(self.rank_unrated_movies(userID, num_recs).index)
+
+    def save(self, path):
+        np.savez(path, P=self.P, Q=self.Q, mean=np.array(self.mean), lamda=np.array(self.lamda),
+                 user_ids=np.asarray(self.knn.user_ids), movie_ids=np.asarray(self.knn.movie_ids))
+
+    @classmethod
+    def load(cls, knn, path):
+        '''
+        Loads factors saved by save(), lining their rows up with knn's users and movies. Users or movies the model
+        has not seen get zero factors (they are predicted the mean rating).
+        '''
+        with np.load(path) as data:
+            model = cls(knn, data['P'].shape[1], float(data['lamda']))
+            model.mean = float(data['mean'])
+            model.P = _align(data['P'], data['user_ids'], knn.user_ids)
+            model.Q = _align(data['Q'], data['movie_ids'], knn.movie_ids)
+        return model
+
+
+def _align(factors, saved_ids, ids):
+    # Reorders factor rows from the saved id order to ids, with zeros for ids that were not saved
+    positions = pd.Index(saved_ids).get_indexer(np.asarray(ids))
+    aligned = np.zeros((len(ids), factors.shape[1]), dtype=np.float32)
+    aligned[positions >= 0] = factors[positions[positions >= 0]]
+    return aligned
+
+
+def split_ratings(ratings, test_fraction=.1, seed=0):
+    '''Randomly splits the entries of a sparse ratings matrix into (train, test) matrices of the same shape.'''
+    coo = ratings.tocoo()
+    test = np.random.RandomState(seed).rand(coo.nnz) < test_fraction
+    return [sparse.csr_matrix((coo.data[mask], (coo.row[mask], coo.col[mask])), shape=ratings.shape)
+            for mask in (~test, test)]
+
+
+if __name__ == '__main__':
+    from knn import Knn
+
+    parser = argparse.ArgumentParser(description='Train the matrix factorization recommender.')
+    parser.add_argument('--factors', type=int, default=32)
+    parser.add_argument('--lamda', type=float, default=.05)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--test-fraction', type=float, default=.1, help='held-out ratings for the reported RMSE')
+    parser.add_argument('--output', default='data/movielens_2k/mf_model.npz')
+    args = parser.parse_args()
+
+    knn = Knn()
+    train, test = split_ratings(knn.ratings, args.test_fraction)
+
+    start = time.perf_counter()
+    model = MatrixFactorization(knn, args.factors, args.lamda).fit(args.iterations, train, verbose=True)
+    print('Trained in {0:.1f}s; test RMSE {1:.4f}'.format(time.perf_counter() - start, model.rmse(test)))
+
+    # Refit on every rating before saving
+    model.fit(args.iterations)
+    model.save(args.output)
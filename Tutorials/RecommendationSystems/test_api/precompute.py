@@ -0,0 +1,266 @@
+'''
+Offline precomputation of neighbors and top-N recommendations for every user.
+
+Users are processed in blocks: one sparse matrix-matrix product gives the distances from a block of users to every
+user, top_k_smallest_rows picks each row's neighbors, and a second product with a neighbor selection matrix gives
+every block user's per-movie neighbor mean ratings at once. Blocks are spread over a process pool.
+
+Results are written as a small JSON header plus one .npy file per array, so they can be opened memory-mapped:
+    <base>.json             format, k, num_recs, metric, shapes and the key of the ratings file (knn.data_key)
+    <base>.users.npy        userIDs, sorted (one row per user)
+    <base>.neighbors.npy    neighbor userIDs (users x k), closest first
+    <base>.distances.npy    neighbor distances (users x k)
+    <base>.movies.npy       recommended movieIDs (users x num_recs), best first; -1 pads users with fewer
+    <base>.scores.npy       neighbor mean rating of each recommended movie (NaN where movies is -1)
+
+Run from test_api:
+    python precompute.py --output data/movielens_2k/recommendations --k 10 --num-recs 50
+'''
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from scipy import sparse
+from knn import Knn, top_k_smallest_rows
+
+
+FORMAT_NAME = 'knn-recommendations'
+FORMAT_VERSION = 1
+ARRAYS = ['users', 'neighbors', 'distances', 'movies', 'scores']
+
+_knn = None     # Model shared with pool workers
+
+
+def _init_worker(knn):
+    global _knn
+    _knn = knn
+
+
+def compute_block(knn, rows, k, num_recs, metric=None):
+    '''
+    Computes the neighbors and top-N recommendations of a block of users
+
+    Matches Knn.find_knn(exact=True) and Knn.rank_unrated_movies: neighbors and movies tied on distance or mean
+    rating are ordered by position.
+
+    param knn: Knn model
+    param rows: row positions of the users in the ratings matrix
+    param k: number of neighbors
+    param num_recs: number of recommendations per user
+
+    return: (neighbor rows, neighbor distances, recommended movie columns (-1 padded), scores)
+    '''
+    rows = np.asarray(rows)
+    distances = knn.distance_block(rows, metric)
+    distances[np.arange(len(rows)), rows] = np.inf
+    neighbors = top_k_smallest_rows(distances, k)
+    neighbor_distances = np.take_along_axis(distances, neighbors, axis=1)
+
+    # Selection matrix with a 1 for each (block user, neighbor) pair
+    selection = sparse.csr_matrix((np.ones(neighbors.size), neighbors.ravel(),
+                                   np.arange(0, neighbors.size + 1, neighbors.shape[1])),
+                                  shape=(len(rows), knn.ratings.shape[0]))
+    sums = selection.dot(knn.ratings.astype(np.float64)).toarray()
+    counts = selection.dot(knn.rated).toarray()
+    means = np.divide(sums, counts, out=np.zeros(sums.shape), where=counts > 0)
+
+    # Rank by mean rating, leaving out movies no neighbor rated and movies the user rated
+    ranking = np.where(counts > 0, -means, np.inf)
+    user_rated = knn.rated[rows]
+    ranking[np.repeat(np.arange(len(rows)), np.diff(user_rated.indptr)), user_rated.indices] = np.inf
+
+    movies = top_k_smallest_rows(ranking, num_recs)
+    scores = -np.take_along_axis(ranking, movies, axis=1)
+    missing = np.isinf(scores)
+    movies[missing] = -1
+    scores[missing] = np.nan
+
+    return neighbors, neighbor_distances, movies, scores
+
+
+def _compute_block(args):
+    start, stop, k, num_recs, metric = args
+    return (start,) + compute_block(_knn, np.arange(start, stop), k, num_recs, metric)
+
+
+def precompute(knn, base_path, k=10, num_recs=50, metric=None, block_size=256, processes=None):
+    '''
+    Computes neighbors and recommendations for every user and writes them to base_path
+
+    Each block is written into memory-mapped output arrays as soon as it arrives, so the full result never has to
+    fit in memory.
+
+    param knn: Knn model
+    param base_path: output path without extension
+    param k: number of neighbors
+    param num_recs: number of recommendations per user
+    param metric: distance metric (defaults to knn.metric)
+    param block_size: users per block
+    param processes: worker processes (defaults to the CPU count; 1 computes in this process)
+    '''
+    metric = metric or knn.metric
+    num_users = knn.ratings.shape[0]
+    k = min(k, num_users - 1)
+    num_recs = min(num_recs, knn.ratings.shape[1])
+
+    users = knn.user_ids.astype(np.int64)
+    outputs = {
+        'neighbors': np.lib.format.open_memmap(base_path + '.neighbors.npy', 'w+', np.int64, (num_users, k)),
+        'distances': np.lib.format.open_memmap(base_path + '.distances.npy', 'w+', np.float32, (num_users, k)),
+        'movies': np.lib.format.open_memmap(base_path + '.movies.npy', 'w+', np.int64, (num_users, num_recs)),
+        'scores': np.lib.format.open_memmap(base_path + '.scores.npy', 'w+', np.float32, (num_users, num_recs))
+    }
+    np.save(base_path + '.users.npy', users)
+
+    tasks = [(start, min(start + block_size, num_users), k, num_recs, metric)
+             for start in range(0, num_users, block_size)]
+
+    def write(result):
+        start, neighbors, distances, movies, scores = result
+        stop = start + len(neighbors)
+        outputs['neighbors'][start:stop] = users[neighbors]
+        outputs['distances'][start:stop] = distances
+        outputs['movies'][start:stop] = np.where(movies >= 0, knn.movie_ids.astype(np.int64)[movies], -1)
+        outputs['scores'][start:stop] = scores
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        _init_worker(knn)
+        for task in tasks:
+            write(_compute_block(task))
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(knn,)) as pool:
+            for result in pool.imap_unordered(_compute_block, tasks):
+                write(result)
+
+    for output in outputs.values():
+        output.flush()
+
+    header = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'metric': metric,
+        'k': k,
+        'num_recs': num_recs,
+        'num_users': num_users,
+        'data_key': getattr(knn, 'data_key', None),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    with open(base_path + '.json', 'w+') as f:
+        f.write(json.dumps(header))
+
+
+class PrecomputedRecommendations:
+    '''
+    Read-only view of a table written by precompute(), opened memory-mapped by default. Rows are found through a
+    userID -> row dict, so each lookup is O(1).
+    '''
+    k = 0
+    num_recs = 0
+    metric = None
+
+    def __init__(self, base_path, mmap=True):
+        with open(base_path + '.json', 'r') as f:
+            header = json.loads(f.readline())
+        if header.get('format') != FORMAT_NAME or header.get('version') != FORMAT_VERSION:
+            raise ValueError("Unsupported file format: {0} v{1}".format(header.get('format'), header.get('version')))
+
+        self.k = header['k']
+        self.num_recs = header['num_recs']
+        self.metric = header['metric']
+        self.num_users = header['num_users']
+        self.data_key = header.get('data_key')
+
+        arrays = {name: np.load('{0}.{1}.npy'.format(base_path, name), mmap_mode='r' if mmap else None)
+                  for name in ARRAYS}
+        if any(len(array) != header['num_users'] for array in arrays.values()):
+            raise ValueError("Precomputed arrays do not match the header's {0} users.".format(header['num_users']))
+
+        self.users = arrays['users']
+        self.neighbors = arrays['neighbors']
+        self.distances = arrays['distances']
+        self.movies = arrays['movies']
+        self.scores = arrays['scores']
+        self.user_rows = {int(userID): row for row, userID in enumerate(self.users)}
+        self.reverse_neighbors = None   # (neighbor userIDs sorted, row of each), built on first use
+
+    def check(self, knn):
+        '''
+        Checks that the table was computed from the ratings knn loaded
+
+        return: None if it matches, otherwise the reason it does not
+        '''
+        if self.data_key is None or self.data_key != getattr(knn, 'data_key', None):
+            return 'computed from a different ratings file ({0}, loaded {1})'.format(
+                self.data_key, getattr(knn, 'data_key', None))
+        if self.num_users != len(knn.user_ids):
+            return 'computed for {0} users, loaded {1}'.format(self.num_users, len(knn.user_ids))
+        return None
+
+    def __contains__(self, userID):
+        return int(userID) in self.user_rows
+
+    def get_neighbors(self, userID):
+        '''Returns (neighbor userIDs, distances) for userID, or None if the user is not in the table.'''
+        row = self.user_rows.get(int(userID))
+        if row is None:
+            return None
+        return self.neighbors[row], self.distances[row]
+
+    def get_users_with_neighbors(self, userIDs):
+        '''
+        Finds the users whose precomputed neighbors include any of userIDs, through a reverse index (neighbor ->
+        rows) sorted once, so each lookup is a binary search instead of a scan of the neighbors table
+
+        param userIDs: neighbor userIDs to look up
+
+        return: np.ndarray of userIDs, sorted
+        '''
+        if self.reverse_neighbors is None:
+            neighbors = np.asarray(self.neighbors).ravel()
+            order = np.argsort(neighbors, kind='stable')
+            self.reverse_neighbors = (neighbors[order], order // max(self.neighbors.shape[1], 1))
+        keys, rows = self.reverse_neighbors
+        userIDs = np.asarray(list(userIDs), dtype=np.int64)
+        starts = np.searchsorted(keys, userIDs, 'left')
+        lengths = np.searchsorted(keys, userIDs, 'right') - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.unique(self.users[rows[positions]])
+
+    def get_recommendations(self, userID, num_recs=None):
+        '''
+        Gets the precomputed recommendations for userID
+
+        param userID: userID to look up
+        param num_recs: number of recommendations (at most the table's num_recs)
+
+        return: (movieIDs, scores) best first, or None if the user is not in the table
+        '''
+        row = self.user_rows.get(int(userID))
+        if row is None:
+            return None
+        movies = self.movies[row, :num_recs]
+        found = movies >= 0
+        return movies[found], self.scores[row, :num_recs][found]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute neighbors and top-N recommendations for every user.')
+    parser.add_argument('--output', default='data/movielens_2k/recommendations', help='output path without extension')
+    parser.add_argument('--metric', default='hamming')
+    parser.add_argument('--k', type=int, default=10, help='number of neighbors')
+    parser.add_argument('--num-recs', type=int, default=50, help='recommendations stored per user')
+    parser.add_argument('--block-size', type=int, default=256, help='users per block')
+    parser.add_argument('--processes', type=int, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    knn = Knn(metric=args.metric)
+    print('Loaded {0} users in {1:.1f}s'.format(knn.ratings.shape[0], time.perf_counter() - start))
+
+    start = time.perf_counter()
+    precompute(knn, args.output, args.k, args.num_recs, block_size=args.block_size, processes=args.processes)
+    print('Precomputed recommendations in {0:.1f}s'.format(time.perf_counter() - start))
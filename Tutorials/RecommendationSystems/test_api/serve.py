@@ -0,0 +1,125 @@
+'''
+Pre-fork multi-process server for the recommendation API.
+
+The parent process imports app (loading the ratings matrix, movie metadata, caches and precomputed table once),
+freezes the garbage collector so collections do not write to the inherited objects, opens the listening socket and
+then forks the workers. The workers share the model's NumPy/SciPy arrays copy-on-write, so they do not each hold
+their own copy; each runs a threaded server on the shared socket.
+
+New ratings posted to any worker are appended to a shared log file. Every worker merges the log into its own model
+on its periodic merge, so all workers pick up new activity.
+
+Linux/macOS only (uses fork). Run from test_api:
+    python serve.py --workers 4 --port 5000
+'''
+
+import os
+import gc
+import sys
+import json
+import fcntl
+import signal
+import socket
+import argparse
+from werkzeug.serving import make_server
+
+
+class RatingsLog:
+    '''
+    Append-only log of (userID, movieID, rating) triples shared by the worker processes, one JSON list per line.
+    Writers hold an exclusive file lock per append; each process reads from its own offset.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        open(path, 'a').close()
+
+    def append(self, triples):
+        if not triples:
+            return
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(''.join(json.dumps(list(triple)) + '\n' for triple in triples))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_new(self):
+        '''Returns the triples appended since the last call in this process.'''
+        with open(self.path, 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                f.seek(self.offset)
+                lines = f.readlines()
+                self.offset = f.tell()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return [tuple(json.loads(line)) for line in lines if line.strip()]
+
+    def skip_existing(self):
+        '''Starts reading from the current end of the log (for entries already in the loaded data).'''
+        self.offset = os.path.getsize(self.path)
+
+
+def run_worker(app_module, worker, sock):
+    app_module.histograms.set_worker(worker)
+    app_module.start_background_threads()
+    server = make_server(sock.getsockname()[0], sock.getsockname()[1], app_module.app, threaded=True,
+                         fd=sock.fileno())
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the recommendation API from several worker processes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--ratings-log', default='data/movielens_2k/ratings_log.jsonl',
+                        help='file the workers share new ratings through')
+    args = parser.parse_args(argv)
+
+    import app as app_module
+    if args.workers > app_module.MAX_WORKERS:
+        parser.error('at most {0} workers are supported'.format(app_module.MAX_WORKERS))
+
+    app_module.ratings_log = RatingsLog(args.ratings_log)
+    app_module.ratings_log.skip_existing()
+
+    # Keep the loaded model out of future collections so the workers' pages stay shared
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    workers = []
+    for worker in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app_module, worker, sock)
+            finally:
+                os._exit(0)
+        workers.append(pid)
+    print('Serving on http://{0}:{1} with {2} workers'.format(args.host, args.port, args.workers))
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in workers:
+        os.waitpid(pid, 0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
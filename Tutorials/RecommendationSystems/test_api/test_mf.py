@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import importlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _write_table(path, columns, rows):
+    with open(path, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in rows:
+            f.write('\t'.join(str(value) for value in row) + '\n')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A small movielens_2k-style data directory with a trained model, served by a freshly imported app
+    rng = np.random.RandomState(0)
+    data = tmp_path / 'data' / 'movielens_2k'
+    data.mkdir(parents=True)
+    movie_ids = np.arange(1, 41) * 10
+    rt_columns = ['rtAllCriticsRating', 'rtAllCriticsNumReviews', 'rtAllCriticsScore', 'rtTopCriticsRating',
+                  'rtTopCriticsNumReviews', 'rtTopCriticsNumFresh', 'rtTopCriticsNumRotten', 'rtTopCriticsScore',
+                  'rtAudienceRating', 'rtAudienceNumRatings', 'rtAudienceScore']
+    _write_table(data / 'movies.dat', ['id', 'title', 'imdbID', 'rtID'] + rt_columns,
+                 [[m, 'Movie {0}'.format(m), m, 'movie_{0}'.format(m)] + [1] * len(rt_columns) for m in movie_ids])
+    _write_table(data / 'movie_actors.dat', ['movieID', 'actorID', 'actorName', 'ranking'],
+                 [[m, 'a{0}'.format(m % 7), 'Actor {0}'.format(m % 7), 1] for m in movie_ids])
+    _write_table(data / 'movie_directors.dat', ['movieID', 'directorID', 'directorName'],
+                 [[m, 'd{0}'.format(m % 5), 'Director {0}'.format(m % 5)] for m in movie_ids])
+    _write_table(data / 'movie_genres.dat', ['movieID', 'genre'], [[m, 'Drama'] for m in movie_ids])
+    _write_table(data / 'user_ratedmovies.dat', ['userID', 'movieID', 'rating'],
+                 [[user, m, rng.randint(1, 11) / 2] for user in range(1, 31)
+                  for m in rng.choice(movie_ids, 12, replace=False)])
+    monkeypatch.chdir(tmp_path)
+
+    from knn import Knn
+    from mf import MatrixFactorization
+    MatrixFactorization(Knn(), num_factors=4).fit(3).save(str(data / 'mf_model.npz'))
+
+    sys.modules.pop('app', None)
+    app = importlib.import_module('app')
+    yield app.app.test_client()
+    sys.modules.pop('app', None)
+
+
+def test_mf_recommendations_after_merging_new_users_and_movies(client):
+    # User 1000 and movie 1000 are not in the model; movie 1000 is unknown to the metadata as well
+    ratings = [{'userID': 1000, 'movieID': 10, 'rating': 5}, {'userID': 1000, 'movieID': 1000, 'rating': 4},
+               {'userID': 1, 'movieID': 1000, 'rating': 3}]
+    response = client.post('/ratings?merge=1', json=ratings)
+    assert response.status_code == 200 and response.get_json()['merged_users'] == 2
+
+    for user_id in (1000, 1, 2):
+        response = client.get('/recommend/mf/{0}/5'.format(user_id))
+        assert response.status_code == 200
+        assert len(json.loads(response.get_json())['titles']) == 5
+    assert 'Movie 10' not in json.loads(client.get('/recommend/mf/1000/40').get_json())['titles']
+
+    # Same response shape as the Knn endpoint
+    knn_response = client.get('/recommend/1/5/5').get_json()
+    assert isinstance(knn_response, str) and isinstance(client.get('/recommend/mf/1/5').get_json(), str)
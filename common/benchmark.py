@@ -0,0 +1,304 @@
+'''
+Scaling benchmarks for the common package.
+
+Times data_exploration.get_data_quality_report, enumerate_categorical_columns and set_columns_to_category_dtype,
+data_transformation.normalize and ml_modeling.train_and_score_classifier on synthetic datasets of growing size and
+categorical cardinality. No data files are needed.
+
+Run from common:
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --baseline bench.json
+
+Each result records throughput (rows/sec, from the fastest of --repeat runs) and peak traced memory. Peak memory is
+measured in a second, separate run under tracemalloc so tracing overhead does not distort the timings (--no-memory
+skips it). A result is flagged as a regression when its throughput drops, or its peak memory grows, by more than the
+tolerance.
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.naive_bayes import GaussianNB
+
+# Personal libraries
+import data_exploration as dex
+import data_transformation as dt
+import ml_modeling as ml
+
+
+ROW_COUNTS = [1000, 10000, 100000, 1000000]
+QUICK_ROW_COUNTS = [1000, 10000]
+CARDINALITIES = [10, 1000]
+REGRESSION_TOLERANCE = .2   # Flag results more than 20% slower (or larger) than the baseline
+
+
+def make_synthetic_data(num_rows: int,
+                        num_numeric: int=10,
+                        num_categorical: int=5,
+                        numeric_dtype: str='float64',
+                        categorical_dtype: str='object',
+                        cardinality: int=10,
+                        null_rate: float=.01,
+                        positive_rate: float=.1,
+                        seed: int=0):
+    '''
+    Builds a synthetic dataset with numeric and categorical features and imbalanced binary labels.
+
+    Numeric columns are normal draws ('num_0', ...), cast to numeric_dtype (integer dtypes are scaled by 1000 first).
+    Categorical columns ('cat_0', ...) hold cardinality distinct strings with skewed (Zipf-like) frequencies, as
+    'object' or 'category' dtype. null_rate of the values of every column are nulls (integer columns can't hold
+    nulls and are left complete). Labels depend on the first two numeric columns, with positive_rate positives.
+
+    :return: df, labels (pd.Series of 0/1)
+    '''
+    rng = np.random.RandomState(seed)
+    numeric = rng.normal(size=(num_rows, num_numeric))
+    data = {}
+    for i in range(num_numeric):
+        column = numeric[:, i]
+        if np.dtype(numeric_dtype).kind in 'iu':
+            data['num_{0}'.format(i)] = (column * 1000).astype(numeric_dtype)
+        else:
+            column = column.astype(numeric_dtype)
+            column[rng.rand(num_rows) < null_rate] = np.nan
+            data['num_{0}'.format(i)] = column
+
+    weights = 1. / np.arange(1, cardinality + 1)
+    values = np.array(['value_{0}'.format(value) for value in range(cardinality)], dtype=object)
+    for i in range(num_categorical):
+        column = values[rng.choice(cardinality, num_rows, p=weights / weights.sum())]
+        column[rng.rand(num_rows) < null_rate] = None
+        data['cat_{0}'.format(i)] = pd.Series(column, dtype=categorical_dtype)
+
+    df = pd.DataFrame(data)
+
+    # Positives are the rows with the highest (noisy) score
+    score = numeric[:, 0] + (numeric[:, 1] if num_numeric > 1 else 0) + rng.normal(size=num_rows)
+    labels = pd.Series((score >= np.quantile(score, 1 - positive_rate)).astype(int), name='label')
+    return df, labels
+
+
+def _time_call(func, measure_memory: bool, setup=None, repeat: int=1):
+    '''
+    Runs func with stdout and warnings silenced; returns (fastest of repeat runs in seconds, result, peak memory in
+    MB or None). setup, if given, builds func's argument outside of the timed and traced regions.
+    '''
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        seconds = None
+        for run in range(repeat):
+            argument = setup() if setup else None
+            start = time.perf_counter()
+            result = func(argument) if setup else func()
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+        peak_mb = None
+        if measure_memory:
+            argument = setup() if setup else None
+            tracemalloc.start()
+            func(argument) if setup else func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+    return seconds, result, peak_mb
+
+
+def _result(seconds: float, num_rows: int, peak_mb: float):
+    return {'seconds': seconds, 'rows_per_sec': num_rows / seconds, 'peak_memory_mb': peak_mb}
+
+
+def bench_data_quality_report(df: pd.DataFrame, measure_memory: bool, repeat: int=1):
+    seconds, _, peak_mb = _time_call(lambda: dex.get_data_quality_report(df), measure_memory, repeat=repeat)
+    return _result(seconds, df.shape[0], peak_mb)
+
+
+def bench_enumerate_categorical_columns(df: pd.DataFrame, measure_memory: bool, repeat: int=1):
+    # enumerate_series writes a mapping file per column to the working directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            seconds, _, peak_mb = _time_call(lambda: dex.enumerate_categorical_columns(df), measure_memory,
+                                             repeat=repeat)
+        finally:
+            os.chdir(working_directory)
+    return _result(seconds, df.shape[0], peak_mb)
+
+
+def bench_set_columns_to_category_dtype(df: pd.DataFrame, measure_memory: bool, repeat: int=1):
+    # Modifies its argument, so every run gets a fresh copy
+    seconds, _, peak_mb = _time_call(dex.set_columns_to_category_dtype, measure_memory, setup=df.copy, repeat=repeat)
+    return _result(seconds, df.shape[0], peak_mb)
+
+
+def bench_normalize(df: pd.DataFrame, measure_memory: bool, repeat: int=1):
+    cols = list(dex.get_numeric_column_names(df))
+    seconds, _, peak_mb = _time_call(lambda: dt.normalize(df, cols), measure_memory, repeat=repeat)
+    return _result(seconds, df.shape[0], peak_mb)
+
+
+def bench_train_and_score_classifier(df: pd.DataFrame, labels: pd.Series, n_folds: int, measure_memory: bool,
+                                     repeat: int=1):
+    features = dex.get_numeric_data(df)
+
+    def run():
+        return ml.train_and_score_classifier(GaussianNB(), features, labels, pos_label=1, n_folds=n_folds,
+                                             print_results=False)
+
+    seconds, (classifier, metrics), peak_mb = _time_call(run, measure_memory, repeat=repeat)
+    return dict(_result(seconds, df.shape[0], peak_mb), f1=float(metrics['f1']))
+
+
+def run_benchmarks(row_counts: list=None,
+                   cardinalities: list=None,
+                   num_numeric: int=10,
+                   num_categorical: int=5,
+                   numeric_dtype: str='float64',
+                   null_rate: float=.01,
+                   positive_rate: float=.1,
+                   n_folds: int=5,
+                   measure_memory: bool=True,
+                   repeat: int=1,
+                   seed: int=0):
+    '''
+    Runs every benchmark for each (rows, cardinality) combination.
+
+    :return: list of result dicts
+    '''
+    row_counts = row_counts or ROW_COUNTS
+    cardinalities = cardinalities or CARDINALITIES
+    results = []
+
+    for num_rows in row_counts:
+        for cardinality in cardinalities:
+            df, labels = make_synthetic_data(num_rows, num_numeric, num_categorical, numeric_dtype, 'object',
+                                             cardinality, null_rate, positive_rate, seed)
+            categorical_df = df.copy()
+            dex.set_columns_to_category_dtype(categorical_df)
+            case = {'rows': num_rows, 'cardinality': cardinality, 'numeric_columns': num_numeric,
+                    'categorical_columns': num_categorical, 'numeric_dtype': numeric_dtype, 'null_rate': null_rate,
+                    'positive_rate': positive_rate}
+
+            results.append(dict(case, benchmark='get_data_quality_report',
+                                **bench_data_quality_report(categorical_df, measure_memory, repeat)))
+            results.append(dict(case, benchmark='enumerate_categorical_columns',
+                                **bench_enumerate_categorical_columns(df, measure_memory, repeat)))
+            results.append(dict(case, benchmark='set_columns_to_category_dtype',
+                                **bench_set_columns_to_category_dtype(df, measure_memory, repeat)))
+            results.append(dict(case, benchmark='normalize', **bench_normalize(df, measure_memory, repeat)))
+            results.append(dict(case, benchmark='train_and_score_classifier', n_folds=n_folds,
+                                **bench_train_and_score_classifier(df, labels, n_folds, measure_memory, repeat)))
+
+            for result in results[-5:]:
+                print(format_result(result))
+
+    return results
+
+
+def format_result(result: dict):
+    memory = '' if result['peak_memory_mb'] is None else '{0:>9.1f} MB'.format(result['peak_memory_mb'])
+    return '{0:<30} rows={1:<8} cardinality={2:<5} {3:>12,.0f} rows/sec {4:>9.3f}s{5}'.format(
+        result['benchmark'], result['rows'], result['cardinality'], result['rows_per_sec'], result['seconds'], memory)
+
+
+def compare_to_baseline(results: list, baseline: dict, tolerance: float=REGRESSION_TOLERANCE):
+    '''
+    Compares throughput and peak memory against a previously saved benchmark file.
+
+    :return: list of (result, baseline result, description) for every case slower or larger than baseline by more
+    than tolerance
+    '''
+    def key(result):
+        return (result['benchmark'], result['rows'], result['cardinality'], result['numeric_columns'],
+                result['categorical_columns'], result['numeric_dtype'], result['null_rate'], result['positive_rate'],
+                result.get('n_folds'))
+
+    baseline_results = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        ratio = result['rows_per_sec'] / previous['rows_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append((result, previous, '{0:.0%} of baseline throughput'.format(ratio)))
+        if result['peak_memory_mb'] is not None and previous['peak_memory_mb']:
+            ratio = result['peak_memory_mb'] / previous['peak_memory_mb']
+            if ratio > 1 + tolerance:
+                regressions.append((result, previous, '{0:.0%} of baseline peak memory'.format(ratio)))
+    return regressions
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def main(argv: list=None):
+    parser = argparse.ArgumentParser(description='Benchmark the common data exploration and modeling functions.')
+    parser.add_argument('--rows', type=int, nargs='+', help='dataset sizes (default: 1k to 1M)')
+    parser.add_argument('--cardinality', type=int, nargs='+', help='distinct values per categorical column')
+    parser.add_argument('--quick', action='store_true', help='only run the small dataset sizes')
+    parser.add_argument('--numeric-columns', type=int, default=10)
+    parser.add_argument('--categorical-columns', type=int, default=5)
+    parser.add_argument('--numeric-dtype', default='float64', help='e.g. float32, int64')
+    parser.add_argument('--null-rate', type=float, default=.01)
+    parser.add_argument('--positive-rate', type=float, default=.1, help='share of positive labels')
+    parser.add_argument('--folds', type=int, default=5, help='kfolds of train_and_score_classifier')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per case (the fastest is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced peak memory runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    row_counts = args.rows or (QUICK_ROW_COUNTS if args.quick else ROW_COUNTS)
+    results = run_benchmarks(row_counts=row_counts,
+                             cardinalities=args.cardinality,
+                             num_numeric=args.numeric_columns,
+                             num_categorical=args.categorical_columns,
+                             numeric_dtype=args.numeric_dtype,
+                             null_rate=args.null_rate,
+                             positive_rate=args.positive_rate,
+                             n_folds=args.folds,
+                             measure_memory=not args.no_memory,
+                             repeat=args.repeat,
+                             seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w+') as f:
+            f.write(json.dumps({'environment': environment_info(), 'results': results}, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.loads(f.read())
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for result, previous, description in regressions:
+            print('REGRESSION: {0} ({1})'.format(format_result(result), description))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
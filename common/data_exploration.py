@@ -50,9 +50,10 @@ def get_data_quality_report(df: pd.DataFrame):
 
     # Modify or add supplemental rows
     continuous_dqr.loc['count'] = num_rows
-    continuous_dqr = continuous_dqr.append(nulls[continuous_cols])
-    continuous_dqr = continuous_dqr.append(nulls_pct[continuous_cols])
-    continuous_dqr = continuous_dqr.append(cardinality[continuous_cols])
+    continuous_dqr = pd.concat([continuous_dqr,
+                                nulls[continuous_cols].to_frame().T,
+                                nulls_pct[continuous_cols].to_frame().T,
+                                cardinality[continuous_cols].to_frame().T])
     
     '''
     Reorder rows
@@ -87,12 +88,12 @@ def get_data_quality_report(df: pd.DataFrame):
         categorical_mode = reduce(lambda x, y: x.merge(y, left_index=True, right_index=True), categorical_mode_list)
 
         # Aggregate all categorical data quality rows
-        categorical_dqr = pd.DataFrame()
-        categorical_dqr = categorical_dqr.append(pd.Series([num_rows for col in categorical_df.columns], name='count', index=categorical_df.columns))
-        categorical_dqr = categorical_dqr.append(categorical_mode)
-        categorical_dqr = categorical_dqr.append(nulls[categorical_cols])
-        categorical_dqr = categorical_dqr.append(nulls_pct[categorical_cols])
-        categorical_dqr = categorical_dqr.append(cardinality[categorical_cols])
+        categorical_dqr = pd.concat([
+            pd.Series([num_rows for col in categorical_df.columns], name='count', index=categorical_df.columns).to_frame().T,
+            categorical_mode,
+            nulls[categorical_cols].to_frame().T,
+            nulls_pct[categorical_cols].to_frame().T,
+            cardinality[categorical_cols].to_frame().T])
 
         # Format decimal precision
         #continuous_dqr.loc['nulls pct'] = continuous_dqr.loc['nulls pct'].apply(two_decimal_precision)
@@ -212,7 +213,7 @@ def enumerate_categorical_columns(df: pd.DataFrame, columns: list=None):
     for column in columns:
         enumerated_data.append(enumerate_series(df[column]))
 
-    enumerated_df = reduce(lambda x, y: x.merge(y, left_index=True, right_index=True), enumerated_data)
+    enumerated_df = pd.concat(enumerated_data, axis=1)
     return enumerated_df
 
 
@@ -232,9 +233,9 @@ def get_mode_and_second_mode(s: pd.Series):
     mode_pct = mode_counts / s.size
 
     if counts.index.size < 2:
-        second_mode_col = np.NaN
-        second_mode_counts = np.NaN
-        second_mode_pct = np.NaN
+        second_mode_col = np.nan
+        second_mode_counts = np.nan
+        second_mode_pct = np.nan
     else:
         second_mode_col = counts.index[1]
         second_mode_counts = counts.iloc[1]
@@ -264,3 +265,31 @@ def enumerate_series(s: pd.Series):
     return pd.to_numeric(s.apply(lambda x: list_of_unique_values.index(x)))
 
 
+
+
+def load_series_mapping(name: str, directory: str=None):
+    """
+    Loads a value -> integer mapping saved by enumerate_series, so new data can be enumerated the same way.
+    :param name: name of the enumerated series (the file is <name>_mapping.txt)
+    :param directory: directory containing the mapping file (defaults to the current working directory)
+    :return: dict of str(value) -> integer
+    """
+    mapping = {}
+    with open(os.path.join(directory or os.getcwd(), name + '_mapping.txt'), 'r') as file:
+        for line in file:
+            line = line.rstrip('\r\n')
+            if line:
+                value, number = line.rsplit('\t', 1)
+                mapping[value] = int(number)
+    return mapping
+
+
+def apply_series_mapping(s: pd.Series, mapping: dict, unknown: int=-1):
+    """
+    Maps values in a pd.Series object with a mapping loaded by load_series_mapping
+    :param s: series to be mapped
+    :param mapping: dict of str(value) -> integer
+    :param unknown: integer for values that are not in the mapping
+    :return: series with integer-mapped values
+    """
+    return s.astype(str).map(mapping).fillna(unknown).astype(np.int64)
@@ -1,19 +1,166 @@
 import os
+import json
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
 
-def normalize(df: pd.DataFrame, cols: list=None):
+
+class MinMaxNormalizer(object):
+    """
+    Min-max scaling of DataFrame columns to feature_range, equivalent to sklearn's MinMaxScaler, that can be fit one
+    chunk at a time (partial_fit), transforms in place keeping the index, and saves its parameters to a small json
+    file so that batch and online scoring reuse the same scaling without refitting.
     """
-    Normalizes specified dataframe columns using the MinMaxScaler
-    
+
+    def __init__(self, cols: list=None, feature_range: tuple=(0, 1)):
+        """
+        :param cols: list of columns to scale (defaults to every numeric column of the first chunk fit)
+        :param feature_range: (min, max) range of the scaled data
+        """
+        self.cols = None if cols is None else list(cols)
+        self.feature_range = tuple(feature_range)
+        self.data_min = None
+        self.data_max = None
+        self.n_samples_seen = 0
+
+    def partial_fit(self, df: pd.DataFrame):
+        """
+        Updates the column minimums and maximums with a chunk of data. Nulls are ignored.
+
+        :param df: pd.DataFrame chunk containing the columns to scale
+        :return: self
+        """
+        if self.cols is None:
+            self.cols = list(df.select_dtypes(include=[np.number]).columns)
+
+        chunk_min = df[self.cols].min().values.astype(np.float64)
+        chunk_max = df[self.cols].max().values.astype(np.float64)
+        if self.data_min is None:
+            self.data_min, self.data_max = chunk_min, chunk_max
+        else:
+            self.data_min = np.fmin(self.data_min, chunk_min)
+            self.data_max = np.fmax(self.data_max, chunk_max)
+        self.n_samples_seen += len(df)
+        return self
+
+    def fit(self, data):
+        """
+        Fits the scaling from a whole pd.DataFrame or from an iterable of chunks (e.g. pd.read_csv(chunksize=...))
+
+        :param data: pd.DataFrame or iterable of pd.DataFrame chunks
+        :return: self
+        """
+        self.data_min = self.data_max = None
+        self.n_samples_seen = 0
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+        for chunk in chunks:
+            self.partial_fit(chunk)
+        return self
+
+    @property
+    def scale(self):
+        # Constant columns get a scale of 1 (as in MinMaxScaler), so they map to the bottom of feature_range
+        data_range = self.data_max - self.data_min
+        data_range[data_range == 0] = 1
+        return (self.feature_range[1] - self.feature_range[0]) / data_range
+
+    def transform(self, df: pd.DataFrame, inplace: bool=False, dtype=None):
+        """
+        Scales the fitted columns of df. The index and any other columns are kept as they are.
+
+        :param df: pd.DataFrame containing the fitted columns
+        :param inplace: overwrite the columns of df instead of returning a scaled copy
+        :param dtype: dtype of the scaled columns, e.g. np.float32 to halve their memory (defaults to float64)
+        :return: pd.DataFrame with the scaled columns (df itself when inplace)
+        """
+        if self.data_min is None:
+            raise ValueError('MinMaxNormalizer has not been fit')
+        dtype = np.dtype(np.float64 if dtype is None else dtype)
+        if not inplace:
+            df = df.copy()
+
+        # One column at a time, so only a single column of temporaries is ever allocated
+        scale = self.scale
+        for i, col in enumerate(self.cols):
+            values = df[col].to_numpy(dtype=dtype, copy=True)
+            values -= dtype.type(self.data_min[i])
+            values *= dtype.type(scale[i])
+            values += dtype.type(self.feature_range[0])
+            df[col] = values
+        return df
+
+    def fit_transform(self, data, inplace: bool=False, dtype=None):
+        """
+        Fits the scaling to a pd.DataFrame and scales it
+
+        :return: see transform
+        """
+        return self.fit(data).transform(data, inplace, dtype)
+
+    def inverse_transform(self, df: pd.DataFrame, inplace: bool=False):
+        """
+        Maps scaled columns back to the original units
+
+        :param df: pd.DataFrame containing scaled columns
+        :param inplace: overwrite the columns of df instead of returning a copy
+        :return: pd.DataFrame with the original units
+        """
+        if not inplace:
+            df = df.copy()
+        scale = self.scale
+        for i, col in enumerate(self.cols):
+            df[col] = (df[col].to_numpy(dtype=np.float64) - self.feature_range[0]) / scale[i] + self.data_min[i]
+        return df
+
+    def save(self, path: str):
+        """
+        Saves the fitted parameters to a json file
+
+        :param path: file path, e.g. 'models/scaler.json'
+        :return: None
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'cols': self.cols,
+                'feature_range': list(self.feature_range),
+                'data_min': None if self.data_min is None else self.data_min.tolist(),
+                'data_max': None if self.data_max is None else self.data_max.tolist(),
+                'n_samples_seen': self.n_samples_seen
+            }, f, indent=1)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads a normalizer saved with save()
+
+        :param path: file path of the json parameters
+        :return: fitted MinMaxNormalizer
+        """
+        with open(path, 'r') as f:
+            params = json.load(f)
+        normalizer = cls(params['cols'], params['feature_range'])
+        if params['data_min'] is not None:
+            normalizer.data_min = np.array(params['data_min'], dtype=np.float64)
+            normalizer.data_max = np.array(params['data_max'], dtype=np.float64)
+        normalizer.n_samples_seen = params['n_samples_seen']
+        return normalizer
+
+
+def normalize(df: pd.DataFrame, cols: list=None, dtype=None):
+    """
+    Normalizes specified dataframe columns to [0, 1] (min-max scaling)
+
     :param df: pd.DataFrame containing data to be scaled
     :param cols: list of columns to be scaled
-    :return: pd.DataFrame containing normalized data
+    :param dtype: dtype of the scaled data, e.g. np.float32 (defaults to float64)
+    :return: pd.DataFrame containing normalized data, with the index of df
     """
     if cols is None:
-        features_to_normalize = df.columns
+        features_to_normalize = list(df.columns)
     else:
-        features_to_normalize = cols
-    
-    scaler = MinMaxScaler()
-    return pd.DataFrame(scaler.fit_transform(df[features_to_normalize]), columns=features_to_normalize)
\ No newline at end of file
+        features_to_normalize = list(cols)
+
+    normalizer = MinMaxNormalizer(features_to_normalize).fit(df)
+    return normalizer.transform(df[features_to_normalize], inplace=True, dtype=dtype)
@@ -0,0 +1,397 @@
+import os
+import time
+import types
+import pickle
+import hashlib
+import inspect
+import functools
+import sysconfig
+import numpy as np
+import pandas as pd
+
+# Bump to invalidate every existing cache entry (e.g. when the fingerprint changes)
+CACHE_VERSION = 2
+
+# Installed code (standard library and site-packages) is identified by name only, not followed into
+_LIBRARY_PATHS = tuple(os.path.realpath(sysconfig.get_path(name)) + os.sep
+                       for name in ('stdlib', 'platstdlib', 'purelib', 'platlib'))
+
+_file_hashes = {}    # source path -> ((size, mtime), sha256 of the file)
+
+
+def _update_with_array(h, values: np.ndarray):
+    """
+    Adds the dtype, shape and raw buffer of a numeric array to a hash
+
+    :param h: hashlib hash object
+    :param values: np.ndarray of a fixed-size dtype
+    """
+    values = np.ascontiguousarray(values)
+    h.update(str(values.dtype).encode())
+    h.update(str(values.shape).encode())
+    h.update(values.view(np.uint8).reshape(-1).data)
+
+
+def _update_with_series(h, s: pd.Series):
+    """
+    Adds a column to a hash: its raw buffer for numeric/bool/datetime data, the pandas hash of each value for object
+    and string data, and the codes plus categories for categorical data
+    """
+    h.update(repr(s.name).encode())
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        h.update(b'category')
+        _update_with_array(h, s.cat.codes.values)
+        _update_with_series(h, pd.Series(s.cat.categories))
+    elif isinstance(s.dtype, np.dtype) and s.dtype.kind in 'biufcmM':
+        _update_with_array(h, s.values)
+    else:
+        h.update(str(s.dtype).encode())
+        _update_with_array(h, pd.util.hash_pandas_object(s, index=False).values)
+
+
+class _Unfitted(object):
+    # Marks arguments whose estimators are hashed without their fitted attributes
+    def __init__(self, value):
+        self.value = value
+
+
+def _update_with_object(h, obj, fitted: bool=True):
+    """
+    Adds any argument to a hash. DataFrames, Series and arrays are hashed from their buffers (no pickling),
+    estimators from their class, parameters and fitted attributes, containers element by element and anything else
+    from its pickle.
+
+    :param fitted: include the fitted attributes of estimators (without them, an estimator the function refits
+     hashes the same before and after)
+    """
+    if isinstance(obj, pd.DataFrame):
+        h.update(b'DataFrame')
+        _update_with_series(h, obj.index.to_series())
+        for col in obj.columns:
+            _update_with_series(h, obj[col])
+    elif isinstance(obj, pd.Series):
+        h.update(b'Series')
+        _update_with_series(h, obj.index.to_series())
+        _update_with_series(h, obj)
+    elif isinstance(obj, pd.Index):
+        h.update(b'Index')
+        _update_with_series(h, obj.to_series())
+    elif isinstance(obj, np.ndarray) and obj.dtype.kind in 'biufcmM':
+        h.update(b'ndarray')
+        _update_with_array(h, obj)
+    elif isinstance(obj, _Unfitted):
+        h.update(b'unfitted')
+        _update_with_object(h, obj.value, fitted=False)
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update(repr((type(obj).__name__, obj)).encode())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        h.update('{0}[{1}]'.format(type(obj).__name__, len(obj)).encode())
+        for item in (sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj):
+            _update_with_object(h, item, fitted)
+    elif isinstance(obj, dict):
+        h.update('dict[{0}]'.format(len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            _update_with_object(h, key, fitted)
+            _update_with_object(h, obj[key], fitted)
+    elif hasattr(obj, 'get_params'):
+        # Estimators and samplers: class, parameters and, once fitted, the learned attributes (coef_, classes_...)
+        h.update('{0}.{1}'.format(type(obj).__module__, type(obj).__qualname__).encode())
+        _update_with_object(h, obj.get_params(deep=False), fitted)
+        if fitted:
+            _update_with_object(h, {name: value for name, value in getattr(obj, '__dict__', {}).items()
+                                    if name.endswith('_') and not name.startswith('_')})
+    else:
+        h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _file_hash(path: str):
+    # Hash of a source file, reread only when its size or modification time changes
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    version = (stat.st_size, stat.st_mtime_ns)
+    cached = _file_hashes.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, 'rb') as f:
+            cached = _file_hashes[path] = (version, hashlib.sha256(f.read()).hexdigest())
+    return cached[1]
+
+
+def _source_file(obj):
+    try:
+        return os.path.realpath(inspect.getsourcefile(obj))
+    except TypeError:
+        return None    # builtins and C extensions
+
+
+def _update_with_code(h, code: types.CodeType):
+    # Bytecode, constants (nested functions, lambdas and comprehensions included) and names of a code object
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_with_code(h, const)
+        elif isinstance(const, frozenset):
+            # Set literals (x in {...}); their repr order depends on string hashing
+            h.update(repr(sorted(repr(item) for item in const)).encode())
+        else:
+            h.update(repr((type(const).__name__, const)).encode())
+
+
+def _code_names(code: types.CodeType):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def code_fingerprint(function):
+    """
+    Computes a hash of a function's code and of the user code it calls: the bytecode, constants and names of the
+    function, of every function, class or module it refers to through its globals (followed recursively), and the
+    contents of their source files. Library code is identified by its qualified name only.
+
+    :param function: function to fingerprint
+    :return: hex digest string
+    """
+    h = hashlib.sha256()
+    files = set()
+    seen = set()
+    stack = [(function, ())]    # (object, names the referring code looks up on it when it is a module)
+    while stack:
+        obj, names = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        obj = inspect.unwrap(obj) if callable(obj) else obj
+        h.update('{0}.{1}'.format(getattr(obj, '__module__', None),
+                                  getattr(obj, '__qualname__', getattr(obj, '__name__', None))).encode())
+        path = _source_file(obj)
+        if path is not None:
+            if path.startswith(_LIBRARY_PATHS):
+                continue
+            files.add(path)
+
+        if isinstance(obj, types.FunctionType):
+            _update_with_code(h, obj.__code__)
+            names = _code_names(obj.__code__)
+            namespace = obj.__globals__
+        elif isinstance(obj, type):
+            stack.extend((value, ()) for value in vars(obj).values() if isinstance(value, types.FunctionType))
+            continue
+        else:
+            # A module used as a namespace (e.g. dex.get_data_quality_report): follow the names looked up on it
+            namespace = vars(obj)
+        for name in sorted(names):
+            value = namespace.get(name)
+            if isinstance(value, (types.FunctionType, type, types.ModuleType)):
+                stack.append((value, names))
+
+    for file_hash in sorted(str(_file_hash(path)) for path in files):
+        h.update(file_hash.encode())
+    return h.hexdigest()
+
+
+def fingerprint(*objects):
+    """
+    Computes a content hash of DataFrames, arrays and other arguments
+
+    :param objects: objects to hash
+    :return: hex digest string
+    """
+    h = hashlib.sha256()    # usually the fastest hashlib algorithm (hardware accelerated)
+    h.update(str(CACHE_VERSION).encode())
+    for obj in objects:
+        _update_with_object(h, obj)
+    return h.hexdigest()[:40]
+
+
+class DiskCache(object):
+    """
+    Content-addressed, disk-backed memoization of analysis functions. Results are keyed on the function (its name
+    and the code_fingerprint of it and the user code it calls) and a fingerprint of the arguments, so reruns on
+    unchanged data are read back from disk instead of recomputed, across kernel restarts, while editing a helper the
+    function calls invalidates its entries.
+
+    Entries are pickled (protocol 5, which writes numpy buffers as-is) one file per key. Least recently used entries
+    are evicted once the cache grows past max_bytes; a hit refreshes the entry's modification time.
+
+    Usage:
+        cache = DiskCache('.cache')
+        get_data_quality_report = cache.memoize(dex.get_data_quality_report)
+        train_and_score_classifier = cache.memoize(mlm.train_and_score_classifier, unfitted=('classifier', 'sampler'))
+
+    Estimator arguments are keyed on their class, parameters and fitted attributes, so differently fitted models
+    don't share entries. Arguments a function fits itself (the classifier and sampler of train_and_score_classifier)
+    are named in unfitted and keyed on their class and parameters only; otherwise the state left by one call would
+    make every later call with the same object a miss.
+
+    Functions whose side effects matter (e.g. the mapping files written by enumerate_categorical_columns) don't
+    repeat them on a hit, and functions that modify their arguments in place (set_columns_to_category_dtype)
+    shouldn't be memoized.
+    """
+
+    def __init__(self, directory: str='.cache', max_bytes: int=2**30):
+        """
+        :param directory: directory of the cache files (created if needed)
+        :param max_bytes: size of the cache above which least recently used entries are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.function_stats = {}    # function name -> [hits, misses, compute seconds saved by hits]
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._entry_paths())
+
+    def _entry_paths(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.pkl')]
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key: str):
+        """
+        Reads an entry
+
+        :param key: entry key
+        :return: (True, value) for a hit, (False, None) for a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception:
+            # Truncated or unreadable entry: drop it and recompute
+            self._remove(path)
+            return False, None
+        os.utime(path)
+        return True, value
+
+    def set(self, key: str, value):
+        """
+        Writes an entry (atomically, through a temporary file) and evicts old entries if the cache is full
+
+        :param key: entry key
+        :param value: picklable value
+        """
+        path = self._path(key)
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            self._size -= os.path.getsize(path)
+        os.replace(temp_path, path)
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict(self.max_bytes)
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._size -= size
+        except FileNotFoundError:
+            pass
+
+    def evict(self, max_bytes: int):
+        """
+        Removes least recently used entries until the cache holds at most max_bytes
+
+        :param max_bytes: target size of the cache
+        """
+        entries = []
+        for path in self._entry_paths():
+            try:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        self._size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if self._size <= max_bytes:
+                break
+            self._remove(path)
+
+    def clear(self):
+        """Removes every entry."""
+        self.evict(0)
+
+    def key(self, function, args: tuple, kwargs: dict, unfitted: tuple=()):
+        """
+        Cache key of a function call. Arguments are bound to the function's signature with defaults applied, so
+        equivalent positional and keyword calls share an entry.
+
+        :param unfitted: names of the arguments whose estimators are keyed on their class and parameters only
+        :return: hex digest string
+        """
+        try:
+            bound = inspect.signature(function).bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+        except (TypeError, ValueError):
+            arguments = {'args': args, 'kwargs': kwargs}
+        unfitted_arguments = {name: arguments.pop(name) for name in unfitted if name in arguments}
+        return fingerprint('{0}.{1}'.format(function.__module__, function.__qualname__),
+                           code_fingerprint(function), arguments, _Unfitted(unfitted_arguments))
+
+    def memoize(self, function, unfitted: tuple=()):
+        """
+        Wraps a function so its results are read from the cache when called again with the same arguments
+
+        :param function: function to memoize (its result must be picklable)
+        :param unfitted: names of the estimator arguments the function fits itself, keyed on their class and
+         parameters only (e.g. ('classifier', 'sampler') for train_and_score_classifier)
+        :return: memoized function
+        """
+        name = function.__qualname__
+
+        @functools.wraps(function)
+        def memoized(*args, **kwargs):
+            stats = self.function_stats.setdefault(name, [0, 0, 0.])
+            key = self.key(function, args, kwargs, unfitted)
+            hit, value = self.get(key)
+            if hit:
+                self.hits += 1
+                stats[0] += 1
+                stats[2] += value['seconds']
+                return value['result']
+
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            self.set(key, {'result': result, 'seconds': seconds})
+            self.misses += 1
+            stats[1] += 1
+            return result
+
+        memoized.cache = self
+        return memoized
+
+    @property
+    def size(self):
+        """Bytes of the cache entries."""
+        return self._size
+
+    @property
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.
+
+    def stats(self):
+        """
+        Hit-rate statistics since the cache was opened
+
+        :return: pd.DataFrame with hits, misses, hit rate and compute time saved by hits per function, and a total row
+        """
+        rows = dict(self.function_stats)
+        rows['total'] = [self.hits, self.misses, sum(stats[2] for stats in self.function_stats.values())]
+        df = pd.DataFrame.from_dict(rows, orient='index', columns=['hits', 'misses', 'seconds saved'])
+        calls = df['hits'] + df['misses']
+        df['hit rate'] = (df['hits'] / calls.where(calls > 0)).fillna(0.)
+        return df
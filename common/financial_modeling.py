@@ -1,10 +1,13 @@
 import os
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+TRADING_DAYS_PER_YEAR = 252
+
 
 def plot_selected(df, columns, start_index, end_index):
-    data_to_plot = df.ix[start_index:end_index, columns]
+    data_to_plot = df.loc[start_index:end_index, columns]
     plot_data(data_to_plot, title='Selected Data')
 
 
@@ -27,7 +30,7 @@ def get_data(filePath, dates):
 
 
 def normalize_data(df):
-    return df / df.ix[0, :]
+    return df / df.iloc[0, :]
 
 
 def plot_data(df, title='Stock Prices'):
@@ -46,9 +49,275 @@ def fill_missing_values(df_data):
 def compute_daily_returns(df):
     # using pandas
     daily_returns = (df / df.shift(1)) - 1
-    daily_returns.ix[0, :] = 0  # set daily returns for row 0 to 0
+    daily_returns.iloc[0, :] = 0  # set daily returns for row 0 to 0
     return daily_returns
 
+
+##########################################
+#    VECTORIZED PORTFOLIO ANALYTICS      #
+##########################################
+# Every function below works on a whole panel at once: a pd.DataFrame indexed by date with one column per symbol.
+# Functions that walk the time axis accept an optional chunk_size so very long histories can be processed in
+# bounded memory.
+
+def _panel_values(df: pd.DataFrame):
+    """Return the panel as a 2D float64 array (dates x symbols)."""
+    return np.asarray(df, dtype=np.float64).reshape(df.shape[0], -1)
+
+
+def _chunk_bounds(num_rows: int, chunk_size: int=None):
+    """Yield (start, stop) row bounds covering num_rows in chunks of chunk_size (one chunk if not specified)."""
+    if chunk_size is None or chunk_size <= 0:
+        chunk_size = max(num_rows, 1)
+    for start in range(0, num_rows, chunk_size):
+        yield start, min(start + chunk_size, num_rows)
+
+
+def _rolling_sum(values: np.ndarray, window: int):
+    """
+    Rolling sum over the first axis using a cumulative sum. Windows containing a NaN are NaN, matching pandas'
+    default min_periods behaviour.
+
+    :param values: array whose first axis is time
+    :param window: number of rows in each window
+    :return: array of the same shape as values; the first window-1 rows are NaN
+    """
+    valid = np.isfinite(values)
+    zero_row = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([zero_row, np.cumsum(np.where(valid, values, 0), axis=0)])
+    counts = np.concatenate([zero_row, np.cumsum(valid, axis=0)])
+
+    rolled = np.full(values.shape, np.nan)
+    if values.shape[0] >= window:
+        window_sums = sums[window:] - sums[:-window]
+        window_counts = counts[window:] - counts[:-window]
+        rolled[window - 1:] = np.where(window_counts == window, window_sums, np.nan)
+    return rolled
+
+
+def compute_returns(df: pd.DataFrame, log: bool=False):
+    """
+    Computes period returns for every symbol in the panel. The first row is set to 0, as in compute_daily_returns.
+
+    :param df: pd.DataFrame of prices (dates x symbols)
+    :param log: flag to compute log returns instead of simple returns
+    :return: pd.DataFrame of returns
+    """
+    prices = _panel_values(df)
+    returns = np.zeros_like(prices)
+    if log:
+        returns[1:] = np.log(prices[1:] / prices[:-1])
+    else:
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    return pd.DataFrame(returns, index=df.index, columns=df.columns)
+
+
+def compute_cumulative_returns(returns: pd.DataFrame):
+    """
+    Computes cumulative returns from period returns. Missing returns are treated as 0.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :return: pd.DataFrame of cumulative returns
+    """
+    growth = np.cumprod(1 + np.nan_to_num(_panel_values(returns)), axis=0)
+    return pd.DataFrame(growth - 1, index=returns.index, columns=returns.columns)
+
+
+def compute_rolling_volatility(returns: pd.DataFrame, window: int=20, annualize: bool=True, chunk_size: int=None):
+    """
+    Computes rolling sample standard deviation of returns for every symbol.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param window: number of periods in each window
+    :param annualize: flag to scale volatility by sqrt(TRADING_DAYS_PER_YEAR)
+    :param chunk_size: number of rows processed at a time; bounds memory for long histories
+    :return: pd.DataFrame of rolling volatility (first window-1 rows are NaN)
+    """
+    values = _panel_values(returns)
+    volatility = np.full(values.shape, np.nan)
+
+    for start, stop in _chunk_bounds(values.shape[0], chunk_size):
+        # Each chunk carries window-1 rows of history so its first rolling window is complete
+        history_start = max(start - window + 1, 0)
+        block = values[history_start:stop]
+        sums = _rolling_sum(block, window)
+        sums_sq = _rolling_sum(block ** 2, window)
+        variance = np.maximum(sums_sq - sums ** 2 / window, 0) / (window - 1)
+        volatility[start:stop] = np.sqrt(variance[start - history_start:])
+
+    if annualize:
+        volatility *= np.sqrt(TRADING_DAYS_PER_YEAR)
+    return pd.DataFrame(volatility, index=returns.index, columns=returns.columns)
+
+
+def compute_ewma_volatility(returns: pd.DataFrame, decay: float=.94, annualize: bool=True, block_size: int=128):
+    """
+    Computes exponentially weighted (RiskMetrics) volatility for every symbol:
+        var[t] = decay * var[t-1] + (1 - decay) * r[t]^2
+
+    The recursion is evaluated block_size rows at a time with a closed form, so the whole panel is updated with
+    array operations instead of one Python step per row. Missing returns are treated as 0.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param decay: weight given to the previous variance (lambda)
+    :param annualize: flag to scale volatility by sqrt(TRADING_DAYS_PER_YEAR)
+    :param block_size: rows per closed-form block; kept small so decay^-block_size does not overflow
+    :return: pd.DataFrame of EWMA volatility
+    """
+    squared = np.nan_to_num(_panel_values(returns)) ** 2
+    variance = np.empty_like(squared)
+    prev_variance = np.zeros(squared.shape[1:])
+
+    for start, stop in _chunk_bounds(squared.shape[0], block_size):
+        steps = np.arange(stop - start, dtype=np.float64).reshape((-1,) + (1,) * (squared.ndim - 1))
+        decay_pow = decay ** steps
+        weighted = np.cumsum(squared[start:stop] / decay_pow, axis=0)
+        variance[start:stop] = decay_pow * (decay * prev_variance + (1 - decay) * weighted)
+        prev_variance = variance[stop - 1]
+
+    volatility = np.sqrt(variance)
+    if annualize:
+        volatility *= np.sqrt(TRADING_DAYS_PER_YEAR)
+    return pd.DataFrame(volatility, index=returns.index, columns=returns.columns)
+
+
+def compute_drawdowns(returns: pd.DataFrame, chunk_size: int=None):
+    """
+    Computes the drawdown (percent below the running peak) of each symbol at every date. Missing returns are
+    treated as 0.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param chunk_size: number of rows processed at a time; bounds memory for long histories
+    :return: pd.DataFrame of drawdowns (values <= 0)
+    """
+    values = np.nan_to_num(_panel_values(returns))
+    drawdowns = np.empty_like(values)
+    wealth = np.ones(values.shape[1])
+    peak = np.ones(values.shape[1])
+
+    for start, stop in _chunk_bounds(values.shape[0], chunk_size):
+        chunk_wealth = wealth * np.cumprod(1 + values[start:stop], axis=0)
+        chunk_peak = np.maximum(np.maximum.accumulate(chunk_wealth, axis=0), peak)
+        drawdowns[start:stop] = chunk_wealth / chunk_peak - 1
+        wealth, peak = chunk_wealth[-1], chunk_peak[-1]
+
+    return pd.DataFrame(drawdowns, index=returns.index, columns=returns.columns)
+
+
+def compute_max_drawdown(returns: pd.DataFrame, chunk_size: int=None):
+    """
+    Computes the maximum drawdown of each symbol.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param chunk_size: number of rows processed at a time; bounds memory for long histories
+    :return: pd.Series of max drawdown per symbol (values <= 0)
+    """
+    return compute_drawdowns(returns, chunk_size).min()
+
+
+def compute_sharpe_ratio(returns: pd.DataFrame, risk_free_rate: float=0, periods_per_year: int=TRADING_DAYS_PER_YEAR):
+    """
+    Computes the annualized Sharpe ratio of each symbol, ignoring missing returns.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param risk_free_rate: risk free rate per period
+    :param periods_per_year: number of return periods in a year
+    :return: pd.Series of Sharpe ratios
+    """
+    excess = _panel_values(returns) - risk_free_rate
+    sharpe = np.nanmean(excess, axis=0) / np.nanstd(excess, axis=0, ddof=1) * np.sqrt(periods_per_year)
+    return pd.Series(sharpe, index=returns.columns)
+
+
+def compute_sortino_ratio(returns: pd.DataFrame, risk_free_rate: float=0, periods_per_year: int=TRADING_DAYS_PER_YEAR):
+    """
+    Computes the annualized Sortino ratio of each symbol (mean excess return over downside deviation), ignoring
+    missing returns.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param risk_free_rate: risk free rate per period
+    :param periods_per_year: number of return periods in a year
+    :return: pd.Series of Sortino ratios
+    """
+    excess = _panel_values(returns) - risk_free_rate
+    downside_deviation = np.sqrt(np.nanmean(np.minimum(excess, 0) ** 2, axis=0))
+    sortino = np.nanmean(excess, axis=0) / downside_deviation * np.sqrt(periods_per_year)
+    return pd.Series(sortino, index=returns.columns)
+
+
+def compute_beta(returns: pd.DataFrame, benchmark_returns: pd.Series):
+    """
+    Computes the beta of each symbol to a benchmark, using only the dates where both returns are present.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param benchmark_returns: pd.Series of benchmark returns aligned to the same dates
+    :return: pd.Series of betas
+    """
+    values = _panel_values(returns)
+    benchmark = np.asarray(benchmark_returns.reindex(returns.index), dtype=np.float64)[:, np.newaxis]
+
+    # Pairwise-complete observations for each symbol
+    mask = np.isfinite(values) & np.isfinite(benchmark)
+    counts = mask.sum(axis=0)
+    values = np.where(mask, values, 0)
+    benchmark = np.where(mask, benchmark, 0)
+
+    values_centered = np.where(mask, values - values.sum(axis=0) / counts, 0)
+    benchmark_centered = np.where(mask, benchmark - benchmark.sum(axis=0) / counts, 0)
+    covariance = (values_centered * benchmark_centered).sum(axis=0)
+    benchmark_variance = (benchmark_centered ** 2).sum(axis=0)
+
+    return pd.Series(covariance / benchmark_variance, index=returns.columns)
+
+
+def iter_rolling_correlation(returns: pd.DataFrame, window: int=20, chunk_size: int=1000):
+    """
+    Yields rolling correlation matrices chunk by chunk, so only chunk_size matrices are held in memory at once.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param window: number of periods in each window
+    :param chunk_size: number of dates per yielded chunk
+    :return: generator of (pd.Index of dates, np.ndarray of shape (len(dates), symbols, symbols))
+    """
+    values = _panel_values(returns)
+
+    for start, stop in _chunk_bounds(values.shape[0], chunk_size):
+        history_start = max(start - window + 1, 0)
+        block = values[history_start:stop]
+
+        sums = _rolling_sum(block, window)
+        sums_sq = _rolling_sum(block ** 2, window)
+        sums_cross = _rolling_sum(block[:, :, np.newaxis] * block[:, np.newaxis, :], window)
+
+        covariance = sums_cross - sums[:, :, np.newaxis] * sums[:, np.newaxis, :] / window
+        std = np.sqrt(np.maximum(sums_sq - sums ** 2 / window, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = covariance / (std[:, :, np.newaxis] * std[:, np.newaxis, :])
+
+        yield returns.index[start:stop], np.clip(correlation[start - history_start:], -1, 1)
+
+
+def compute_rolling_correlation(returns: pd.DataFrame, window: int=20, chunk_size: int=None, out: np.ndarray=None):
+    """
+    Computes the rolling correlation matrix between all symbols at every date.
+
+    :param returns: pd.DataFrame of period returns (dates x symbols)
+    :param window: number of periods in each window
+    :param chunk_size: number of dates processed at a time; bounds the working memory for long histories
+    :param out: optional preallocated array (e.g. np.memmap) of shape (dates, symbols, symbols) to write into
+    :return: np.ndarray of shape (dates, symbols, symbols); the first window-1 matrices are NaN
+    """
+    num_rows, num_symbols = returns.shape[0], returns.shape[1]
+    if out is None:
+        out = np.empty((num_rows, num_symbols, num_symbols))
+
+    start = 0
+    for dates, correlation in iter_rolling_correlation(returns, window, chunk_size or num_rows):
+        out[start:start + len(dates)] = correlation
+        start += len(dates)
+    return out
+
+
 '''
 def test_run():
     # Define a date range
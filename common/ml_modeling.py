@@ -1,5 +1,7 @@
 from decimal import Decimal
+import numpy as np
 import pandas as pd
+from sklearn.base import clone
 from sklearn.model_selection import KFold, StratifiedKFold
 from sklearn.metrics import accuracy_score, roc_curve, auc, precision_score, recall_score, f1_score
 
@@ -18,10 +20,17 @@ def _get_min_significant_precision(df: pd.DataFrame):
     :return: Minimum number of decimal places required to represent the smallest piece of data in the dataset
     """
 
-    # Count number of rows
-    num_rows = df.shape[0]
+    return _get_min_significant_precision_for_rows(df.shape[0])
+
+def _get_min_significant_precision_for_rows(num_rows: int):
+    """
+    Same as _get_min_significant_precision, given the number of rows rather than the data
+
+    :param num_rows: number of records in the dataset
+    :return: Minimum number of decimal places required to represent the smallest piece of data in the dataset
+    """
     # Get significance of single row, save as string
-    row_significance_string = str(1.0 / num_rows)
+    row_significance_string = np.format_float_positional(1.0 / num_rows)
     # Parse string and count number of leading, significant zeros
     start_index = row_significance_string.index('.') + 1
     num_zeros = 0
@@ -117,29 +126,184 @@ def train_and_score_classifier(classifier, df: pd.DataFrame, labels: pd.DataFram
     avg_f1 = round(Decimal(sum(f1_scores) / len(f1_scores)), PRECISION)
     avg_time = sum(time_to_train_and_predict)/len(time_to_train_and_predict)
     
-    if print_results:
-        horizontal_bar = '=' * (len(description)+4)
-        description_line = '= ' + description + ' ='
-        print(horizontal_bar)
-        print(description_line)
-        print(horizontal_bar)
-        print('Accuracy:\t', avg_acc)
-        print('AUC:\t\t', avg_auc)
-        print('Precision:\t', avg_precision)
-        print('Recall:\t\t', avg_recall)
-        print('F1:\t\t', avg_f1)
-        print('Average time to train: ', Stopwatch.get_formatted_time(avg_time))
-        print('\n')
-    
     metrics = {"accuracy": avg_acc,
                "auc": avg_auc,
                "precision": avg_precision,
                "recall": avg_recall,
                "f1": avg_f1,
                "average_training_time": avg_time}
+
+    if print_results:
+        _print_results(metrics, description)
     
     return classifier, metrics
 
+def _print_results(metrics: dict, description: str):
+    horizontal_bar = '=' * (len(description)+4)
+    description_line = '= ' + description + ' ='
+    print(horizontal_bar)
+    print(description_line)
+    print(horizontal_bar)
+    print('Accuracy:\t', metrics['accuracy'])
+    print('AUC:\t\t', metrics['auc'])
+    print('Precision:\t', metrics['precision'])
+    print('Recall:\t\t', metrics['recall'])
+    print('F1:\t\t', metrics['f1'])
+    print('Average time to train: ', Stopwatch.get_formatted_time(metrics['average_training_time']))
+    print('\n')
+
+def _get_fold_ids(rows: np.ndarray, num_rows: int, n_folds: int, shuffle: bool, seed: int):
+    """
+    Computes the kfolds fold of each row from its position alone, so folds never have to be materialized as index
+    arrays. Without shuffling, folds are the contiguous blocks of KFold. With shuffling, each row is hashed
+    (splitmix64) with the seed into a fold, which gives folds of (almost exactly) equal size.
+
+    :param rows: np.ndarray of row positions
+    :param num_rows: number of rows in the dataset
+    :param n_folds: number of folds
+    :param shuffle: flag indicating to assign rows to folds pseudo-randomly
+    :param seed: seed of the pseudo-random assignment
+    :return: np.ndarray of fold numbers (0 to n_folds - 1), one per row
+    """
+    if not shuffle:
+        fold_sizes = np.full(n_folds, num_rows // n_folds)
+        fold_sizes[:num_rows % n_folds] += 1
+        return np.searchsorted(np.cumsum(fold_sizes), rows, side='right')
+
+    with np.errstate(over='ignore'):
+        z = rows.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z % np.uint64(n_folds)).astype(np.int64)
+
+def _iter_chunks(data, labels, chunk_size: int):
+    """
+    Yields (features, labels) np.ndarray chunks of a dataset
+
+    :param data: 2-D array-like (np.ndarray, np.memmap, pd.DataFrame) or a function returning an iterable of
+     (features, labels) chunks
+    :param labels: 1-D array-like of labels (ignored when data is a function)
+    :param chunk_size: number of rows per chunk of array-like data
+    """
+    if callable(data):
+        for x, y in data():
+            yield np.asarray(x), np.asarray(y)
+    else:
+        rows = data.iloc if hasattr(data, 'iloc') else data
+        label_rows = labels.iloc if hasattr(labels, 'iloc') else labels
+        for start in range(0, data.shape[0], chunk_size):
+            yield np.asarray(rows[start:start + chunk_size]), np.asarray(label_rows[start:start + chunk_size])
+
+def train_and_score_classifier_out_of_core(classifier, data, labels, pos_label: int, n_folds: int=5, shuffle: bool=True, chunk_size: int=100000, n_epochs: int=1, classes: list=None, random_state: int=None, print_results: bool=True, description: str='Results'):
+    """
+    Out-of-core version of train_and_score_classifier for datasets that don't fit in memory. The data is read one
+    chunk at a time, from memory-mapped arrays or from a chunked source such as
+        lambda: ((chunk[features].values, chunk['class'].values) for chunk in pd.read_csv(path, chunksize=100000))
+
+    Fold membership is computed from row positions, one chunk at a time. One model per fold is trained with
+    partial_fit on the chunk rows outside its fold (n_epochs passes), then a final pass predicts each fold's rows
+    with its model and accumulates the confusion counts each metric is computed from. The data is read
+    n_epochs + 1 times in all, whatever the number of folds. Metrics are averaged across the kfolds as in
+    train_and_score_classifier; AUC is computed from the hard predictions as well.
+
+    Resampling isn't supported, since samplers need the whole training set.
+
+    :param classifier: instantiated classifier object supporting partial_fit (e.g. GaussianNB, SGDClassifier)
+    :param data: 2-D np.ndarray/np.memmap/pd.DataFrame, or a function returning an iterable of (features, labels)
+     chunks (the same chunks in the same order on every call)
+    :param labels: labels corresponding to the rows of data (None when data is a function)
+    :param pos_label: label value considered 'positive' (used for scoring)
+    :param n_folds: number of folds to use when splitting the input data into test/train groups
+    :param shuffle: flag indicating to randomly split data during kfolds
+    :param chunk_size: number of rows read at a time from array data
+    :param n_epochs: number of partial_fit passes over the training data
+    :param classes: list of all label values (found with an extra pass over the labels if not given)
+    :param random_state: seed of the random fold assignment
+    :param print_results: flag determining whether or not results should be printed
+    :param description: description of model being trained; will be displayed if results are printed
+    :return: the classifier (trained on the last fold's training data) and the metrics of train_and_score_classifier
+    """
+    if not hasattr(classifier, 'partial_fit'):
+        raise Exception("Out-of-core training requires a classifier with partial_fit.")
+
+    # Number of rows and classes, when they can't be read off the arrays
+    if callable(data):
+        num_rows = 0
+        found_classes = set()
+        for x, y in _iter_chunks(data, labels, chunk_size):
+            num_rows += len(y)
+            if classes is None:
+                found_classes.update(np.unique(y).tolist())
+        if classes is None:
+            classes = sorted(found_classes)
+    else:
+        num_rows = data.shape[0]
+        if classes is None:
+            classes = np.unique(np.asarray(labels))
+    classes = np.asarray(classes)
+
+    PRECISION = _get_min_significant_precision_for_rows(num_rows)
+    seed = np.random.randint(2**31) if random_state is None else random_state
+
+    # One model per fold; the classifier passed in becomes the last fold's model
+    models = [clone(classifier) for fold in range(n_folds - 1)] + [classifier]
+    time_to_train_and_predict = np.zeros(n_folds)
+
+    for epoch in range(n_epochs):
+        first_row = 0
+        for x, y in _iter_chunks(data, labels, chunk_size):
+            folds = _get_fold_ids(np.arange(first_row, first_row + len(y)), num_rows, n_folds, shuffle, seed)
+            first_row += len(y)
+            for fold, model in enumerate(models):
+                train = folds != fold
+                if train.any():
+                    Stopwatch.start()
+                    model.partial_fit(x[train], y[train], classes=classes)
+                    Stopwatch.stop()
+                    time_to_train_and_predict[fold] += Stopwatch.get_time_elapsed()
+
+    # Confusion counts of each fold: true positives, false positives, true negatives, false negatives
+    confusion = np.zeros((n_folds, 4), dtype=np.int64)
+    first_row = 0
+    for x, y in _iter_chunks(data, labels, chunk_size):
+        folds = _get_fold_ids(np.arange(first_row, first_row + len(y)), num_rows, n_folds, shuffle, seed)
+        first_row += len(y)
+        for fold, model in enumerate(models):
+            test = folds == fold
+            if test.any():
+                Stopwatch.start()
+                predictions = model.predict(x[test])
+                Stopwatch.stop()
+                time_to_train_and_predict[fold] += Stopwatch.get_time_elapsed()
+
+                actual = y[test] == pos_label
+                predicted = predictions == pos_label
+                confusion[fold] += [np.count_nonzero(actual & predicted), np.count_nonzero(~actual & predicted),
+                                    np.count_nonzero(~actual & ~predicted), np.count_nonzero(actual & ~predicted)]
+
+    # Per-fold metrics from the counts (0 where undefined, as sklearn does)
+    tp, fp, tn, fn = confusion.T.astype(np.float64)
+    def ratio(numerator, denominator):
+        return np.divide(numerator, denominator, out=np.zeros(n_folds), where=denominator > 0)
+    acc_scores = ratio(tp + tn, tp + fp + tn + fn)
+    precision_scores = ratio(tp, tp + fp)
+    recall_scores = ratio(tp, tp + fn)
+    f1_scores = ratio(2 * tp, 2 * tp + fp + fn)
+    auc_scores = (recall_scores + ratio(tn, tn + fp)) / 2
+
+    metrics = {"accuracy": round(Decimal(acc_scores.mean()), PRECISION),
+               "auc": round(Decimal(auc_scores.mean()), PRECISION),
+               "precision": round(Decimal(precision_scores.mean()), PRECISION),
+               "recall": round(Decimal(recall_scores.mean()), PRECISION),
+               "f1": round(Decimal(f1_scores.mean()), PRECISION),
+               "average_training_time": float(time_to_train_and_predict.mean())}
+
+    if print_results:
+        _print_results(metrics, description)
+
+    return classifier, metrics
+
 def show_precision_recall_curve(classifier, x_test: pd.DataFrame, y_test: pd.DataFrame):
     """
     Displays precision-recall curve for a trained classifier and test dataset